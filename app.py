@@ -1,18 +1,36 @@
 #!/usr/bin/env python3
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, g, render_template, jsonify, request
 from flask_cors import CORS
-import asyncio
-from datetime import datetime, UTC
-from sqlalchemy import func
-from database_multiuser import DatabaseManager, Game, Move
-from main import BlunderTracker
+from sqlalchemy import case, func, literal
+from database_multiuser import (Game, Move, OpeningNode, QUALITY_FULL, QUALITY_LEVELS, UNKNOWN_POSITION,
+                                from_signed64, shared_db_manager)
+from downsampling import lttb, parse_point_limit
+from pagination import InvalidCursor, filter_played_between, paginate_newest_first, parse_page_size
+from response_cache import ResponseCache
+from columnar import COLUMNS_MIMETYPE, choose_encoding, dumps, encode_body, wants_columns
+from progress_events import ProgressBroker, StatusPoller, format_event
+from job_queue import JobQueue
+from scheduler import MAX_RUNNING_ANALYSES, engine_slot_count
+from worker_protocol import ProtocolError, RemoteWorkerServer, check_token
+import metrics
+import opening_tree
+import sql_profiler
+import queue
 import threading
+import time
+import functools
+import hashlib
+import io
 import json
 import os
 
 # Initialize database manager
-db_manager = DatabaseManager()
+db_manager = shared_db_manager()
+response_cache = ResponseCache()
+progress_broker = ProgressBroker()
+job_queue = JobQueue()
+remote_workers = RemoteWorkerServer(job_queue, db_manager)
 
 app = Flask(__name__, static_folder='frontend/build', static_url_path='')
 CORS(app)  # Allow all origins for development
@@ -26,58 +44,225 @@ def serve_frontend():
     else:
         return "Frontend not built. Run 'cd frontend && npm run build' first."
 
-# Per-user operation tracking and resource management
-user_operations = {}
-MAX_CONCURRENT_ANALYSES = 2  # Limit concurrent Stockfish engines to prevent CPU overload
+# Per-user operation tracking and resource management; all of it lives in the shared
+# control database (jobs.db), so any number of web processes can serve requests
+MAX_CONCURRENT_ANALYSES = MAX_RUNNING_ANALYSES  # Engine slots across all workers
 USER_TIMEOUT_SECONDS = 60  # Timeout user operations after this much inactivity
+STREAM_KEEPALIVE_SECONDS = 15  # Comment sent on idle progress streams; also refreshes activity
+MAINTENANCE_INTERVAL_SECONDS = 15  # How often inactive users are checked
+STREAM_POLL_SECONDS = 1.0  # How often the status of users with open streams is re-read from the queue
+# Analysis workers started inside the web process; 0 when running worker.py separately
+EMBEDDED_WORKERS = int(os.environ.get('BLUNDER_EMBEDDED_WORKERS', engine_slot_count()))
 
 def get_user_status(username):
-    """Get or create operation status for a specific user"""
-    if username not in user_operations:
-        user_operations[username] = {
-            'fetching': False,
-            'analyzing': False,
-            'last_operation': None,
-            'progress': {},
-            'last_active': datetime.now(UTC),
-        }
-    return user_operations[username]
+    """Get operation status for a specific user from the job queue"""
+    return job_queue.get_operation_status(username, MAX_CONCURRENT_ANALYSES)
+
+def publish_status(username):
+    """Push the user's current operation status to their open progress streams"""
+    progress_broker.publish(username, 'status', get_user_status(username))
 
 def update_user_activity(username):
     """Update the last active timestamp for a user"""
-    if username in user_operations:
-        user_operations[username]['last_active'] = datetime.now(UTC)
+    job_queue.touch_user(username)
+
+# Open progress streams keep their users active through this poller
+status_poller = StatusPoller(progress_broker, get_user_status, update_user_activity,
+                             interval=STREAM_POLL_SECONDS, touch_seconds=STREAM_KEEPALIVE_SECONDS)
 
 def cleanup_inactive_users():
-    """Cleanup users that have been inactive for too long"""
-    now = datetime.now(UTC)
-    to_remove = []
-    
-    for username, status in user_operations.items():
-        # Only cleanup users that are not actively analyzing or fetching
-        if not status.get('analyzing') and not status.get('fetching'):
-            inactive_seconds = (now - status['last_active']).total_seconds()
-            if inactive_seconds > USER_TIMEOUT_SECONDS:
-                to_remove.append(username)
+    """Cleanup users that have been inactive for too long
+
+    Safe to run from every web process at once: each step is a conditional UPDATE
+    or DELETE in the control database.
+    """
+    # Nobody is watching: drop queued jobs and stop running ones at the next ply
+    for username in job_queue.get_inactive_users(USER_TIMEOUT_SECONDS * 3):
+        if job_queue.request_cancel(username, 'inactive', include_background=False):
+            print(f"[INFO] Cancelling jobs for inactive user: {username}")
     
-    # Remove the inactive users
-    for username in to_remove:
+    # Only cleanup users that are not actively analyzing or fetching
+    removed = [username for username in job_queue.get_inactive_users(USER_TIMEOUT_SECONDS)
+               if job_queue.forget_user(username, USER_TIMEOUT_SECONDS)]
+    for username in removed:
         print(f"[INFO] Removing inactive user: {username}")
-        del user_operations[username]
     
-    return to_remove
+    # Release database handles nobody has touched recently
+    db_manager.evict_idle()
+    
+    return removed
+
+# Time control strings grouped into the four categories shown in the UI
+TIME_CONTROL_CATEGORIES = {
+    # Bullet: 120+1 and below (60+0, 60+1, 120+1, etc.)
+    'bullet': ['60+0', '60+1', '120+1', '180+0'],
+    # Blitz: 3+2 to 5+3 typically (but exclude bullet range)
+    'blitz': ['180+2', '300+0', '300+3'],
+    # Rapid: 10-30 minute games
+    'rapid': ['600+0', '600+5', '900+10', '1800+0'],
+    # Classical: 30+ minute games
+    'classical': ['1800+0', '1800+30', '3600+0'],
+}
+
+def filter_time_control(query, time_control, column=Game.time_control):
+    """Restrict a query to a time control category or exact value"""
+    if not time_control or time_control == 'All':
+        return query
+    if time_control in TIME_CONTROL_CATEGORIES:
+        return query.filter(column.in_(TIME_CONTROL_CATEGORIES[time_control]))
+    # Exact time control match (for backwards compatibility)
+    return query.filter(column == time_control)
+
+def filter_quality(query, quality, column=Move.analysis_quality):
+    """Restrict moves to those analyzed at least at a quality level ('quick' or 'full')"""
+    if not quality:
+        return query
+    return query.filter(column >= QUALITY_LEVELS[quality])
+
+def invalid_quality(quality):
+    """Error response for an unknown quality parameter, or None"""
+    if quality and quality not in QUALITY_LEVELS:
+        return jsonify({'error': f'quality must be one of {", ".join(QUALITY_LEVELS)}'}), 400
+    return None
+
+def versioned_json(extra=None):
+    """Serve a read endpoint from the response cache with a data-version ETag
+
+    The wrapped view returns a JSON-ready body (or an error tuple). Bodies are
+    cached per user, data version and query string; `extra` adds fields that
+    change independently of the data, such as operation status. Responses use
+    the columnar layout when asked for and are compressed when accepted; without
+    `extra`, the encoded bytes are cached too.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            username = request.args.get('username', 'default')
+            if not username:
+                return view(*args, **kwargs)
+            
+            update_user_activity(username)
+            db = db_manager.get_db(username)
+            try:
+                version = db_manager.get_data_version(username)
+            finally:
+                db.close()
+            
+            key = (request.endpoint, username, version, tuple(sorted(request.args.items(multi=True))))
+            columns = wants_columns(request)
+            encoding = choose_encoding(request)
+            extra_fields = extra(username) if extra else {}
+            # Each layout and content coding is a separate representation with its own tag
+            etag = hashlib.sha1(json.dumps([key, columns, encoding, extra_fields], default=str).encode()).hexdigest()
+            if etag in request.if_none_match:
+                response_cache.record_not_modified()
+                response = app.response_class(status=304)
+                response.set_etag(etag)
+                response.cache_control.no_cache = True
+                response.vary.update(('Accept', 'Accept-Encoding'))
+                return response
+            
+            encoded_key = key + (columns, encoding)
+            encoded = None if extra_fields else response_cache.get(encoded_key)
+            if encoded is None:
+                body = response_cache.get(key)
+                if body is None:
+                    body = view(*args, **kwargs)
+                    if isinstance(body, tuple):
+                        return body  # Errors are neither cached nor tagged
+                    # Sized by its JSON; the cache is bounded in bytes, not entries
+                    response_cache.put(key, body, len(dumps(body)))
+                encoded = encode_body({**body, **extra_fields} if extra_fields else body, columns, encoding)
+                if not extra_fields:
+                    response_cache.put(encoded_key, encoded, len(encoded[0]))
+            
+            payload, content_encoding = encoded
+            response = app.response_class(payload, mimetype=COLUMNS_MIMETYPE if columns else 'application/json')
+            if content_encoding:
+                response.headers['Content-Encoding'] = content_encoding
+            response.set_etag(etag)
+            # Browsers then revalidate every poll with If-None-Match
+            response.cache_control.no_cache = True
+            response.vary.update(('Accept', 'Accept-Encoding'))
+            return response
+        return wrapper
+    return decorator
+
+def maintenance_loop():
+    """Periodically cancel abandoned work and release idle resources"""
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            cleanup_inactive_users()
+        except Exception as e:
+            print(f"[ERROR] Maintenance failed: {e}")
+
+_maintenance_started = threading.Event()
+
+@app.before_request
+def start_maintenance():
+    """Start the maintenance thread with the first request, under any WSGI server"""
+    if not _maintenance_started.is_set():
+        _maintenance_started.set()
+        threading.Thread(target=maintenance_loop, name='maintenance', daemon=True).start()
+
+@app.before_request
+def start_request_metrics():
+    """Attribute this request's SQL statements to its route and start its timer"""
+    g.metrics_started = time.perf_counter()
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_endpoint_token = metrics.current_endpoint.set(g.metrics_route)
+    # A profile opened by the caller (e.g. sql_profiler.count_queries) keeps collecting
+    if sql_profiler.SQL_PROFILE and sql_profiler.current_profile() is None:
+        g.sql_profile_token = sql_profiler.start_profile()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and record its latency (for streams, the time to the first byte)"""
+    if 'metrics_started' in g:
+        metrics.HTTP_REQUESTS.inc(route=g.metrics_route, method=request.method, status=response.status_code)
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_started, route=g.metrics_route)
+    profile = sql_profiler.current_profile()
+    if sql_profiler.SQL_PROFILE and profile is not None:
+        response.headers.update(profile.headers())
+    return response
+
+@app.teardown_request
+def reset_request_metrics(exc):
+    if 'sql_profile_token' in g:
+        sql_profiler.stop_profile(g.sql_profile_token)
+    if 'metrics_endpoint_token' in g:
+        metrics.current_endpoint.reset(g.metrics_endpoint_token)
+
+def queue_depth_samples():
+    """Unfinished jobs per kind and state, read from the queue at scrape time"""
+    return [({'kind': kind, 'state': state}, count) for (kind, state), count in job_queue.count_by_state().items()]
+
+def database_pool_samples():
+    return [({'stat': stat}, value) for stat, value in db_manager.get_pool_stats().items()]
+
+metrics.REGISTRY.gauge('blunder_queue_jobs', 'Jobs waiting or running', ('kind', 'state'), callback=queue_depth_samples)
+metrics.REGISTRY.gauge('blunder_engine_slots', 'Engines that can run at once',
+                       callback=lambda: [({}, MAX_CONCURRENT_ANALYSES)])
+metrics.REGISTRY.gauge('blunder_databases', 'User database cache counters', ('stat',), callback=database_pool_samples)
 
 def get_active_analyses_count():
-    """Count how many users are currently analyzing"""
-    return sum(1 for ops in user_operations.values() if ops.get('analyzing', False))
+    """Count users with analysis work queued or running across all workers"""
+    return job_queue.count_active('analyze')
 
 @app.route('/api/stats')
+@versioned_json(extra=lambda username: {'operation_status': get_user_status(username)})
 def get_stats():
     """Get comprehensive game statistics"""
     username = request.args.get('username', 'default')
     if not username:
         return jsonify({'error': 'Username is required'}), 400
         
+    # Optional: only count moves analyzed at this quality
+    quality = request.args.get('quality')
+    if invalid_quality(quality):
+        return invalid_quality(quality)
+        
     # Update user activity timestamp
     update_user_activity(username)
     db = db_manager.get_db(username)
@@ -85,7 +270,7 @@ def get_stats():
     try:
         # Base queries
         games_query = db.query(Game)
-        moves_query = db.query(Move)
+        moves_query = filter_quality(db.query(Move), quality)
         
         # Apply time control filter if specified
         time_control_filter = request.args.get('time_control')
@@ -97,6 +282,10 @@ def get_stats():
         total_games = games_query.count()
         analyzed_games = games_query.filter(Game.fully_analyzed == True).count()
         unanalyzed_games = total_games - analyzed_games
+        # Analyzed by the quick sweep only, still waiting for full depth
+        provisional_games = games_query.filter(
+            Game.fully_analyzed == True, func.coalesce(Game.analysis_quality, QUALITY_FULL) < QUALITY_FULL
+        ).count()
         
         # Get latest and oldest game dates
         latest_game = games_query.order_by(Game.played_at.desc()).first()
@@ -116,48 +305,42 @@ def get_stats():
         # Time control breakdown (always show all time controls)
         time_controls = db.query(Game.time_control, func.count(Game.id)).group_by(Game.time_control).all()
         
+        # Move counts per time control from one grouped join, summed into categories below
+        move_counts = {
+            tc: (moves, blunders or 0, mistakes or 0)
+            for tc, moves, blunders, mistakes in filter_quality(db.query(
+                Game.time_control,
+                func.count(Move.id),
+                func.sum(case((Move.is_blunder == True, 1), else_=0)),
+                func.sum(case((Move.is_mistake == True, 1), else_=0))
+            ).select_from(Move).join(Game, Move.game_lichess_id == Game.lichess_id), quality).group_by(Game.time_control).all()
+        }
+        game_counts = dict(time_controls)
+        
         # Time control specific stats for comparison
         time_control_stats = {}
-        for tc_name in ['bullet', 'blitz', 'rapid', 'classical']:
-            # Match time controls by common patterns
-            tc_filter = None
-            if tc_name == 'bullet':
-                # Bullet: 120+1 and below (60+0, 60+1, 120+1, etc.)
-                tc_filter = (Game.time_control.in_(['60+0', '60+1', '120+1', '180+0']))
-            elif tc_name == 'blitz':
-                # Blitz: 3+2 to 5+3 typically (but exclude bullet range)
-                tc_filter = (Game.time_control.in_(['180+2', '300+0', '300+3']))
-            elif tc_name == 'rapid':
-                # Rapid: 10-30 minute games
-                tc_filter = (Game.time_control.in_(['600+0', '600+5', '900+10', '1800+0']))
-            elif tc_name == 'classical':
-                # Classical: 30+ minute games
-                tc_filter = (Game.time_control.in_(['1800+0', '1800+30', '3600+0']))
+        for tc_name, tc_values in TIME_CONTROL_CATEGORIES.items():
+            tc_games = sum(game_counts.get(tc, 0) for tc in tc_values)
+            tc_moves = sum(move_counts.get(tc, (0, 0, 0))[0] for tc in tc_values)
+            tc_blunders = sum(move_counts.get(tc, (0, 0, 0))[1] for tc in tc_values)
+            tc_mistakes = sum(move_counts.get(tc, (0, 0, 0))[2] for tc in tc_values)
             
-            if tc_filter is not None:
-                # Count games with this time control
-                tc_games = db.query(Game).filter(tc_filter).count()
-                
-                # Count moves from games with this time control - need to join properly
-                tc_moves = db.query(Move).join(Game, Move.game_lichess_id == Game.lichess_id).filter(tc_filter).count()
-                tc_blunders = db.query(Move).join(Game, Move.game_lichess_id == Game.lichess_id).filter(tc_filter, Move.is_blunder == True).count()
-                tc_mistakes = db.query(Move).join(Game, Move.game_lichess_id == Game.lichess_id).filter(tc_filter, Move.is_mistake == True).count()
-                
-                time_control_stats[tc_name] = {
-                    'games': tc_games,
-                    'moves': tc_moves,
-                    'blunders': tc_blunders,
-                    'mistakes': tc_mistakes,
-                    'blunder_rate': (tc_blunders / tc_moves * 100) if tc_moves > 0 else 0,
-                    'mistake_rate': (tc_mistakes / tc_moves * 100) if tc_moves > 0 else 0
-                }
+            time_control_stats[tc_name] = {
+                'games': tc_games,
+                'moves': tc_moves,
+                'blunders': tc_blunders,
+                'mistakes': tc_mistakes,
+                'blunder_rate': (tc_blunders / tc_moves * 100) if tc_moves > 0 else 0,
+                'mistake_rate': (tc_mistakes / tc_moves * 100) if tc_moves > 0 else 0
+            }
         
-        return jsonify({
+        return {
             'username': username,
             'games': {
                 'total': total_games,
                 'analyzed': analyzed_games,
                 'unanalyzed': unanalyzed_games,
+                'provisional': provisional_games,
                 'analysis_progress': (analyzed_games / total_games * 100) if total_games > 0 else 0,
                 'latest_date': latest_game.played_at.isoformat() if latest_game else None,
                 'oldest_date': oldest_game.played_at.isoformat() if oldest_game else None
@@ -172,9 +355,8 @@ def get_stats():
                 'inaccuracy_rate': round(inaccuracy_rate, 2)
             },
             'time_controls': [{'name': tc, 'count': count} for tc, count in time_controls],
-            'time_control_stats': time_control_stats,
-            'operation_status': get_user_status(username)
-        })
+            'time_control_stats': time_control_stats
+        }
     finally:
         db.close()
 
@@ -189,18 +371,16 @@ def fetch_games():
     # Update user activity timestamp
     update_user_activity(username)
     
-    user_status = get_user_status(username)
-    if user_status['fetching'] or user_status['analyzing']:
-        return jsonify({'error': f'Another operation is already running for user {username}'}), 400
-    
     batch_size = data.get('batch_size', 100)
     fetch_older = data.get('fetch_older', False)
     
-    # Start fetching in background
-    thread = threading.Thread(target=run_fetch_games, args=(username, batch_size, fetch_older))
-    thread.start()
+    # Queue the fetch for a worker, unless another operation is already queued or running
+    job = job_queue.enqueue_exclusive(username, 'fetch', {'batch_size': batch_size, 'fetch_older': fetch_older})
+    if job is None:
+        return jsonify({'error': f'Another operation is already running for user {username}'}), 400
+    publish_status(username)
     direction = "older" if fetch_older else "newer"
-    return jsonify({'message': f'Started fetching {batch_size} {direction} games for {username}'})
+    return jsonify({'message': f'Started fetching {batch_size} {direction} games for {username}', 'job_id': job.id})
 
 @app.route('/api/analyze-games', methods=['POST'])
 def analyze_games():
@@ -213,167 +393,153 @@ def analyze_games():
     # Update user activity timestamp
     update_user_activity(username)
     
-    user_status = get_user_status(username)
-    if user_status['fetching'] or user_status['analyzing']:
-        return jsonify({'error': f'Another operation is already running for user {username}'}), 400
-    
-    # Check if we've reached the concurrent analysis limit
-    active_analyses = get_active_analyses_count()
-    if active_analyses >= MAX_CONCURRENT_ANALYSES:
-        return jsonify({
-            'error': f'Maximum concurrent analyses ({MAX_CONCURRENT_ANALYSES}) reached. Please wait for another analysis to complete.'
-        }), 429  # 429 Too Many Requests
-    
     time_limit_per_game = data.get('time_limit_per_game', 20)
     total_time_limit = data.get('total_time_limit')  # Optional total session limit
+    # Progressive: a quick sweep now, full depth later as a background job
+    progressive = data.get('progressive', True)
     
-    # Start analysis in background
-    thread = threading.Thread(target=run_analyze_games, args=(username, time_limit_per_game, total_time_limit))
-    thread.start()
+    # Queue the analysis for a worker, unless another operation is already queued or running
+    job = job_queue.enqueue_exclusive(username, 'analyze', {
+        'time_limit_per_game': time_limit_per_game,
+        'total_time_limit': total_time_limit,
+        'quality': 'quick' if progressive else 'full'
+    })
+    if job is None:
+        return jsonify({'error': f'Another operation is already running for user {username}'}), 400
+    if not progressive:
+        # Full depth covers the quick-analyzed games a background deepening job would redo
+        job_queue.request_cancel(username, 'superseded by full analysis', only_background=True)
+    publish_status(username)
     message = f'Started analyzing games for {username} with {time_limit_per_game}s per game'
     if total_time_limit:
         message += f' (max {total_time_limit}s total)'
-    return jsonify({'message': message})
-
-def run_fetch_games(username, batch_size, fetch_older=False):
-    """Background task to fetch games"""
-    user_status = get_user_status(username)
-    direction = "older" if fetch_older else "newer"
-    print(f"[DEBUG] Starting fetch for {username} with batch size {batch_size} ({direction} games)")
-    user_status['fetching'] = True
-    user_status['progress'] = {'stage': 'fetching', 'current': 0, 'total': batch_size}
-    try:
-        async def fetch():
-            print("[DEBUG] Creating BlunderTracker instance")
-            tracker = BlunderTracker()
-            print(f"[DEBUG] About to call fetch_user_games (fetch_older={fetch_older})")
-            result = await tracker.fetch_user_games(username, max_games=batch_size, fetch_older=fetch_older)
-            print(f"[DEBUG] fetch_user_games returned: {result}")
-            return result
-        print("[DEBUG] Creating new asyncio event loop")
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        print("[DEBUG] Running event loop for fetch")
-        games_added = loop.run_until_complete(fetch())
-        print(f"[DEBUG] Fetch complete, games added: {games_added}")
-        loop.close()
-        user_status['last_operation'] = {
-            'type': 'fetch',
-            'completed_at': datetime.now(UTC).isoformat(),
-            'result': f'Added {games_added} new {direction} games for {username}'
-        }
-    except Exception as e:
-        print(f"[ERROR] Exception during fetch: {e}")
-        import traceback; traceback.print_exc()
-        user_status['last_operation'] = {
-            'type': 'fetch',
-            'completed_at': datetime.now(UTC).isoformat(),
-            'error': str(e)
-        }
-    finally:
-        user_status['fetching'] = False
-        user_status['progress'] = {}
-
-def run_analyze_games(username, time_limit_per_game, total_time_limit=None):
-    """Background task to analyze games"""
-    user_status = get_user_status(username)
-    user_status['analyzing'] = True
     
-    # Get count of unanalyzed games for progress tracking
-    db = db_manager.get_db(username)
-    unanalyzed_count = db.query(Game).filter(
-        Game.username == username,
-        Game.fully_analyzed == False
-    ).count()
-    db.close()
-    
-    user_status['progress'] = {
-        'stage': 'analyzing', 
-        'current': 0, 
-        'total': unanalyzed_count,
-        'start_time': datetime.now(UTC).isoformat(),
-        'time_limit_per_game': time_limit_per_game,
-        'total_time_limit': total_time_limit,
-        'current_game': None,
-        'games_analyzed': 0,
-        'games_skipped': 0
-    }
+    # Every request is admitted; engine slots rotate between users game by game
+    queue_position = job_queue.get_queue_position(job)
+    if queue_position:
+        message += f' (position {queue_position + 1} in queue)'
+    return jsonify({
+        'message': message,
+        'job_id': job.id,
+        'queue_position': queue_position,
+        'estimated_wait_seconds': round(job_queue.estimate_wait(job, MAX_CONCURRENT_ANALYSES))
+    })
+
+@app.route('/api/cancel', methods=['POST'])
+def cancel_operations():
+    """Cancel a user's queued jobs and stop their running analysis at the next ply"""
+    data = request.get_json()
+    username = data.get('username')
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
     
-    # Set the last active timestamp to prevent timeout during analysis
     update_user_activity(username)
-    
-    def check_user_timeout():
-        """Check if the user has timed out"""
-        if username not in user_operations:
-            print(f"[INFO] User {username} has been removed. Stopping analysis.")
-            return True
-            
-        # Calculate time since last activity
-        inactive_seconds = (datetime.now(UTC) - user_operations[username]['last_active']).total_seconds()
-        
-        # If inactive for 3x the timeout period, consider this a timeout
-        if inactive_seconds > USER_TIMEOUT_SECONDS * 3:
-            print(f"[INFO] User {username} has timed out after {inactive_seconds}s of inactivity. Stopping analysis.")
-            return True
-            
-        return False
-    
-    def progress_callback(progress_data):
-        """Update user-specific progress state"""
-        # Only update if the user still exists
-        if username in user_operations:
-            user_status['progress'].update(progress_data)
-    
-    try:
-        async def analyze():
-            tracker = BlunderTracker(progress_callback=progress_callback)
-            
-            # Store original analyze_games method for timeout checking
-            original_analyze_games = tracker.analyze_games
-            
-            async def analyze_games_with_timeout_check(*args, **kwargs):
-                # Check if user has timed out before starting analysis
-                if check_user_timeout():
-                    print(f"[INFO] Analysis for {username} terminated due to timeout")
-                    return {"games_analyzed": 0, "games_skipped": 0}
-                
-                # Update activity timestamp before analyzing
-                update_user_activity(username)
-                
-                # Call the original method
-                return await original_analyze_games(*args, **kwargs)
-            
-            # Replace with our wrapped version
-            tracker.analyze_games = analyze_games_with_timeout_check
-            
-            return await tracker.analyze_games(
-                username, 
-                time_limit_per_game_seconds=time_limit_per_game,
-                total_time_limit_seconds=total_time_limit
-            )
-            
-        # Run async function in new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(analyze())
-        loop.close()
-        
-        user_status['last_operation'] = {
-            'type': 'analyze',
-            'completed_at': datetime.now(UTC).isoformat(),
-            'result': f'Analysis completed for {username}: {result["games_analyzed"]} games analyzed, {result["games_skipped"]} skipped'
-        }
-    except Exception as e:
-        user_status['last_operation'] = {
-            'type': 'analyze',
-            'completed_at': datetime.now(UTC).isoformat(),
-            'error': str(e)
-        }
-    finally:
-        user_status['analyzing'] = False
-        user_status['progress'] = {}
+    cancelled = job_queue.request_cancel(username, 'cancelled by user')
+    publish_status(username)
+    if not cancelled:
+        return jsonify({'message': f'No operation is running for {username}'})
+    return jsonify({'message': f'Stopping {cancelled} operation(s) for {username}'})
+
+def worker_endpoint(view):
+    """Authenticate a remote worker call and turn ProtocolError into a JSON error"""
+    @functools.wraps(view)
+    def wrapper():
+        try:
+            check_token(request.headers.get('Authorization'))
+            return jsonify(view(request.get_json() or {}))
+        except ProtocolError as e:
+            return jsonify({'error': str(e)}), e.status
+    return wrapper
+
+@app.route('/api/worker/claim', methods=['POST'])
+@worker_endpoint
+def worker_claim(data):
+    """Lease an analyze job and a batch of its games to a remote worker"""
+    if not data.get('worker_id'):
+        raise ProtocolError('worker_id is required')
+    claim = remote_workers.claim(data['worker_id'], data.get('max_games'))
+    if claim is not None:
+        publish_status(claim['username'])
+    return {'job': claim}
+
+@app.route('/api/worker/heartbeat', methods=['POST'])
+@worker_endpoint
+def worker_heartbeat(data):
+    """Renew a remote worker's lease; replies with a reason to stop, if any"""
+    return remote_workers.heartbeat(data.get('job_id'), data.get('claim_token'), data.get('current_game'))
+
+@app.route('/api/worker/submit', methods=['POST'])
+@worker_endpoint
+def worker_submit(data):
+    """Merge a remote worker's finished games; done releases the job"""
+    reply = remote_workers.submit(data.get('job_id'), data.get('claim_token'), data.get('results', []),
+                                  bool(data.get('done')), data.get('stopped'), data.get('partial_game'))
+    job = job_queue.get_job(data.get('job_id'))
+    if job is not None:
+        publish_status(job.username)
+    return reply
+
+@app.route('/api/jobs/<int:job_id>')
+def get_job_status(job_id):
+    """Get the state, progress and result of a queued job"""
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return jsonify(job.to_dict())
+
+def apply_listing_filters(query, model):
+    """Apply the optional speed, opening and date filters shared by listing endpoints"""
+    query = filter_time_control(query, request.args.get('speed'), model.time_control)
+    opening = request.args.get('opening')
+    if opening:
+        query = query.filter(model.opening_name == opening)
+    return filter_played_between(query, model.played_at, request.args.get('date_from'), request.args.get('date_to'))
+
+def get_move_counts(db, lichess_ids):
+    """Move and blunder counts for a page of games from one grouped query"""
+    if not lichess_ids:
+        return {}
+    rows = db.query(
+        Move.game_lichess_id,
+        func.count(Move.id),
+        func.sum(case((Move.is_blunder == True, 1), else_=0))
+    ).filter(Move.game_lichess_id.in_(lichess_ids)).group_by(Move.game_lichess_id).all()
+    return {lichess_id: (moves, blunders or 0) for lichess_id, moves, blunders in rows}
+
+def serialize_games(db, games):
+    """Convert a page of games to JSON-ready dicts with move and blunder counts"""
+    counts = get_move_counts(db, [game.lichess_id for game in games])
+    game_list = []
+    for game in games:
+        moves_count, blunders_count = counts.get(game.lichess_id, (0, 0))
+        game_list.append({
+            'lichess_id': game.lichess_id,
+            'played_at': game.played_at.isoformat(),
+            'time_control': game.time_control,
+            'opening_name': game.opening_name,
+            'user_color': game.user_color,
+            'user_rating': game.user_rating,
+            'opponent_rating': game.opponent_rating,
+            'result': game.result,
+            'fully_analyzed': game.fully_analyzed,
+            'moves_count': moves_count,
+            'blunders_count': blunders_count
+        })
+    return game_list
+
+def serialize_blunder(blunder):
+    """Convert a blunder move to a JSON-ready dict"""
+    return {
+        'move_san': blunder.move_san,
+        'centipawn_loss': blunder.centipawn_loss,
+        'played_at': blunder.played_at.isoformat(),
+        'opening_name': blunder.opening_name,
+        'opponent_rating': blunder.opponent_rating,
+        'game_id': blunder.game_lichess_id
+    }
 
 @app.route('/api/recent-games')
+@versioned_json()
 def get_recent_games():
     """Get recent games with analysis status"""
     username = request.args.get('username', 'default')
@@ -384,59 +550,95 @@ def get_recent_games():
     update_user_activity(username)
     db = db_manager.get_db(username)
     try:
-        games = db.query(Game).order_by(Game.played_at.desc()).limit(20).all()
-        game_list = []
-        for game in games:
-            moves_count = db.query(Move).filter(Move.game_lichess_id == game.lichess_id).count()
-            blunders_count = db.query(Move).filter(
-                Move.game_lichess_id == game.lichess_id,
-                Move.is_blunder == True
-            ).count()
-            game_list.append({
-                'lichess_id': game.lichess_id,
-                'played_at': game.played_at.isoformat(),
-                'time_control': game.time_control,
-                'opening_name': game.opening_name,
-                'user_color': game.user_color,
-                'user_rating': game.user_rating,
-                'opponent_rating': game.opponent_rating,
-                'result': game.result,
-                'fully_analyzed': game.fully_analyzed,
-                'moves_count': moves_count,
-                'blunders_count': blunders_count
-            })
-        result = jsonify(game_list)
+        limit = parse_page_size(request.args.get('limit'))
+        games = db.query(Game).order_by(Game.played_at.desc(), Game.id.desc()).limit(limit).all()
+        result = serialize_games(db, games)
+    finally:
+        db.close()
+    return result
+
+@app.route('/api/games')
+@versioned_json()
+def list_games():
+    """Page through a user's games, newest first, using a keyset cursor"""
+    username = request.args.get('username', 'default')
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+    
+    update_user_activity(username)
+    db = db_manager.get_db(username)
+    try:
+        query = apply_listing_filters(db.query(Game), Game)
+        games, next_cursor = paginate_newest_first(
+            query, Game.played_at, Game.id,
+            request.args.get('cursor'), parse_page_size(request.args.get('limit'))
+        )
+        result = {'games': serialize_games(db, games), 'next_cursor': next_cursor}
+    except InvalidCursor as e:
+        result = jsonify({'error': str(e)}), 400
+    finally:
+        db.close()
+    return result
+
+@app.route('/api/blunders')
+@versioned_json()
+def list_blunders():
+    """Page through a user's blunders, newest first, using a keyset cursor"""
+    username = request.args.get('username', 'default')
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+    
+    update_user_activity(username)
+    db = db_manager.get_db(username)
+    try:
+        query = apply_listing_filters(db.query(Move).filter(Move.is_blunder == True), Move)
+        blunders, next_cursor = paginate_newest_first(
+            query, Move.played_at, Move.id,
+            request.args.get('cursor'), parse_page_size(request.args.get('limit'))
+        )
+        result = {
+            'blunders': [serialize_blunder(blunder) for blunder in blunders],
+            'next_cursor': next_cursor
+        }
+    except InvalidCursor as e:
+        result = jsonify({'error': str(e)}), 400
     finally:
         db.close()
     return result
 
 @app.route('/api/blunder-analysis')
+@versioned_json()
 def get_blunder_analysis():
     """Get detailed blunder analysis"""
     username = request.args.get('username', 'default')
     if not username:
         return jsonify({'error': 'Username is required'}), 400
+    quality = request.args.get('quality')
+    if invalid_quality(quality):
+        return invalid_quality(quality)
         
     # Update user activity timestamp
     update_user_activity(username)
     db = db_manager.get_db(username)
     try:
         # Recent blunders
-        recent_blunders = db.query(Move).filter(Move.is_blunder == True).order_by(Move.played_at.desc()).limit(10).all()
+        recent_blunders, recent_blunders_cursor = paginate_newest_first(
+            filter_quality(db.query(Move).filter(Move.is_blunder == True), quality), Move.played_at, Move.id,
+            None, parse_page_size(request.args.get('blunder_limit'), default=10)
+        )
         # Blunders by opening
-        opening_blunders = db.query(
+        opening_blunders = filter_quality(db.query(
             Move.opening_name,
             func.count(Move.id).label('blunder_count'),
             func.count(func.distinct(Move.game_lichess_id)).label('games')
-        ).filter(Move.is_blunder == True).group_by(Move.opening_name).order_by(func.count(Move.id).desc()).limit(10).all()
+        ), quality).filter(Move.is_blunder == True).group_by(Move.opening_name).order_by(func.count(Move.id).desc()).limit(10).all()
         # Blunders by time control
-        time_control_blunders = db.query(
+        time_control_blunders = filter_quality(db.query(
             Move.time_control,
             func.count(Move.id).label('blunder_count')
-        ).filter(Move.is_blunder == True).group_by(Move.time_control).all()
+        ), quality).filter(Move.is_blunder == True).group_by(Move.time_control).all()
         # Average centipawn loss by rating range
-        from sqlalchemy import case
-        rating_analysis = db.query(
+        rating_analysis = filter_quality(db.query(
             case(
                 (Move.opponent_rating < 1200, 'Under 1200'),
                 (Move.opponent_rating < 1400, '1200-1399'),
@@ -447,16 +649,11 @@ def get_blunder_analysis():
             ).label('rating_range'),
             func.avg(Move.centipawn_loss).label('avg_cp_loss'),
             func.count(Move.id).label('move_count')
-        ).filter(Move.centipawn_loss > 0).group_by('rating_range').all()
-        result = jsonify({
-            'recent_blunders': [{
-                'move_san': blunder.move_san,
-                'centipawn_loss': blunder.centipawn_loss,
-                'played_at': blunder.played_at.isoformat(),
-                'opening_name': blunder.opening_name,
-                'opponent_rating': blunder.opponent_rating,
-                'game_id': blunder.game_lichess_id
-            } for blunder in recent_blunders],
+        ), quality).filter(Move.centipawn_loss > 0).group_by('rating_range').all()
+        result = {
+            'recent_blunders': [serialize_blunder(blunder) for blunder in recent_blunders],
+            # Continue with /api/blunders?cursor=... to see older blunders
+            'recent_blunders_next_cursor': recent_blunders_cursor,
             'opening_blunders': [{
                 'opening': opening,
                 'blunder_count': count,
@@ -471,17 +668,156 @@ def get_blunder_analysis():
                 'avg_cp_loss': round(float(avg_cp_loss), 1),
                 'move_count': move_count
             } for rating_range, avg_cp_loss, move_count in rating_analysis]
-        })
+        }
     finally:
         db.close()
     return result
 
+def position_before_move(pgn, move_number):
+    """FEN of the position in which the move_number-th ply was played"""
+    import chess.pgn
+    game = chess.pgn.read_game(io.StringIO(pgn or ''))
+    if not game:
+        return None
+    board = game.board()
+    for ply, move in enumerate(game.mainline_moves(), start=1):
+        if ply == move_number:
+            return board.fen()
+        board.push(move)
+    return None
+
+@app.route('/api/problem-positions')
+@versioned_json()
+def get_problem_positions():
+    """Positions the user reached repeatedly and went wrong in
+
+    Grouped on the indexed Zobrist hash of the position before each user move.
+    `min_cp` (default 100) is the loss that counts as going wrong and
+    `min_count` (default 2) the fewest times the position must have occurred.
+    """
+    username = request.args.get('username', 'default')
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+    
+    limit = parse_page_size(request.args.get('limit'))
+    min_cp = request.args.get('min_cp', 100, type=int)
+    min_count = max(1, request.args.get('min_count', 2, type=int))
+    
+    update_user_activity(username)
+    db = db_manager.get_db(username)
+    try:
+        went_wrong = func.sum(case((Move.centipawn_loss >= min_cp, 1), else_=0))
+        # In SQLite, the bare columns come from the row holding max(played_at): the latest occurrence
+        rows = db.query(
+            Move.position_hash,
+            func.count(Move.id).label('occurrences'),
+            went_wrong.label('went_wrong'),
+            func.avg(Move.centipawn_loss).label('avg_cp_loss'),
+            func.max(Move.played_at).label('last_played_at'),
+            Move.game_lichess_id,
+            Move.move_number,
+            Move.best_move
+        ).filter(
+            Move.position_hash != None, Move.position_hash != UNKNOWN_POSITION
+        ).group_by(Move.position_hash).having(
+            func.count(Move.id) >= min_count, went_wrong > 0
+        ).order_by(went_wrong.desc(), func.count(Move.id).desc()).limit(limit).all()
+        
+        hashes = [row.position_hash for row in rows]
+        moves_played = {}
+        if hashes:
+            for position_hash, move_san, count, avg_cp_loss in db.query(
+                Move.position_hash, Move.move_san, func.count(Move.id), func.avg(Move.centipawn_loss)
+            ).filter(Move.position_hash.in_(hashes)).group_by(Move.position_hash, Move.move_san).order_by(func.count(Move.id).desc()):
+                moves_played.setdefault(position_hash, []).append({
+                    'move_san': move_san,
+                    'count': count,
+                    'avg_cp_loss': round(float(avg_cp_loss or 0), 1)
+                })
+        pgns = dict(db.query(Game.lichess_id, Game.pgn).filter(
+            Game.lichess_id.in_({row.game_lichess_id for row in rows})
+        ).all()) if rows else {}
+        
+        result = {'positions': [{
+            'position_hash': format(from_signed64(row.position_hash), '016x'),
+            'fen': position_before_move(pgns.get(row.game_lichess_id), row.move_number),
+            'occurrences': row.occurrences,
+            'went_wrong': row.went_wrong,
+            'avg_cp_loss': round(float(row.avg_cp_loss or 0), 1),
+            'best_move': row.best_move,
+            'moves_played': moves_played.get(row.position_hash, []),
+            'last_played_at': row.last_played_at.isoformat(),
+            'last_game_id': row.game_lichess_id,
+            'last_move_number': row.move_number
+        } for row in rows]}
+    finally:
+        db.close()
+    return result
+
+@app.route('/api/opening-tree')
+@versioned_json()
+def get_opening_tree():
+    """One level of the user's opening tree, expanded lazily from `node`
+
+    Without `node` the moves from the starting position are returned; pass a
+    child's id to drill down. `color` (white/black) picks the tree.
+    """
+    username = request.args.get('username', 'default')
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+    
+    color = request.args.get('color', 'white')
+    if color not in ('white', 'black'):
+        return jsonify({'error': 'color must be white or black'}), 400
+    node_id = request.args.get('node', opening_tree.ROOT_ID, type=int)
+    min_games = max(1, request.args.get('min_games', 1, type=int))
+    
+    update_user_activity(username)
+    db = db_manager.get_db(username)
+    try:
+        node = None
+        if node_id != opening_tree.ROOT_ID:
+            node = db.query(OpeningNode).filter(OpeningNode.id == node_id, OpeningNode.user_color == color).first()
+            if node is None:
+                return jsonify({'error': f'Opening node {node_id} not found'}), 404
+        
+        children = opening_tree.get_children(db, color, node_id, min_games)
+        result = {
+            'color': color,
+            'node': opening_tree.serialize_node(node, bool(children)) if node else None,
+            'path': opening_tree.get_path(db, node_id),
+            'children': children
+        }
+    finally:
+        db.close()
+    return result
+
+# strftime formats used to bucket games for the performance chart
+PERFORMANCE_BUCKETS = {
+    'day': '%Y-%m-%d',
+    'week': '%Y-%W',
+    'month': '%Y-%m',
+}
+
 @app.route('/api/performance')
+@versioned_json()
 def get_performance_data():
-    """Get performance data for charting with optional filters"""
+    """Get performance data for charting with optional filters
+
+    Optional `bucket` (day/week/month) aggregates games per period; optional
+    `points` downsamples the per-game series with LTTB.
+    """
     username = request.args.get('username', 'default')
     if not username:
         return jsonify({'error': 'Username is required'}), 400
+    
+    bucket = request.args.get('bucket')
+    if bucket and bucket not in PERFORMANCE_BUCKETS:
+        return jsonify({'error': f'bucket must be one of {", ".join(PERFORMANCE_BUCKETS)}'}), 400
+    points = parse_point_limit(request.args.get('points'))
+    quality = request.args.get('quality')
+    if invalid_quality(quality):
+        return invalid_quality(quality)
         
     # Update user activity timestamp
     update_user_activity(username)
@@ -494,27 +830,30 @@ def get_performance_data():
         date_start = request.args.get('dateRange[0]')
         date_end = request.args.get('dateRange[1]')
         
-        # Base query for moves with game data
-        query = db.query(Move).join(Game, Move.game_lichess_id == Game.lichess_id)
+        positive_cp = case((Move.centipawn_loss > 0, Move.centipawn_loss))
+        if bucket:
+            group_key = func.strftime(PERFORMANCE_BUCKETS[bucket], Game.played_at)
+            games_column = func.count(func.distinct(Move.game_lichess_id))
+        else:
+            group_key = Move.game_lichess_id
+            games_column = literal(1)
+        
+        # One aggregate row per game (or per period), joined to games for the user's rating
+        query = db.query(
+            func.min(Move.played_at).label('date'),
+            games_column.label('games'),
+            func.count(Move.id).label('total_moves'),
+            func.sum(case((Move.is_blunder == True, 1), else_=0)).label('blunders'),
+            func.sum(case((Move.is_mistake == True, 1), else_=0)).label('mistakes'),
+            func.sum(case((Move.is_inaccuracy == True, 1), else_=0)).label('inaccuracies'),
+            func.avg(positive_cp).label('avg_cp_loss'),
+            func.avg(Game.user_rating).label('user_rating'),
+            func.avg(Move.opponent_rating).label('opponent_rating'),
+        ).join(Game, Move.game_lichess_id == Game.lichess_id)
         
         # Apply filters
-        if time_control and time_control != 'All':
-            # Support 4-category time control classification
-            if time_control == 'bullet':
-                # Bullet: 120+1 and below (60+0, 60+1, 120+1, etc.)
-                query = query.filter(Game.time_control.in_(['60+0', '60+1', '120+1', '180+0']))
-            elif time_control == 'blitz':
-                # Blitz: 3+2 to 5+3 typically (but exclude bullet range)
-                query = query.filter(Game.time_control.in_(['180+2', '300+0', '300+3']))
-            elif time_control == 'rapid':
-                # Rapid: 10-30 minute games
-                query = query.filter(Game.time_control.in_(['600+0', '600+5', '900+10', '1800+0']))
-            elif time_control == 'classical':
-                # Classical: 30+ minute games
-                query = query.filter(Game.time_control.in_(['1800+0', '1800+30', '3600+0']))
-            else:
-                # Exact time control match (for backwards compatibility)
-                query = query.filter(Game.time_control == time_control)
+        query = filter_time_control(query, time_control)
+        query = filter_quality(query, quality)
         
         if rating_min and rating_max:
             query = query.filter(Move.opponent_rating >= rating_min, Move.opponent_rating <= rating_max)
@@ -525,66 +864,66 @@ def get_performance_data():
         if date_end:
             query = query.filter(Move.played_at <= date_end)
         
-        # Get moves ordered by date
-        moves = query.order_by(Move.played_at).all()
+        rows = query.group_by(group_key).order_by(func.min(Move.played_at)).all()
         
-        # Group moves by game and calculate performance metrics
         performance_data = []
-        game_moves = {}
-        
-        # Group moves by game
-        for move in moves:
-            game_id = move.game_lichess_id
-            if game_id not in game_moves:
-                # Get the corresponding game to access user_rating
-                game = db.query(Game).filter(Game.lichess_id == game_id).first()
-                user_rating = game.user_rating if game else None
-                
-                game_moves[game_id] = {
-                    'moves': [],
-                    'date': move.played_at,
-                    'time_control': move.time_control,
-                    'opponent_rating': move.opponent_rating,
-                    'user_rating': user_rating
-                }
-            game_moves[game_id]['moves'].append(move)
-        
-        # Calculate performance for each game
-        for game_id, game_data in game_moves.items():
-            moves_list = game_data['moves']
-            total_moves = len(moves_list)
-            
-            if total_moves == 0:
-                continue
-            
-            blunders = sum(1 for m in moves_list if m.is_blunder)
-            mistakes = sum(1 for m in moves_list if m.is_mistake)
-            inaccuracies = sum(1 for m in moves_list if m.is_inaccuracy)
-            
-            blunder_rate = (blunders / total_moves) * 100
-            mistake_rate = (mistakes / total_moves) * 100
-            inaccuracy_rate = (inaccuracies / total_moves) * 100
-            
-            avg_cp_loss = sum(m.centipawn_loss for m in moves_list if m.centipawn_loss > 0) / len([m for m in moves_list if m.centipawn_loss > 0]) if any(m.centipawn_loss > 0 for m in moves_list) else 0
-            
+        for row in rows:
             performance_data.append({
-                'date': game_data['date'].isoformat(),
-                'blunder_rate': blunder_rate,
-                'mistake_rate': mistake_rate,
-                'inaccuracy_rate': inaccuracy_rate,
-                'total_moves': total_moves,
-                'avg_centipawn_loss': avg_cp_loss,
-                'user_rating': game_data['user_rating'],
-                'opponent_rating': game_data['opponent_rating']
+                'date': row.date.isoformat(),
+                'blunder_rate': row.blunders / row.total_moves * 100,
+                'mistake_rate': row.mistakes / row.total_moves * 100,
+                'inaccuracy_rate': row.inaccuracies / row.total_moves * 100,
+                'total_moves': row.total_moves,
+                'avg_centipawn_loss': float(row.avg_cp_loss or 0),
+                'user_rating': round(row.user_rating) if row.user_rating is not None else None,
+                'opponent_rating': round(row.opponent_rating) if row.opponent_rating is not None else None,
+                **({'games': row.games} if bucket else {}),
+                '_x': row.date.timestamp()
             })
         
-        # Sort by date
-        performance_data.sort(key=lambda x: x['date'])
-        result = jsonify(performance_data)
+        if points and not bucket:
+            performance_data = lttb(performance_data, points, '_x', 'blunder_rate')
+        for entry in performance_data:
+            del entry['_x']
+        result = performance_data
     finally:
         db.close()
     return result
 
+@app.route('/api/progress/stream')
+def stream_progress():
+    """Server-Sent Events stream of a user's operation status and progress
+
+    An open stream keeps the user active, replacing /api/ping polling.
+    """
+    username = request.args.get('username')
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+    
+    update_user_activity(username)
+    status_poller.start()
+    subscriber = progress_broker.subscribe(username)
+    
+    def events():
+        try:
+            # Current state first, so the client never has to poll for it
+            status = get_user_status(username)
+            progress_broker.remember_status(username, status)
+            yield format_event('status', status)
+            while True:
+                # The shared status poller and in-process jobs publish; this stream only waits
+                try:
+                    yield subscriber.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+        finally:
+            progress_broker.unsubscribe(username, subscriber)
+    
+    response = app.response_class(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
 @app.route('/api/ping', methods=['POST'])
 def ping():
     """Keep-alive endpoint for the frontend to prevent user timeout"""
@@ -618,20 +957,39 @@ def get_active_users():
     cleanup_inactive_users()
     
     active_analyses = get_active_analyses_count()
-    total_users = len(user_operations)
-    analyzing_users = [user for user, status in user_operations.items() if status.get('analyzing', False)]
+    total_users = job_queue.count_users()
+    analyzing_users = job_queue.get_active_usernames('analyze')
     
     return jsonify({
         'totalUsers': total_users,
         'activeAnalyses': active_analyses,
         'maxConcurrentAnalyses': MAX_CONCURRENT_ANALYSES,
         'analyzingUsers': analyzing_users,
+        'databases': db_manager.get_pool_stats(),
+        'responseCache': response_cache.get_stats(),
+        'progressStreams': progress_broker.get_stats(),
     })
 
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics for this process (web requests, SQL and any embedded workers)"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 # Configure for cloud deployment
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     debug = os.environ.get('FLASK_ENV') != 'production'
     
+    # Run jobs inside this process unless separate workers are deployed; with the
+    # debug reloader, only the serving child process starts them
+    if EMBEDDED_WORKERS and (not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        # Imported here so importing app (e.g. under gunicorn) does not load the engine code
+        from game_analyzer import PREWARM_DISCOVERY, prewarm_discovery
+        from worker import start_worker_threads
+        if PREWARM_DISCOVERY:
+            prewarm_discovery()
+        start_worker_threads(job_queue, ['fetch'], count=1)
+        start_worker_threads(job_queue, ['analyze'], count=EMBEDDED_WORKERS)
+    
     # Enable CORS for production
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark Stockfish settings on this machine and write the engine config
+
+Runs a fixed set of positions with every combination of engine count,
+Threads per engine and Hash size that fits the machine's cores and memory,
+measures aggregate positions analysed per second, and writes the fastest to
+data/engine_config.json (BLUNDER_ENGINE_CONFIG). The analyzer, the worker
+count and the running-analysis limit read it at startup:
+
+    python autotune.py                # a few minutes
+    python autotune.py --depth 10     # quicker, less precise
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, UTC
+
+import chess
+import chess.engine
+
+from game_analyzer import FULL_DEPTH, GameAnalyzer
+from scheduler import ENGINE_CONFIG_PATH
+
+# Openings, middlegames and endgames, so hash and thread effects show up as in real games
+BENCHMARK_POSITIONS = [
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1',
+    'r1bqkbnr/pppp1ppp/2n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3',
+    'rnbqkb1r/pp2pppp/3p1n2/8/3NP3/2N5/PPP2PPP/R1BQKB1R b KQkq - 2 5',
+    'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 9',
+    'r2q1rk1/1b2bppp/p2ppn2/1p6/3NP3/1BN1B3/PPP2PPP/R2Q1RK1 w - - 0 12',
+    '2rq1rk1/pb1nbppp/1p2pn2/2pp4/2PP4/1PNBPN2/PB3PPP/2RQ1RK1 w - - 4 12',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    '3r1rk1/p4ppp/1p2p3/2q5/2P5/1P3Q2/P4PPP/3R1RK1 w - - 0 21',
+    '8/5pk1/6p1/3R4/5P2/6P1/r6P/6K1 w - - 0 40',
+    '8/8/4k3/3p4/3K4/4P3/8/8 w - - 0 50',
+    '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 30',
+    '8/2p5/1p1k4/p2p4/P2P4/1P1K4/2P5/8 w - - 0 45',
+]
+
+# Hash sizes tried, in MB
+HASH_SIZES = (16, 64, 256)
+
+# Fraction of physical memory all engines' hash tables may use together
+MAX_HASH_MEMORY_FRACTION = 0.5
+
+def physical_memory_mb() -> int:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+def candidate_configs(cpus: int, memory_mb: int, hash_sizes=HASH_SIZES) -> list:
+    """(engines, threads per engine, hash MB) combinations that fit the machine"""
+    thread_options = sorted({t for t in (1, 2, 4, 8, 16, cpus) if t <= cpus})
+    configs = []
+    for threads in thread_options:
+        for engines in sorted({1, max(1, cpus // (2 * threads)), max(1, cpus // threads)}):
+            for hash_mb in hash_sizes:
+                if engines * hash_mb <= memory_mb * MAX_HASH_MEMORY_FRACTION:
+                    configs.append((engines, threads, hash_mb))
+    return configs
+
+async def _engine_run(engine_path: str, threads: int, hash_mb: int, positions: list, depth: int) -> tuple:
+    """Analyse positions with one engine; returns (positions, nodes)"""
+    engine = await GameAnalyzer(engine_path, threads=threads, hash_mb=hash_mb).open_engine()
+    nodes = 0
+    try:
+        for fen in positions:
+            info = await engine.analyse(chess.Board(fen), chess.engine.Limit(depth=depth))
+            nodes += info.get('nodes', 0)
+    finally:
+        await engine.quit()
+    return len(positions), nodes
+
+async def benchmark(engine_path: str, engines: int, threads: int, hash_mb: int,
+                    depth: int, positions=BENCHMARK_POSITIONS) -> dict:
+    """Run `engines` engines at once over the position set; aggregate throughput"""
+    started = time.perf_counter()
+    results = await asyncio.gather(*[
+        _engine_run(engine_path, threads, hash_mb, positions, depth) for _ in range(engines)
+    ])
+    seconds = time.perf_counter() - started
+    analysed = sum(count for count, _ in results)
+    return {
+        'engines': engines,
+        'threads': threads,
+        'hash_mb': hash_mb,
+        'seconds': round(seconds, 2),
+        'positions_per_second': round(analysed / seconds, 2),
+        'nodes_per_second': round(sum(nodes for _, nodes in results) / seconds),
+    }
+
+def choose(results: list) -> dict:
+    """Fastest combination; near-ties (within 3%) go to fewer threads, then less hash"""
+    best = max(result['positions_per_second'] for result in results)
+    close = [result for result in results if result['positions_per_second'] >= best * 0.97]
+    return min(close, key=lambda result: (result['threads'], result['hash_mb'], -result['positions_per_second']))
+
+async def autotune(engine_path: str, depth: int, cpus: int, memory_mb: int) -> dict:
+    results = []
+    for engines, threads, hash_mb in candidate_configs(cpus, memory_mb):
+        result = await benchmark(engine_path, engines, threads, hash_mb, depth)
+        print(f"[INFO] {engines} engines x {threads} threads, {hash_mb}MB hash: "
+              f"{result['positions_per_second']} positions/s, {result['nodes_per_second']} nodes/s")
+        results.append(result)
+    chosen = choose(results)
+    return {
+        'threads': chosen['threads'],
+        'hash_mb': chosen['hash_mb'],
+        'slots': chosen['engines'],
+        'positions_per_second': chosen['positions_per_second'],
+        'depth': depth,
+        'cpu_count': cpus,
+        'memory_mb': memory_mb,
+        'engine_path': engine_path,
+        'benchmarked_at': datetime.now(UTC).isoformat(),
+        'results': results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Stockfish settings and write the engine config")
+    parser.add_argument('--depth', type=int, default=FULL_DEPTH - 3, help="Search depth per benchmark position")
+    parser.add_argument('--cpus', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--memory-mb', type=int, default=physical_memory_mb())
+    parser.add_argument('--output', default=ENGINE_CONFIG_PATH)
+    parser.add_argument('--dry-run', action='store_true', help="Print the recommendation without writing it")
+    args = parser.parse_args()
+
+    engine_path = GameAnalyzer().engine_path
+    config = asyncio.run(autotune(engine_path, args.depth, args.cpus, args.memory_mb))
+    print(f"[INFO] Recommended: {config['slots']} engines x {config['threads']} threads, "
+          f"{config['hash_mb']}MB hash ({config['positions_per_second']} positions/s)")
+    if args.dry_run:
+        return
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(config, f, indent=2)
+    print(f"[INFO] Wrote {args.output}; restart the server and workers to use it")
+
+if __name__ == "__main__":
+    main()
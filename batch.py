@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Headless batch refresh: fetch and analyze games for many users
+
+Reads usernames (one per line, # for comments, - for stdin) and runs each
+user's fetch and analysis on its own thread, with at most --engines analyses
+running at once:
+
+    python batch.py users.txt --parallel 8 --engines 4 --max-games 50 > run.jsonl
+
+Progress is written to stdout as JSON lines (start, fetched, progress, done,
+busy, error, and a final report with per-user throughput); logs go to stderr.
+Each user is held through the job queue in data/jobs.db while they are
+refreshed, so a user the web server or worker.py is already working on is
+reported as busy and skipped, and no worker starts on a user held here. A
+user whose run fails is reported and the batch carries on. Exit codes:
+0 all users succeeded, 1 some failed, 2 bad arguments or user list,
+3 every user failed, 130 interrupted (finished games are kept).
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, UTC
+
+from cancellation import CancellationToken
+from database_multiuser import QUALITY_LEVELS
+from game_analyzer import GameAnalyzer
+from job_queue import JobQueue, default_worker_id
+from main import BlunderTracker
+from scheduler import ENGINE_HASH_MB, ENGINE_THREADS, engine_slot_count
+
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_USAGE = 2
+EXIT_ALL_FAILED = 3
+EXIT_INTERRUPTED = 130
+
+# Least time between two progress lines for one user
+PROGRESS_INTERVAL_SECONDS = 5.0
+
+def read_usernames(path: str) -> list:
+    """Usernames from a file (or - for stdin), without blanks, comments or repeats"""
+    handle = sys.stdin if path == '-' else open(path)
+    try:
+        lines = handle.read().splitlines()
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+    usernames = []
+    for line in lines:
+        username = line.split('#', 1)[0].strip()
+        if username and username not in usernames:
+            usernames.append(username)
+    return usernames
+
+class EventWriter:
+    """JSON lines to a stream, one whole line at a time from any thread"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({'event': event, 'time': datetime.now(UTC).isoformat(timespec='seconds'), **fields})
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+class BatchRunner:
+    """Runs fetch and analysis for each user, `parallel` users and `engines` analyses at a time"""
+
+    def __init__(self, events: EventWriter, parallel: int, engines: int, threads: int = ENGINE_THREADS,
+                 hash_mb: int = ENGINE_HASH_MB, max_games: int = 100, analyze_max=None,
+                 time_limit_per_game: int = 20, user_time_limit=None, quality: str = 'full',
+                 fetch: bool = True, analyze: bool = True, progress_interval: float = PROGRESS_INTERVAL_SECONDS,
+                 job_queue=None):
+        self.events = events
+        self.job_queue = job_queue if job_queue is not None else JobQueue()
+        self.parallel = max(1, parallel)
+        self.engine_slots = threading.BoundedSemaphore(max(1, engines))
+        self.threads = threads
+        self.hash_mb = hash_mb
+        self.max_games = max_games
+        self.analyze_max = analyze_max
+        self.time_limit_per_game = time_limit_per_game
+        self.user_time_limit = user_time_limit
+        self.quality = QUALITY_LEVELS[quality]
+        self.fetch = fetch
+        self.analyze = analyze
+        self.progress_interval = progress_interval
+        self.cancel_token = CancellationToken()
+        self.user_tokens = set()
+        self.lock = threading.Lock()
+
+    def stop(self, reason: str = 'interrupted'):
+        """Stop running analyses at the next ply and start no more users"""
+        self.cancel_token.cancel(reason)
+        with self.lock:
+            for token in self.user_tokens:
+                token.cancel(reason)
+
+    def _hold(self, job, cancel_token, done):
+        """Renew the user's job lease until done; a stop request or a lost lease stops the user's analysis"""
+        interval = max(1.0, min(5.0, self.job_queue.lease_seconds / 4))
+        while not done.wait(interval):
+            try:
+                # Keeps the web server's inactivity cleanup from cancelling the job
+                self.job_queue.touch_user(job.username)
+                held = self.job_queue.heartbeat(job)
+                reason = self.job_queue.cancel_reason(job)
+            except Exception as e:
+                print(f"[WARN] Could not renew job {job.id} for {job.username}: {e}")
+                continue
+            if not held:
+                print(f"[WARN] Lost the lease on job {job.id} for {job.username}")
+                cancel_token.cancel('lease lost')
+                return
+            if reason:
+                cancel_token.cancel(reason)
+
+    def _error(self, report: dict, error: Exception):
+        """Record a user's failure in their report and on stdout"""
+        traceback.print_exc()
+        report.update(status='error', error=f'{type(error).__name__}: {error}')
+        self.events.emit('error', username=report['username'], error=report['error'])
+
+    def run_user(self, username: str) -> dict:
+        """Fetch and analyze one user; never raises, so one failure cannot end the batch"""
+        report = {'username': username, 'status': 'skipped', 'games_fetched': 0, 'games_analyzed': 0,
+                  'games_skipped': 0, 'positions_analyzed': 0, 'games_remaining': None,
+                  'fetch_seconds': 0.0, 'analysis_seconds': 0.0}
+        if self.cancel_token.cancelled:
+            return report
+        try:
+            job = self.job_queue.claim_exclusive(username, 'analyze', f'{default_worker_id()}:batch',
+                                                 {'source': 'batch'})
+        except Exception as e:
+            self._error(report, e)
+            return report
+        if job is None:
+            report['status'] = 'busy'
+            self.events.emit('busy', username=username)
+            return report
+        cancel_token = CancellationToken()
+        with self.lock:
+            self.user_tokens.add(cancel_token)
+        if self.cancel_token.cancelled:
+            cancel_token.cancel(self.cancel_token.reason)
+        done = threading.Event()
+        holder = threading.Thread(target=self._hold, args=(job, cancel_token, done), daemon=True)
+        holder.start()
+        self.events.emit('start', username=username)
+        last_progress = [0.0]
+
+        def on_progress(data):
+            now = time.monotonic()
+            if now - last_progress[0] >= self.progress_interval:
+                last_progress[0] = now
+                self.events.emit('progress', username=username, **{key: data.get(key) for key in (
+                    'current', 'total', 'games_analyzed', 'positions_per_second', 'eta_seconds')})
+
+        started = time.monotonic()
+        try:
+            tracker = BlunderTracker(progress_callback=on_progress)
+            if self.fetch:
+                report['games_fetched'] = asyncio.run(tracker.fetch_user_games(username, max_games=self.max_games))
+                report['fetch_seconds'] = round(time.monotonic() - started, 1)
+                self.events.emit('fetched', username=username, games=report['games_fetched'],
+                                 seconds=report['fetch_seconds'])
+            if self.analyze and not cancel_token.cancelled:
+                tracker.analyzer = GameAnalyzer(threads=self.threads, hash_mb=self.hash_mb)
+                with self.engine_slots:
+                    analysis_started = time.monotonic()
+                    result = asyncio.run(tracker.analyze_games(
+                        username,
+                        time_limit_per_game_seconds=self.time_limit_per_game,
+                        total_time_limit_seconds=self.user_time_limit,
+                        max_games=self.analyze_max,
+                        cancel_token=cancel_token,
+                        quality=self.quality
+                    ))
+                    report['analysis_seconds'] = round(time.monotonic() - analysis_started, 1)
+                for key in ('games_analyzed', 'games_skipped', 'positions_analyzed', 'games_remaining'):
+                    report[key] = result[key]
+            report['status'] = 'interrupted' if cancel_token.cancelled else 'ok'
+        except Exception as e:
+            self._error(report, e)
+        finally:
+            done.set()
+            holder.join()
+            with self.lock:
+                self.user_tokens.discard(cancel_token)
+        summary = {'result': f"Batch refresh for {username}: {report['games_analyzed']} games analyzed"}
+        try:
+            if report['status'] == 'error':
+                self.job_queue.fail(job, report['error'])
+            elif report['status'] == 'interrupted':
+                self.job_queue.cancelled(job, summary)
+            else:
+                self.job_queue.complete(job, summary)
+        except Exception as e:
+            # The job's lease runs out and the queue takes it back
+            if report['status'] != 'error':
+                self._error(report, e)
+        report['seconds'] = round(time.monotonic() - started, 1)
+        if report['analysis_seconds']:
+            report['games_per_minute'] = round(report['games_analyzed'] * 60 / report['analysis_seconds'], 2)
+            report['positions_per_second'] = round(report['positions_analyzed'] / report['analysis_seconds'], 1)
+        if report['status'] != 'error':
+            self.events.emit('done', **report)
+        return report
+
+    def run(self, usernames: list) -> list:
+        """Per-user reports, in the order given"""
+        with ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix='batch') as pool:
+            return list(pool.map(self.run_user, usernames))
+
+def exit_code(reports: list, interrupted: bool) -> int:
+    if interrupted:
+        return EXIT_INTERRUPTED
+    failed = sum(1 for report in reports if report['status'] == 'error')
+    if failed and failed == len(reports):
+        return EXIT_ALL_FAILED
+    return EXIT_PARTIAL if failed else EXIT_OK
+
+def print_report(reports: list, stream):
+    print(f"{'user':<24}{'status':>12}{'fetched':>9}{'analyzed':>10}{'left':>7}{'games/min':>11}{'pos/s':>8}", file=stream)
+    for report in reports:
+        left = '-' if report['games_remaining'] is None else report['games_remaining']
+        print(f"{report['username']:<24}{report['status']:>12}{report['games_fetched']:>9}{report['games_analyzed']:>10}"
+              f"{left:>7}{report.get('games_per_minute', '-'):>11}{report.get('positions_per_second', '-'):>8}", file=stream)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch and analyze games for a list of users")
+    parser.add_argument('users', help="File with one username per line, or - for stdin")
+    parser.add_argument('--parallel', type=int, help="Users processed at once (default: --engines)")
+    parser.add_argument('--engines', type=int, default=engine_slot_count(), help="Analyses running at once")
+    parser.add_argument('--threads', type=int, default=ENGINE_THREADS, help="Stockfish Threads per engine")
+    parser.add_argument('--hash-mb', type=int, default=ENGINE_HASH_MB, help="Stockfish Hash per engine")
+    parser.add_argument('--max-games', type=int, default=100, help="Newest games to fetch per user")
+    parser.add_argument('--analyze-max', type=int, help="Most games to analyze per user (default: all)")
+    parser.add_argument('--time-limit', type=int, default=20, help="Seconds per game")
+    parser.add_argument('--user-time-limit', type=int, help="Seconds of analysis per user")
+    parser.add_argument('--quality', choices=sorted(QUALITY_LEVELS), default='full')
+    parser.add_argument('--skip-fetch', action='store_true')
+    parser.add_argument('--skip-analysis', action='store_true')
+    parser.add_argument('--progress-interval', type=float, default=PROGRESS_INTERVAL_SECONDS)
+    args = parser.parse_args()
+
+    try:
+        usernames = read_usernames(args.users)
+    except OSError as e:
+        print(f"[ERROR] Cannot read {args.users}: {e}", file=sys.stderr)
+        sys.exit(EXIT_USAGE)
+    if not usernames:
+        print(f"[ERROR] No usernames in {args.users}", file=sys.stderr)
+        sys.exit(EXIT_USAGE)
+
+    # stdout carries only the JSON lines; everything the tracker prints goes to stderr
+    events = EventWriter(sys.stdout)
+    sys.stdout = sys.stderr
+
+    runner = BatchRunner(events, args.parallel or args.engines, args.engines, args.threads, args.hash_mb,
+                         args.max_games, args.analyze_max, args.time_limit, args.user_time_limit, args.quality,
+                         fetch=not args.skip_fetch, analyze=not args.skip_analysis,
+                         progress_interval=args.progress_interval)
+    signal.signal(signal.SIGTERM, lambda *_: runner.stop())
+    signal.signal(signal.SIGINT, lambda *_: runner.stop())
+
+    started = time.monotonic()
+    events.emit('batch_start', users=len(usernames), parallel=runner.parallel, engines=args.engines)
+    reports = runner.run(usernames)
+    seconds = round(time.monotonic() - started, 1)
+    totals = {key: sum(report[key] for report in reports)
+              for key in ('games_fetched', 'games_analyzed', 'games_skipped', 'positions_analyzed')}
+    code = exit_code(reports, runner.cancel_token.cancelled)
+    events.emit('report', seconds=seconds, exit_code=code, users=reports,
+                failed=[report['username'] for report in reports if report['status'] == 'error'], **totals)
+    print_report(reports, sys.stderr)
+    sys.exit(code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Cooperative cancellation of running analyses
+"""
+
+import threading
+from typing import Optional
+
+class AnalysisCancelled(Exception):
+    """Raised at a ply boundary when an analysis is cancelled or preempted
+
+    Carries the evaluations made so far, so a preempted game can resume at `ply`.
+    """
+
+    def __init__(self, reason: str, move_evaluations: Optional[list] = None, ply: int = 0,
+                 elapsed_seconds: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.move_evaluations = move_evaluations or []
+        self.ply = ply
+        self.elapsed_seconds = elapsed_seconds
+
+class CancellationToken:
+    """Thread-safe flag set by a controller and polled by the analysis loop"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason: str = 'cancelled'):
+        """Request cancellation; the first reason given wins"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self, move_evaluations: Optional[list] = None, ply: int = 0, elapsed_seconds: float = 0.0):
+        """Raise AnalysisCancelled if cancellation was requested"""
+        if self._event.is_set():
+            raise AnalysisCancelled(self.reason, move_evaluations, ply, elapsed_seconds)
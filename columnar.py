@@ -0,0 +1,88 @@
+"""
+Compact encoding of read-endpoint responses: columnar layout, fast JSON, compression
+
+Clients opt in to the columnar layout with `?format=columns` or by accepting
+COLUMNS_MIMETYPE. Every list of row objects in the body is then sent as one
+array per field:
+
+    [{"date": "...", "blunder_rate": 1.5}, ...]
+    -> {"format": "columns", "length": 2, "columns": {"date": [...], "blunder_rate": [...]}}
+
+orjson and brotli are used when installed, falling back to json and gzip.
+"""
+
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COLUMNS_MIMETYPE = 'application/vnd.blunderometer.columns+json'
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+def wants_columns(request) -> bool:
+    """True when the client asked for the columnar layout"""
+    if request.args.get('format') == 'columns':
+        return True
+    # Only an explicit mention counts; */* keeps the row layout
+    return any(mimetype == COLUMNS_MIMETYPE and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+def _is_rows(value) -> bool:
+    """A list of row dicts; an empty list counts, so clients always get the same shape"""
+    return isinstance(value, list) and all(isinstance(row, dict) for row in value)
+
+def to_columns(rows: list) -> dict:
+    """Turn a list of row dicts into parallel arrays; missing fields become null"""
+    fields = {}
+    for row in rows:
+        for field in row:
+            fields.setdefault(field, None)
+    return {
+        'format': 'columns',
+        'length': len(rows),
+        'columns': {field: [row.get(field) for row in rows] for field in fields},
+    }
+
+def columnar_body(body):
+    """Apply the columnar layout to a row list, or to each row list inside a dict"""
+    if _is_rows(body):
+        return to_columns(body)
+    if isinstance(body, dict):
+        return {key: to_columns(value) if _is_rows(value) else value for key, value in body.items()}
+    return body
+
+def dumps(body) -> bytes:
+    """Encode a JSON-ready body"""
+    if orjson is not None:
+        return orjson.dumps(body, default=str)
+    return json.dumps(body, default=str, separators=(',', ':')).encode()
+
+def choose_encoding(request) -> str:
+    """Best content coding the client accepts: 'br', 'gzip' or '' for none"""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered) or ''
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return data
+
+def encode_body(body, columns: bool, encoding: str) -> tuple:
+    """Serialize a body for the negotiated layout and coding; returns (payload, content coding)"""
+    payload = dumps(columnar_body(body) if columns else body)
+    if not encoding or len(payload) < COMPRESS_MIN_BYTES:
+        return payload, ''
+    return compress(payload, encoding), encoding
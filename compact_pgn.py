@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Compact storage of game PGNs
+
+Lichess exports carry a dozen headers, clock comments and an opening tag per
+game, almost all of which already have their own columns. Game.pgn is stored
+instead as:
+
+    version byte | uint16 header length | headers | uint16 plies | 2 bytes per ply | zlib(comments)
+
+Only the headers needed to replay the game (Variant, FEN, SetUp) are kept.
+Each move packs from-square, to-square and promotion piece into 16 bits, so
+decoding needs no move generation; games with piece drops (crazyhouse) are
+stored as text. Move comments such as %clk are dropped
+unless BLUNDER_PGN_KEEP_COMMENTS=1. Decoding gives back a PGN with UCI moves,
+which chess.pgn.read_game reads like the original.
+
+Existing databases keep working (text rows are read as before); to convert
+them and see the size and scan time before and after:
+
+    python compact_pgn.py kencht [more users...]
+"""
+
+import io
+import json
+import os
+import struct
+import zlib
+
+FORMAT_VERSION = 1
+
+# Headers that change how the moves are replayed
+KEPT_HEADERS = ('Variant', 'FEN', 'SetUp')
+
+KEEP_COMMENTS = os.environ.get('BLUNDER_PGN_KEEP_COMMENTS', '0') == '1'
+
+_NULL_MOVE = 0
+
+# Decoding is plain string work, so reading games never imports python-chess
+_SQUARE_NAMES = [file + rank for rank in '12345678' for file in 'abcdefgh']
+_PROMOTION_SYMBOLS = ' pnbrqk'
+
+def _pack_move(move) -> int:
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+def _unpack_move(packed: int) -> str:
+    if packed == _NULL_MOVE:
+        return '--'
+    from_square, to_square, promotion = packed & 63, packed >> 6 & 63, packed >> 12
+    return _SQUARE_NAMES[from_square] + _SQUARE_NAMES[to_square] + _PROMOTION_SYMBOLS[promotion].strip()
+
+def encode(pgn_text: str, keep_comments: bool = KEEP_COMMENTS):
+    """Packed bytes for a PGN, or the text unchanged if it has no moves or does not replay cleanly"""
+    import chess.pgn
+    game = chess.pgn.read_game(io.StringIO(pgn_text or ''))
+    if game is None or game.errors or game.next() is None:
+        return pgn_text
+    headers = '\n'.join(f'{key} {game.headers[key]}' for key in KEPT_HEADERS if key in game.headers).encode()
+    moves = []
+    comments = []
+    for ply, node in enumerate(game.mainline(), start=1):
+        if node.move.drop:
+            # Crazyhouse drops have no from-square to pack; such games are kept as text
+            return pgn_text
+        moves.append(_pack_move(node.move))
+        if keep_comments and node.comment:
+            comments.append([ply, node.comment])
+    if keep_comments and game.comment:
+        comments.insert(0, [0, game.comment])
+    data = struct.pack(f'>BH{len(headers)}sH{len(moves)}H', FORMAT_VERSION, len(headers), headers, len(moves), *moves)
+    if comments:
+        data += zlib.compress(json.dumps(comments, separators=(',', ':')).encode())
+    return data
+
+def decode(data: bytes) -> str:
+    """PGN text (UCI moves) for packed bytes"""
+    version, header_length = struct.unpack_from('>BH', data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Unknown compact PGN version {version}')
+    offset = 3
+    headers = data[offset:offset + header_length].decode()
+    offset += header_length
+    (plies,) = struct.unpack_from('>H', data, offset)
+    offset += 2
+    moves = [_unpack_move(packed) for packed in struct.unpack_from(f'>{plies}H', data, offset)]
+    offset += 2 * plies
+    comments = dict(json.loads(zlib.decompress(data[offset:]))) if len(data) > offset else {}
+
+    lines = [f'[{key} "{value}"]' for key, _, value in (line.partition(' ') for line in headers.splitlines())]
+    movetext = [f'{{ {comments[0]} }}'] if 0 in comments else []
+    for ply, move in enumerate(moves, start=1):
+        movetext.append(move)
+        if ply in comments:
+            movetext.append(f'{{ {comments[ply]} }}')
+    movetext.append('*')
+    return '\n'.join(lines) + ('\n\n' if lines else '') + ' '.join(movetext) + '\n'
+
+def scan_stats(db_path: str) -> dict:
+    """File size and time of a full scan of the games table"""
+    import sqlite3
+    import time
+    connection = sqlite3.connect(db_path)
+    try:
+        started = time.perf_counter()
+        rows = connection.execute('SELECT * FROM games').fetchall()
+        seconds = time.perf_counter() - started
+        pgn_bytes = connection.execute('SELECT COALESCE(SUM(LENGTH(CAST(pgn AS BLOB))), 0) FROM games').fetchone()[0]
+    finally:
+        connection.close()
+    return {'games': len(rows), 'file_mb': round(os.path.getsize(db_path) / 1e6, 2),
+            'pgn_mb': round(pgn_bytes / 1e6, 2), 'scan_ms': round(seconds * 1000, 1)}
+
+def migrate(db_manager, username: str, batch_size: int = 500) -> int:
+    """Re-encode a user's text PGNs in batches and reclaim the space; returns games converted"""
+    from sqlalchemy import text
+    engine = db_manager.get_engine(username)
+    converted = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, pgn FROM games WHERE id > :last_id AND typeof(pgn) = 'text' ORDER BY id LIMIT :limit"
+            ), {'last_id': last_id, 'limit': batch_size}).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            updates = [{'id': row.id, 'pgn': packed} for row in rows
+                       if isinstance(packed := encode(row.pgn), bytes)]
+            if updates:
+                conn.execute(text("UPDATE games SET pgn = :pgn WHERE id = :id"), updates)
+            converted += len(updates)
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql('VACUUM')
+    return converted
+
+def main():
+    import argparse
+    from database_multiuser import DatabaseManager
+    parser = argparse.ArgumentParser(description="Convert stored PGNs to the compact encoding")
+    parser.add_argument('usernames', nargs='+')
+    parser.add_argument('--data-dir', default=None)
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(args.data_dir)
+    for username in args.usernames:
+        db_path = db_manager.get_db_path(username)
+        if not os.path.exists(db_path):
+            print(f"[WARN] No database for {username}")
+            continue
+        before = scan_stats(db_path)
+        converted = migrate(db_manager, username)
+        db_manager.dispose_all()
+        after = scan_stats(db_path)
+        print(f"[INFO] {username}: {converted}/{before['games']} games converted")
+        for label, stats in (('before', before), ('after', after)):
+            print(f"[INFO]   {label}: {stats['file_mb']}MB file, {stats['pgn_mb']}MB of PGN, "
+                  f"full games scan {stats['scan_ms']}ms")
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,49 @@ Multi-user database management for Chess Blunder Tracker
 SQLite only - for local use
 """
 
+import asyncio
 import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import sqlalchemy as sa
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Float
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Float, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 from typing import Optional
+import compact_pgn
+import metrics
+import sql_profiler
 
 Base = declarative_base()
 
+class CompactPGN(TypeDecorator):
+    """PGN text stored packed (see compact_pgn.py); rows written before that read back as they were"""
+    
+    # SQLite keeps the packed bytes as a BLOB in the existing text column, so no schema change is needed
+    impl = String
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return compact_pgn.encode(value)
+        return value
+    
+    def process_result_value(self, value, dialect):
+        if isinstance(value, bytes):
+            return compact_pgn.decode(value)
+        return value
+
+# Analysis quality of a game and its moves: none yet, quick provisional sweep, full depth
+QUALITY_NONE = 0
+QUALITY_QUICK = 1
+QUALITY_FULL = 2
+QUALITY_LEVELS = {'quick': QUALITY_QUICK, 'full': QUALITY_FULL}
+
 class Game(Base):
     __tablename__ = 'games'
     
@@ -28,10 +61,16 @@ class Game(Base):
     user_rating = Column(Integer)
     opponent_rating = Column(Integer)
     result = Column(String)
-    pgn = Column(String)
+    pgn = Column(CompactPGN)
     fully_analyzed = Column(Boolean, default=False)
     analysis_started_at = Column(DateTime)
     analysis_completed_at = Column(DateTime)
+    in_opening_tree = Column(Boolean, default=False)  # Counted in opening_nodes
+    analysis_quality = Column(Integer, default=QUALITY_NONE)  # QUALITY_* of the stored moves
+    
+    __table_args__ = (
+        Index('ix_games_played_at_id', 'played_at', 'id'),  # Keyset pagination
+    )
 
 class Move(Base):
     __tablename__ = 'moves'
@@ -49,19 +88,139 @@ class Move(Base):
     is_blunder = Column(Boolean, default=False)  # Centipawn loss >= 300
     is_mistake = Column(Boolean, default=False)  # Centipawn loss >= 100
     is_inaccuracy = Column(Boolean, default=False)  # Centipawn loss >= 50
+    position_hash = Column(Integer)  # Zobrist hash of the position before the move (signed 64-bit)
+    best_move = Column(String)  # Engine's best move in that position, SAN
+    analysis_quality = Column(Integer)  # From game: QUALITY_QUICK or QUALITY_FULL
+    
+    __table_args__ = (
+        Index('ix_moves_game_lichess_id', 'game_lichess_id'),
+        Index('ix_moves_blunder_played_at_id', 'is_blunder', 'played_at', 'id'),  # Keyset pagination
+        Index('ix_moves_position_hash_cp', 'position_hash', 'centipawn_loss'),  # Recurring positions
+    )
+
+class OpeningNode(Base):
+    """One move sequence from the start of the user's games, with running totals
+
+    Children of the start position have parent_id 0; white and black games form
+    separate trees. See opening_tree.py.
+    """
+    __tablename__ = 'opening_nodes'
+    
+    id = Column(Integer, primary_key=True)
+    user_color = Column(String, nullable=False)
+    parent_id = Column(Integer, nullable=False)
+    move_san = Column(String, nullable=False)
+    ply = Column(Integer, nullable=False)
+    games = Column(Integer, nullable=False, default=0)  # Games that reached this node
+    user_moves = Column(Integer, nullable=False, default=0)  # Analyzed user moves leading into it
+    cp_loss_total = Column(Integer, nullable=False, default=0)  # Their summed centipawn loss
+    blunders = Column(Integer, nullable=False, default=0)  # Of those moves, blunders
+    game_blunders = Column(Integer, nullable=False, default=0)  # Blunders anywhere in the games through this node
+    
+    __table_args__ = (
+        UniqueConstraint('user_color', 'parent_id', 'move_san', name='uq_opening_nodes_child'),
+    )
+
+class DataVersion(Base):
+    """Single-row counter bumped by every commit that changes games or moves"""
+    __tablename__ = 'data_version'
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+def bump_data_version(session):
+    """Increment the user's data version inside the session's pending transaction"""
+    session.execute(sa.text(
+        "INSERT INTO data_version (id, version) VALUES (1, 1) "
+        "ON CONFLICT(id) DO UPDATE SET version = version + 1"
+    ))
+
+# position_hash of moves whose position could not be recovered from the PGN
+UNKNOWN_POSITION = 0
+
+def to_signed64(value: int) -> int:
+    """Store an unsigned 64-bit hash in SQLite's signed INTEGER"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def from_signed64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+# Fills a column for existing rows right after it is added
+COLUMN_BACKFILLS = {
+    # Everything analyzed before quality levels existed was analyzed at full depth
+    ('games', 'analysis_quality'): f"UPDATE games SET analysis_quality = CASE WHEN fully_analyzed = 1 THEN {QUALITY_FULL} ELSE {QUALITY_NONE} END",
+    ('moves', 'analysis_quality'): f"UPDATE moves SET analysis_quality = {QUALITY_FULL}",
+}
+
+def upgrade_schema(engine):
+    """Bring an existing user database up to the current schema"""
+    # Columns added after a database was created; new columns are nullable
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}")
+                    if (table.name, column.name) in COLUMN_BACKFILLS:
+                        conn.exec_driver_sql(COLUMN_BACKFILLS[(table.name, column.name)])
+    
+    # create_all skips tables that already exist, including their indexes
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+# Analysis results are grouped into one transaction per this many games or seconds
+WRITE_BATCH_GAMES = int(os.environ.get('BLUNDER_WRITE_BATCH_GAMES', 10))
+WRITE_BATCH_SECONDS = float(os.environ.get('BLUNDER_WRITE_BATCH_SECONDS', 30))
+
+# Upper bound on per-user engines kept open at once, and how long an unused one may linger
+MAX_OPEN_DATABASES = int(os.environ.get('BLUNDER_MAX_OPEN_DATABASES', 32))
+DATABASE_IDLE_SECONDS = int(os.environ.get('BLUNDER_DATABASE_IDLE_SECONDS', 300))
+
+class UserSession(Session):
+    """A user's session that looks up the user's engine through the manager on every connect
+
+    A thread can keep its session between statements after the user's engine
+    was evicted; its next query then reopens the database through the manager,
+    where it is tracked (and can be evicted) again, instead of silently
+    reconnecting through the disposed engine.
+    """
+
+    def __init__(self, manager: 'DatabaseManager', username: str, **kwargs):
+        super().__init__(**kwargs)
+        self.manager = manager
+        self.username = username
+
+    def get_bind(self, *args, **kwargs):
+        engine = self.manager.engines.get(self.username)
+        if engine is None:
+            engine = self.manager.get_engine(self.username)
+            self.manager.thread_sessions.setdefault(self.username, weakref.WeakSet()).add(self)
+        return engine
 
 class DatabaseManager:
     """Manages SQLite databases for multiple users locally"""
     
-    def __init__(self, data_dir: Optional[str] = None):
+    def __init__(self, data_dir: Optional[str] = None, max_open: Optional[int] = None,
+                 idle_seconds: Optional[int] = None):
         if data_dir is None:
             data_dir = "data"
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
         print(f"[INFO] Using SQLite databases in {data_dir}")
         
-        self.engines = {}
-        self.sessions = {}
+        self.max_open = max_open if max_open is not None else MAX_OPEN_DATABASES
+        self.idle_seconds = idle_seconds if idle_seconds is not None else DATABASE_IDLE_SECONDS
+        
+        # Both dicts are kept in least-recently-used order (oldest first)
+        self.engines = OrderedDict()
+        self.sessions = OrderedDict()
+        # Every live session per user, whichever thread opened it; a thread's session goes when the thread does
+        self.thread_sessions = {}
+        self.last_used = {}
+        self._evicted = OrderedDict()  # Recently evicted usernames, to count reopens
+        self._lock = threading.RLock()
+        self.pool_stats = {'opens': 0, 'evictions': 0, 'reopens': 0}
     
     def get_connection_string(self, username: str) -> str:
         """Get the SQLite database connection string for a specific user"""
@@ -76,38 +235,143 @@ class DatabaseManager:
     
     def get_engine(self, username: str):
         """Get or create database engine for a user"""
-        if username not in self.engines:
-            connection_string = self.get_connection_string(username)
-            self.engines[username] = create_engine(connection_string, echo=False)
+        with self._lock:
+            if username not in self.engines:
+                connection_string = self.get_connection_string(username)
+                engine = create_engine(connection_string, echo=False)
+                self.engines[username] = sql_profiler.attach(metrics.instrument_engine(engine))
+                
+                # Create tables if they don't exist
+                Base.metadata.create_all(self.engines[username])
+                upgrade_schema(self.engines[username])
+                
+                self.pool_stats['opens'] += 1
+                if self._evicted.pop(username, None) is not None:
+                    self.pool_stats['reopens'] += 1
             
-            # Create tables if they don't exist
-            Base.metadata.create_all(self.engines[username])
-            
-        return self.engines[username]
+            self._touch(username)
+            engine = self.engines[username]
+            self._enforce_limits(keep=username)
+            return engine
     
     def get_session(self, username: str):
-        """Get or create database session for a user"""
-        if username not in self.sessions:
-            engine = self.get_engine(username)
-            Session = sessionmaker(bind=engine)
-            self.sessions[username] = Session()
+        """Get or create this thread's database session for a user
+
+        Requests and worker threads use the same user's database concurrently, so
+        each thread gets its own session; closing it never affects another thread.
+        """
+        with self._lock:
+            if username not in self.sessions:
+                self.get_engine(username)
+                make_session = sessionmaker(class_=UserSession, manager=self, username=username)
+                opened = self.thread_sessions.setdefault(username, weakref.WeakSet())
+                
+                def tracked_session():
+                    session = make_session()
+                    opened.add(session)
+                    return session
+                
+                self.sessions[username] = scoped_session(tracked_session)
             
-        return self.sessions[username]
+            self._touch(username)
+            return self.sessions[username]()
+    
+    def _touch(self, username: str):
+        """Mark a user's database as most recently used"""
+        self.last_used[username] = time.monotonic()
+        self.engines.move_to_end(username)
+        if username in self.sessions:
+            self.sessions.move_to_end(username)
+    
+    def _is_busy(self, username: str) -> bool:
+        """A checked-out connection or open transaction belongs to a running request or job, in any thread"""
+        engine = self.engines.get(username)
+        checkedout = getattr(engine.pool, 'checkedout', None) if engine is not None else None
+        if checkedout and checkedout():
+            return True
+        return any(session.in_transaction() for session in list(self.thread_sessions.get(username, ())))
+    
+    def _enforce_limits(self, keep: Optional[str] = None):
+        """Evict idle databases, then least recently used ones until under capacity"""
+        now = time.monotonic()
+        for username in list(self.engines.keys()):
+            if username == keep or self._is_busy(username):
+                continue
+            if now - self.last_used.get(username, now) > self.idle_seconds:
+                self.evict(username)
+        
+        # Busy databases are skipped, so the cap is soft while every open one is in use
+        for username in list(self.engines.keys()):
+            if len(self.engines) <= self.max_open:
+                break
+            if username == keep or self._is_busy(username):
+                continue
+            self.evict(username)
+    
+    def evict(self, username: str):
+        """Close every thread's session for a user and dispose of its engine and connection pool"""
+        with self._lock:
+            self._close_thread_sessions(username)
+            engine = self.engines.pop(username, None)
+            self.last_used.pop(username, None)
+            if engine is None:
+                return
+            engine.dispose()
+            self.pool_stats['evictions'] += 1
+            self._evicted[username] = True
+            while len(self._evicted) > self.max_open * 4:
+                self._evicted.popitem(last=False)
+    
+    def evict_idle(self):
+        """Evict databases that have not been used within the idle timeout"""
+        with self._lock:
+            self._enforce_limits()
+    
+    def get_pool_stats(self) -> dict:
+        """Get open/eviction counters for the per-user engine cache"""
+        with self._lock:
+            return {
+                'open': len(self.engines),
+                'capacity': self.max_open,
+                'idle_seconds': self.idle_seconds,
+                **self.pool_stats
+            }
     
     def get_db(self, username: str):
         """Get database session for a user (alias for get_session for Flask app compatibility)"""
         return self.get_session(username)
     
+    def get_data_version(self, username: str) -> int:
+        """Get the user's data version; it changes whenever games or moves are committed"""
+        session = self.get_session(username)
+        version = session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+        return version or 0
+    
     def close_session(self, username: str):
-        """Close database session for a user"""
-        if username in self.sessions:
-            self.sessions[username].close()
-            del self.sessions[username]
+        """Close this thread's session for a user; other threads' sessions are left alone"""
+        with self._lock:
+            if username in self.sessions:
+                self.sessions[username].remove()
+    
+    def _close_thread_sessions(self, username: str):
+        """Close the sessions every thread holds for a user and forget them"""
+        scoped = self.sessions.pop(username, None)
+        if scoped is not None:
+            scoped.remove()
+        for session in list(self.thread_sessions.pop(username, ())):
+            session.close()
     
     def close_all_sessions(self):
-        """Close all database sessions"""
-        for username in list(self.sessions.keys()):
-            self.close_session(username)
+        """Close all database sessions, in every thread"""
+        with self._lock:
+            for username in list(self.sessions.keys()):
+                self._close_thread_sessions(username)
+    
+    def dispose_all(self):
+        """Close all sessions and dispose of every open engine"""
+        with self._lock:
+            for username in list(self.engines.keys()):
+                self.evict(username)
     
     def get_game_count(self, username: str) -> int:
         """Get total number of games for a user"""
@@ -129,7 +393,7 @@ class DatabaseManager:
         session = self.get_session(username)
         return session.query(Game).filter(Game.lichess_id == lichess_id).first() is not None
     
-    def add_game(self, username: str, game_data: dict) -> Game:
+    def add_game(self, username: str, game_data: dict, commit: bool = True) -> Game:
         """Add a new game for a user"""
         session = self.get_session(username)
         
@@ -149,10 +413,12 @@ class DatabaseManager:
         )
         
         session.add(game)
-        session.commit()
+        if commit:
+            bump_data_version(session)
+            session.commit()
         return game
     
-    def update_game_analysis(self, username: str, lichess_id: str, analysis_data: dict):
+    def update_game_analysis(self, username: str, lichess_id: str, analysis_data: dict, commit: bool = True):
         """Update game analysis status"""
         session = self.get_session(username)
         game = session.query(Game).filter(Game.lichess_id == lichess_id).first()
@@ -160,9 +426,11 @@ class DatabaseManager:
         if game:
             for key, value in analysis_data.items():
                 setattr(game, key, value)
-            session.commit()
+            if commit:
+                bump_data_version(session)
+                session.commit()
     
-    def add_moves(self, username: str, moves_data: list):
+    def add_moves(self, username: str, moves_data: list, commit: bool = True):
         """Add multiple moves for a user"""
         session = self.get_session(username)
         
@@ -172,7 +440,9 @@ class DatabaseManager:
             moves.append(move)
         
         session.add_all(moves)
-        session.commit()
+        if commit:
+            bump_data_version(session)
+            session.commit()
     
     def get_user_stats(self, username: str) -> dict:
         """Get comprehensive stats for a user"""
@@ -192,3 +462,146 @@ class DatabaseManager:
             'total_inaccuracies': total_inaccuracies,
             'blunder_rate': (total_blunders / total_moves * 100) if total_moves > 0 else 0
         }
+
+
+_shared_manager = None
+_shared_lock = threading.Lock()
+
+def shared_db_manager() -> DatabaseManager:
+    """The process-wide DatabaseManager for the default data directory
+
+    The web app and every job in the process use it, so a user's database is
+    opened and schema-checked once rather than on every analysis slice.
+    """
+    global _shared_manager
+    with _shared_lock:
+        if _shared_manager is None:
+            _shared_manager = DatabaseManager()
+        return _shared_manager
+
+class DatabaseThread:
+    """A thread that owns one user's session and runs a coroutine's database work in order
+
+    SQLite commits wait on fsync; run on the event loop they stall the engine
+    search and every other coroutine sharing it. Functions are called as
+    fn(session, ...) on this thread only. submit() queues work without waiting,
+    so a commit can proceed while the caller goes on searching; its errors are
+    raised by the next check() or close().
+    """
+    
+    def __init__(self, db_manager: DatabaseManager, username: str):
+        self.db_manager = db_manager
+        self.username = username
+        self.session = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'db-{username}')
+        self.queued = []
+    
+    def _call(self, fn, args, kwargs):
+        if self.session is None:
+            self.session = self.db_manager.get_db(self.username)
+        return fn(self.session, *args, **kwargs)
+    
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(session, ...) and return its concurrent.futures.Future"""
+        self.check()
+        future = self.executor.submit(self._call, fn, args, kwargs)
+        self.queued.append(future)
+        return future
+    
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(session, ...) after everything queued before it and return its result"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            # Its error, if any, has reached the caller already
+            if future in self.queued:
+                self.queued.remove(future)
+    
+    def check(self):
+        """Raise the error of any finished queued call"""
+        finished = [future for future in self.queued if future.done()]
+        self.queued = [future for future in self.queued if future not in finished]
+        for future in finished:
+            if future.exception() is not None:
+                raise future.exception()
+    
+    async def close(self):
+        """Wait for queued work, close the session and stop the thread; raises a queued call's error"""
+        try:
+            if self.queued:
+                await asyncio.wait([asyncio.wrap_future(future) for future in self.queued])
+            self.check()
+        finally:
+            await asyncio.wrap_future(self.executor.submit(self._close_session))
+            self.executor.shutdown(wait=False)
+    
+    def _close_session(self):
+        if self.session is not None:
+            self.db_manager.close_session(self.username)
+
+class WriteBatcher:
+    """Groups finished games' moves and status updates into few transactions
+
+    A game's moves and its status are always committed together, so a crash only
+    loses unflushed games, which stay unanalyzed.
+    """
+    
+    def __init__(self, session, max_games: Optional[int] = None, max_seconds: Optional[float] = None):
+        self.session = session
+        self.max_games = max_games if max_games is not None else WRITE_BATCH_GAMES
+        self.max_seconds = max_seconds if max_seconds is not None else WRITE_BATCH_SECONDS
+        self.pending = []  # (game, column values, Move rows, callback)
+        self.oldest_pending_at = None
+        self.stats = {'commits': 0, 'games_written': 0, 'moves_written': 0, 'commit_seconds': 0.0}
+    
+    def stage(self, game, values: dict, moves: Optional[list] = None, after=None):
+        """Queue a game's column updates and moves; flushes when a threshold is reached
+
+        `after(session)` runs in the same transaction, for derived data such as
+        the opening tree.
+        """
+        if not self.pending:
+            self.oldest_pending_at = time.monotonic()
+        self.pending.append((game, values, moves or [], after))
+        if self.should_flush():
+            self.flush()
+    
+    def should_flush(self) -> bool:
+        """True when the batch is large or old enough to commit"""
+        if not self.pending:
+            return False
+        if len(self.pending) >= self.max_games:
+            return True
+        return time.monotonic() - self.oldest_pending_at >= self.max_seconds
+    
+    def flush(self):
+        """Write every pending game in a single transaction"""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        self.oldest_pending_at = None
+        
+        try:
+            moves_written = 0
+            for game, values, moves, after in pending:
+                for key, value in values.items():
+                    setattr(game, key, value)
+                self.session.add_all(moves)
+                moves_written += len(moves)
+                if after is not None:
+                    after(self.session)
+            bump_data_version(self.session)
+            
+            commit_start = time.perf_counter()
+            self.session.commit()
+            commit_seconds = time.perf_counter() - commit_start
+            self.stats['commit_seconds'] += commit_seconds
+            metrics.COMMIT_SECONDS.observe(commit_seconds, source='analysis')
+        except Exception:
+            self.session.rollback()
+            raise
+        
+        self.stats['commits'] += 1
+        self.stats['games_written'] += len(pending)
+        self.stats['moves_written'] += moves_written
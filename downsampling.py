@@ -0,0 +1,55 @@
+"""
+Server-side downsampling for chart series
+"""
+
+from typing import List, Optional
+
+def lttb(rows: List[dict], threshold: int, x_key: str, y_key: str) -> List[dict]:
+    """Largest-Triangle-Three-Buckets: keep `threshold` rows that best preserve the curve shape
+
+    Rows must already be sorted by x. The first and last rows are always kept.
+    """
+    if threshold >= len(rows) or threshold < 3:
+        return rows
+
+    def point(row):
+        return float(row[x_key]), float(row[y_key] or 0)
+
+    sampled = [rows[0]]
+    bucket_size = (len(rows) - 2) / (threshold - 2)
+    a = 0  # Index of the previously selected point
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third vertex of the triangle
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, len(rows))
+        next_points = [point(r) for r in rows[next_start:next_end]] or [point(rows[-1])]
+        avg_x = sum(p[0] for p in next_points) / len(next_points)
+        avg_y = sum(p[1] for p in next_points) / len(next_points)
+
+        # Pick the point in this bucket forming the largest triangle
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = point(rows[a])
+        best_index, best_area = start, -1.0
+        for j in range(start, end):
+            bx, by = point(rows[j])
+            area = abs((ax - avg_x) * (by - ay) - (ax - bx) * (avg_y - ay))
+            if area > best_area:
+                best_index, best_area = j, area
+
+        sampled.append(rows[best_index])
+        a = best_index
+
+    sampled.append(rows[-1])
+    return sampled
+
+def parse_point_limit(value: Optional[str], maximum: int = 5000) -> Optional[int]:
+    """Parse a `points` query parameter, clamped to a sane range"""
+    if not value:
+        return None
+    try:
+        points = int(value)
+    except ValueError:
+        return None
+    return max(3, min(points, maximum))
@@ -20,6 +20,9 @@ interface OperationStatus {
     error?: string;
   } | null;
   progress: any;
+  job_state?: 'queued' | 'running' | null;
+  queue_position?: number | null;
+  estimated_wait_seconds?: number | null;
 }
 
 export const WorkflowPanel: React.FC<WorkflowPanelProps> = ({ onStatsUpdate, username, onUsernameChange }) => {
@@ -31,7 +34,6 @@ export const WorkflowPanel: React.FC<WorkflowPanelProps> = ({ onStatsUpdate, use
   // Remove local threshold state - now using props
   
   const [isLoading, setIsLoading] = useState(false);
-  const [keepAliveSession, setKeepAliveSession] = useState<{ stop: () => void } | null>(null);
   const [operationStatus, setOperationStatus] = useState<OperationStatus>({
     fetching: false,
     analyzing: false,
@@ -44,99 +46,68 @@ export const WorkflowPanel: React.FC<WorkflowPanelProps> = ({ onStatsUpdate, use
   const [countdown, setCountdown] = useState<number | null>(null);
   const [estimatedTimeRemaining, setEstimatedTimeRemaining] = useState<number | null>(null);
 
-  // Keep-alive pings to prevent session timeout
+  // Live operation status over Server-Sent Events; the open stream also keeps the session alive
   useEffect(() => {
-    // Clean up previous session if it exists
-    if (keepAliveSession) {
-      keepAliveSession.stop();
-    }
-    
-    // Start new keep-alive session if username is provided
-    if (username) {
-      const session = apiService.startPingInterval(username, 30000); // ping every 30 seconds
-      setKeepAliveSession(session);
-    }
-    
-    return () => {
-      if (keepAliveSession) keepAliveSession.stop();
-    };
-    // eslint-disable-next-line react-hooks/exhaustive-deps
+    if (!username) return;
+    const stream = apiService.subscribeProgress(username, setOperationStatus);
+    return () => stream.stop();
   }, [username]);
   
-  // Poll for operation status and stats
+  // Refresh stats whenever another game finishes (cheap: unchanged data answers 304)
+  const gamesDone = (operationStatus.progress?.games_analyzed ?? 0) + (operationStatus.progress?.games_skipped ?? 0);
+  useEffect(() => {
+    if (!username || (currentStep !== 'fetch' && currentStep !== 'analyze')) return;
+    apiService.getStats(username).then(setStats).catch(error => console.error('Error loading stats:', error));
+  }, [username, currentStep, gamesDone, operationStatus.fetching, operationStatus.analyzing]);
+  
+  // React to status pushed by the server
   useEffect(() => {
-    let interval: NodeJS.Timeout;
+    if (currentStep !== 'fetch' && currentStep !== 'analyze') return;
+    
+    // Update time estimates for analysis
+    if (currentStep === 'analyze' && operationStatus.analyzing && operationStatus.progress) {
+      const progress = operationStatus.progress;
+      
+      // ETA is computed by the server from its own timing
+      if (progress.eta_seconds !== undefined && progress.eta_seconds !== null) {
+        setEstimatedTimeRemaining(progress.eta_seconds);
+      }
+      
+      // Update countdown for current game (per-game time limit)
+      if (progress.time_limit_per_game) {
+        setCountdown(progress.time_limit_per_game);
+      }
+    }
     
-    if (currentStep === 'fetch' || currentStep === 'analyze') {
-      interval = setInterval(async () => {
-        try {
-          const newStats = await apiService.getStats(username);
-          setStats(newStats);
-          setOperationStatus(newStats.operation_status);
-          
-          // Calculate countdown and time estimates for analysis
-          if (currentStep === 'analyze' && newStats.operation_status.analyzing && newStats.operation_status.progress) {
-            const progress = newStats.operation_status.progress;
-            
-            // Calculate time remaining estimates
-            if (progress.start_time && progress.current > 0) {
-              const startTime = new Date(progress.start_time).getTime();
-              const now = Date.now();
-              const elapsedSeconds = (now - startTime) / 1000;
-              const avgTimePerGame = elapsedSeconds / progress.current;
-              const remainingGames = progress.total - progress.current;
-              const estimatedRemaining = remainingGames * avgTimePerGame;
-              setEstimatedTimeRemaining(Math.round(estimatedRemaining));
-            }
-            
-            // Update countdown for current game (per-game time limit)
-            if (progress.time_limit_per_game) {
-              setCountdown(progress.time_limit_per_game);
-            }
-          }
-          
-          // Check if operations are complete
-          if (currentStep === 'fetch' && !newStats.operation_status.fetching) {
-            if (newStats.operation_status.last_operation?.type === 'fetch') {
-              if (newStats.operation_status.last_operation?.error) {
-                setError(newStats.operation_status.last_operation.error);
-                setCurrentStep('input');
-              } else {
-                setStatusMessage('Games fetched successfully! Ready to analyze.');
-                setCurrentStep('analyze');
-              }
-            }
-          }
-          
-          if (currentStep === 'analyze' && !newStats.operation_status.analyzing) {
-            if (newStats.operation_status.last_operation?.type === 'analyze') {
-              if (newStats.operation_status.last_operation?.error) {
-                setError(newStats.operation_status.last_operation.error);
-                setCurrentStep('input');
-              } else {
-                setStatusMessage('Analysis completed successfully!');
-                setCurrentStep('complete');
-                onStatsUpdate?.();
-              }
-            }
-            // Clear countdown when analysis finishes
-            setCountdown(null);
-            setEstimatedTimeRemaining(null);
-          }
-        } catch (error) {
-          console.error('Error polling status:', error);
+    // Check if operations are complete
+    if (currentStep === 'fetch' && !operationStatus.fetching) {
+      if (operationStatus.last_operation?.type === 'fetch') {
+        if (operationStatus.last_operation?.error) {
+          setError(operationStatus.last_operation.error);
+          setCurrentStep('input');
+        } else {
+          setStatusMessage('Games fetched successfully! Ready to analyze.');
+          setCurrentStep('analyze');
         }
-      }, 2000);
+      }
     }
     
-    return () => {
-      if (interval) clearInterval(interval);
-      // Clean up keep-alive session when component unmounts
-      if (keepAliveSession) {
-        keepAliveSession.stop();
+    if (currentStep === 'analyze' && !operationStatus.analyzing) {
+      if (operationStatus.last_operation?.type === 'analyze') {
+        if (operationStatus.last_operation?.error) {
+          setError(operationStatus.last_operation.error);
+          setCurrentStep('input');
+        } else {
+          setStatusMessage(operationStatus.last_operation?.result || 'Analysis completed successfully!');
+          setCurrentStep('complete');
+          onStatsUpdate?.();
+        }
       }
-    };
-  }, [currentStep, onStatsUpdate, username, keepAliveSession]);
+      // Clear countdown when analysis finishes
+      setCountdown(null);
+      setEstimatedTimeRemaining(null);
+    }
+  }, [operationStatus, currentStep, onStatsUpdate]);
 
   const handleFetchGames = async (fetchOlder: boolean = false) => {
     if (!username.trim()) {
@@ -195,6 +166,15 @@ export const WorkflowPanel: React.FC<WorkflowPanelProps> = ({ onStatsUpdate, use
     }
   };
 
+  const handleCancel = async () => {
+    const result = await apiService.cancelOperations(username.trim());
+    if (result.success) {
+      setStatusMessage(result.message);
+    } else {
+      setError(result.message);
+    }
+  };
+
   const handleReset = () => {
     setCurrentStep('input');
     setStatusMessage('');
@@ -388,6 +368,20 @@ export const WorkflowPanel: React.FC<WorkflowPanelProps> = ({ onStatsUpdate, use
                   <div className="text-center">
                     <div className="w-8 h-8 border-4 border-green-500 border-t-transparent rounded-full animate-spin mx-auto mb-2"></div>
                     <p className="text-sm text-gray-600">Analyzing games...</p>
+                    <button
+                      onClick={handleCancel}
+                      className="mt-1 text-xs text-red-600 hover:text-red-800 underline"
+                    >
+                      Stop analysis
+                    </button>
+                    
+                    {/* Waiting for an engine slot (slots rotate between users game by game) */}
+                    {operationStatus.job_state === 'queued' && !!operationStatus.queue_position && (
+                      <p className="text-xs text-gray-500 mt-1">
+                        Waiting for an engine: position {operationStatus.queue_position + 1} in queue
+                        {!!operationStatus.estimated_wait_seconds && ` (~${formatTime(operationStatus.estimated_wait_seconds)})`}
+                      </p>
+                    )}
                     
                     {/* Progress Bar */}
                     {operationStatus.progress?.total > 0 && (
@@ -19,6 +19,7 @@ export interface GameStats {
     total: number;
     analyzed: number;
     unanalyzed: number;
+    provisional?: number;
     analysis_progress: number;
     latest_date: string | null;
     oldest_date: string | null;
@@ -35,6 +36,7 @@ export interface GameStats {
   operation_status: {
     analyzing: boolean;
     fetching: boolean;
+    deepening?: boolean;
     last_operation: {
       type: string;
       completed_at: string;
@@ -42,6 +44,9 @@ export interface GameStats {
       error?: string;
     } | null;
     progress: Record<string, any>;
+    job_state?: 'queued' | 'running' | null;
+    queue_position?: number | null;  // Jobs ahead of ours waiting for an engine slot
+    estimated_wait_seconds?: number | null;
   };
   time_controls: Array<{
     name: string;
@@ -56,13 +61,31 @@ export interface GameStats {
 }
 
 export interface GameData {
-  game_id: string;
+  lichess_id: string;
   played_at: string;
   time_control: string;
-  opponent_rating: number;
-  result: string;
   opening_name: string;
+  user_color: string;
+  user_rating: number | null;
+  opponent_rating: number | null;
+  result: string;
   fully_analyzed: boolean;
+  moves_count: number;
+  blunders_count: number;
+}
+
+export interface GamePage {
+  games: GameData[];
+  next_cursor: string | null;  // Pass back as `cursor` to fetch the next (older) page
+}
+
+export interface ListingOptions {
+  cursor?: string;
+  limit?: number;
+  speed?: string;
+  opening?: string;
+  date_from?: string;
+  date_to?: string;
 }
 
 export interface MoveData {
@@ -90,6 +113,7 @@ export interface PerformanceData {
   user_rating: number | null;
   opponent_rating: number | null;
   opponent_blunder_rate?: number; // Simulated opponent blunder rate percentage
+  games?: number; // Number of games in the period when bucketed
 }
 
 export interface FilterOptions {
@@ -98,6 +122,31 @@ export interface FilterOptions {
   dateRange?: [string, string];
   opening?: string;
   rollingWindow?: number;
+  bucket?: 'day' | 'week' | 'month';  // Aggregate games per period on the server
+  // Downsample the per-game series to at most this many points. LTTB keeps extreme games, so a
+  // rolling average over the result is not a per-game average; the chart does not set it
+  points?: number;
+}
+
+// Row lists sent as one array per field (requested with format=columns)
+export interface ColumnarRows {
+  format: 'columns';
+  length: number;
+  columns: Record<string, any[]>;
+}
+
+// Rebuild row objects from a columnar response
+export function fromColumns<T>(table: ColumnarRows): T[] {
+  const fields = Object.keys(table.columns);
+  const rows = new Array<T>(table.length);
+  for (let i = 0; i < table.length; i++) {
+    const row: any = {};
+    for (const field of fields) {
+      row[field] = table.columns[field][i];
+    }
+    rows[i] = row;
+  }
+  return rows;
 }
 
 class ApiService {
@@ -115,8 +164,9 @@ class ApiService {
     return response.data;
   }
 
-  async getGames(): Promise<GameData[]> {
-    const response = await this.axios.get<GameData[]>('/api/games');
+  async getGames(username: string, options: ListingOptions = {}): Promise<GamePage> {
+    const params = { ...options, username };
+    const response = await this.axios.get<GamePage>('/api/games', { params });
     return response.data;
   }
 
@@ -126,9 +176,10 @@ class ApiService {
   }
 
   async getPerformanceData(username: string, filters?: FilterOptions): Promise<PerformanceData[]> {
-    const params = { ...filters, username };
-    const response = await this.axios.get<PerformanceData[]>('/api/performance', { params });
-    return response.data;
+    // Every game is requested so the chart's rolling averages are over real games
+    const params: any = { ...filters, username, format: 'columns' };
+    const response = await this.axios.get<ColumnarRows>('/api/performance', { params });
+    return fromColumns<PerformanceData>(response.data);
   }
 
   async fetchGames(username: string, count: number = 50, fetchOlder: boolean = false): Promise<{ success: boolean; message: string }> {
@@ -210,6 +261,18 @@ class ApiService {
     }
   }
   
+  async cancelOperations(username: string): Promise<{ success: boolean; message: string }> {
+    try {
+      const response = await this.axios.post<{ message: string }>('/api/cancel', { username });
+      return { success: true, message: response.data.message };
+    } catch (error: any) {
+      return {
+        success: false,
+        message: error.response?.data?.error || error.message || 'Failed to cancel'
+      };
+    }
+  }
+
   async ping(username: string): Promise<{
     status: string;
     username: string;
@@ -230,6 +293,25 @@ class ApiService {
     }
   }
   
+  // Subscribe to pushed operation status; the open stream also keeps the user's session alive
+  subscribeProgress(username: string, onStatus: (status: GameStats['operation_status']) => void): { stop: () => void } {
+    const url = `${API_BASE_URL}/api/progress/stream?username=${encodeURIComponent(username)}`;
+    const source = new EventSource(url);
+    source.addEventListener('status', (event) => {
+      try {
+        onStatus(JSON.parse((event as MessageEvent).data));
+      } catch (error) {
+        console.error('Invalid progress event:', error);
+      }
+    });
+    // EventSource reconnects on its own after network errors
+    source.onerror = () => console.log('Progress stream interrupted, reconnecting...');
+    
+    return {
+      stop: () => source.close()
+    };
+  }
+  
   // Start a keep-alive ping interval for a user
   startPingInterval(username: string, intervalMs: number = 30000): { stop: () => void } {
     const intervalId = setInterval(async () => {
@@ -1,56 +1,81 @@
 import chess
 import chess.pgn
 import chess.engine
+import chess.polyglot
 import asyncio
 from datetime import datetime, timedelta
 import io
 import time
 import os
 import shutil
+import subprocess
+import threading
+import metrics
+import tablebase
+from scheduler import ENGINE_HASH_MB, ENGINE_THREADS
+from cancellation import AnalysisCancelled
 
-class GameAnalyzer:
-    def __init__(self, engine_path=None):
-        """Initialize GameAnalyzer with automatic Stockfish detection"""
-        if engine_path:
-            self.engine_path = engine_path
-        else:
-            self.engine_path = self._find_stockfish_engine()
-    
-    def _find_stockfish_engine(self):
-        """Automatically find Stockfish engine path across different environments"""
-        # Check environment variable first
-        env_path = os.getenv('STOCKFISH_PATH')
-        if env_path and os.path.isfile(env_path):
-            print(f"[INFO] Using Stockfish from STOCKFISH_PATH: {env_path}")
-            return env_path
+# Search depth of a full analysis, and of the quick sweep run first over a backlog
+FULL_DEPTH = 15
+QUICK_DEPTH = int(os.environ.get('BLUNDER_QUICK_DEPTH', 8))
+
+# A candidate binary must answer the UCI handshake within this long to be used
+UCI_HANDSHAKE_SECONDS = 10
+
+# Start engine discovery (and tablebase loading) in the background at boot; no engine is kept running
+PREWARM_DISCOVERY = os.environ.get('BLUNDER_PREWARM_DISCOVERY', '0') == '1'
+
+_engine_path = None
+_engine_lock = threading.Lock()
+
+def check_uci(path):
+    """Name the engine reports if `path` completes a UCI handshake, else None"""
+    try:
+        result = subprocess.run([path], input='uci\nquit\n', capture_output=True, text=True,
+                                timeout=UCI_HANDSHAKE_SECONDS)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if 'uciok' not in result.stdout:
+        return None
+    for line in result.stdout.splitlines():
+        if line.startswith('id name '):
+            return line[len('id name '):].strip()
+    return path
+
+def find_stockfish_engine():
+    """Path of a working Stockfish, searched for and checked once per process"""
+    global _engine_path
+    if _engine_path is not None:
+        return _engine_path
+    with _engine_lock:
+        if _engine_path is not None:
+            return _engine_path
         
-        # Common Stockfish locations to check
-        possible_paths = [
+        # Check environment variable first, then PATH, then common locations
+        candidates = [os.getenv('STOCKFISH_PATH'), shutil.which("stockfish")] + [
             # Cloud/Linux environments (most common)
             "/usr/bin/stockfish",
-            "/usr/local/bin/stockfish", 
-            "stockfish",  # If in PATH
+            "/usr/local/bin/stockfish",
+            "stockfish",
             # macOS Homebrew
             "/opt/homebrew/bin/stockfish",
-            "/usr/local/bin/stockfish",
             # Windows
             "stockfish.exe",
             # Alternative names
             "/usr/games/stockfish",
             "/app/stockfish"  # Some cloud platforms
         ]
-        
-        # First, try to find it in PATH
-        stockfish_in_path = shutil.which("stockfish")
-        if stockfish_in_path:
-            print(f"[INFO] Found Stockfish in PATH: {stockfish_in_path}")
-            return stockfish_in_path
-        
-        # Then check each possible path
-        for path in possible_paths:
-            if os.path.isfile(path):
-                print(f"[INFO] Found Stockfish at: {path}")
+        checked = set()
+        for path in candidates:
+            if not path or path in checked or not os.path.isfile(path):
+                continue
+            checked.add(path)
+            name = check_uci(path)
+            if name:
+                print(f"[INFO] Using Stockfish at {path} ({name})")
+                _engine_path = path
                 return path
+            print(f"[WARN] {path} did not complete a UCI handshake; skipping it")
         
         # If not found, raise an informative error
         raise FileNotFoundError(
@@ -61,10 +86,60 @@ class GameAnalyzer:
             "- Or set STOCKFISH_PATH environment variable to the engine location\n"
             "- Cloud platforms: Ensure stockfish package is installed in build script"
         )
+
+def prewarm_discovery():
+    """Find the engine binary and open the tablebases on a background thread, so the first job doesn't wait"""
+    def run():
+        started = time.perf_counter()
+        try:
+            find_stockfish_engine()
+            tablebase.get_tablebase()
+        except FileNotFoundError as e:
+            print(f"[WARN] Engine discovery prewarm failed: {e.args[0].splitlines()[0]}")
+            return
+        print(f"[INFO] Engine discovery prewarmed in {time.perf_counter() - started:.2f}s")
+    thread = threading.Thread(target=run, name='engine-discovery-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+class GameAnalyzer:
+    def __init__(self, engine_path=None, threads=None, hash_mb=None):
+        """Initialize GameAnalyzer with automatic Stockfish detection"""
+        if engine_path:
+            self.engine_path = engine_path
+        else:
+            self.engine_path = self._find_stockfish_engine()
+        # Threads per engine; engine slots are sized from this (see scheduler.py)
+        self.threads = threads if threads is not None else ENGINE_THREADS
+        self.hash_mb = hash_mb if hash_mb is not None else ENGINE_HASH_MB
+    
+    async def open_engine(self):
+        """Start a Stockfish process with this analyzer's Threads and Hash"""
+        transport, engine = await chess.engine.popen_uci(self.engine_path)
+        options = {}
+        if self.threads > 1:
+            options['Threads'] = self.threads
+        if self.hash_mb:
+            options['Hash'] = self.hash_mb
+        if tablebase.SYZYGY_PATH:
+            options['SyzygyPath'] = tablebase.SYZYGY_PATH
+        if options:
+            await engine.configure(options)
+        return engine
+    
+    def _find_stockfish_engine(self):
+        """Automatically find Stockfish engine path across different environments"""
+        return find_stockfish_engine()
         
-    async def analyze_game_with_time_limit(self, pgn_text, user_color, time_limit_seconds=300):
-        """Analyze a game with a time limit. Returns (success, move_evaluations)"""
-        start_time = time.time()
+    async def analyze_game_with_time_limit(self, pgn_text, user_color, time_limit_seconds=300,
+                                           cancel_token=None, resume=None, depth=FULL_DEPTH):
+        """Analyze a game with a time limit. Returns (success, move_evaluations)
+
+        cancel_token is checked between plies and raises AnalysisCancelled with the
+        partial evaluations; passing those back as resume continues at that ply.
+        """
+        start_time = time.time() - (resume or {}).get('elapsed_seconds', 0)
+        resume_ply = (resume or {}).get('ply', 0)
         
         try:
             # Parse PGN
@@ -75,14 +150,23 @@ class GameAnalyzer:
                 return False, []
             
             # Start engine
-            transport, engine = await chess.engine.popen_uci(self.engine_path)
+            engine = await self.open_engine()
             
-            move_evaluations = []
+            move_evaluations = list((resume or {}).get('move_evaluations', []))
             board = game.board()
             move_number = 1
             
             try:
                 for move in game.mainline_moves():
+                    # Plies already evaluated before a preemption
+                    if move_number <= resume_ply:
+                        board.push(move)
+                        move_number += 1
+                        continue
+                    
+                    if cancel_token:
+                        cancel_token.check(move_evaluations, move_number - 1, time.time() - start_time)
+                    
                     # Check time limit
                     if time.time() - start_time > time_limit_seconds:
                         print(f"Time limit reached at move {move_number}")
@@ -95,15 +179,17 @@ class GameAnalyzer:
                     if is_user_move:
                         # Get move in SAN notation BEFORE making the move
                         move_san = board.san(move)
+                        position_hash = chess.polyglot.zobrist_hash(board)
                         
                         # Get position before move
-                        eval_before = await engine.analyse(board, chess.engine.Limit(depth=15))
+                        eval_before = await self._analyse(engine, board, depth)
+                        best_move = self.best_move_san(board, eval_before)
                         
                         # Make the move
                         board.push(move)
                         
                         # Get position after move
-                        eval_after = await engine.analyse(board, chess.engine.Limit(depth=15))
+                        eval_after = await self._analyse(engine, board, depth, with_best_move=False)
                         
                         # Calculate centipawn loss
                         centipawn_loss = self.calculate_centipawn_loss(
@@ -113,7 +199,9 @@ class GameAnalyzer:
                         move_evaluations.append({
                             'move_number': move_number,
                             'move_san': move_san,
-                            'centipawn_loss': centipawn_loss
+                            'centipawn_loss': centipawn_loss,
+                            'position_hash': position_hash,
+                            'best_move': best_move
                         })
                     else:
                         # Just make the move without analysis
@@ -126,10 +214,36 @@ class GameAnalyzer:
             finally:
                 await engine.quit()
                 
+        except AnalysisCancelled:
+            raise
         except Exception as e:
             print(f"Error analyzing game: {e}")
             return False, []
     
+    async def _analyse(self, engine, board, depth, with_best_move=True):
+        """Run one engine search, recording its latency and node count
+
+        Endgames covered by the Syzygy tables (see tablebase.py) are answered
+        from them without searching.
+        """
+        info = tablebase.probe(board, with_best_move)
+        if info is not None:
+            return info
+        started = time.perf_counter()
+        info = await engine.analyse(board, chess.engine.Limit(depth=depth))
+        metrics.observe_engine_search(depth, time.perf_counter() - started, info, threading.current_thread().name)
+        return info
+    
+    def best_move_san(self, board, info):
+        """First move of the engine's principal variation, in SAN"""
+        pv = info.get('pv')
+        if not pv:
+            return None
+        try:
+            return board.san(pv[0])
+        except (ValueError, AssertionError):
+            return None
+    
     def calculate_centipawn_loss(self, score_before, score_after, user_color):
         """Calculate centipawn loss for a move"""
         try:
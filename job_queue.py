@@ -0,0 +1,543 @@
+"""
+Durable SQLite-backed job queue shared by the web process and analysis workers
+
+jobs.db is also the control database for the web tier: user activity and
+engine admission live here, so every web and worker process sees the same
+state whatever WSGI server or process count is used.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, UTC
+from typing import Optional
+
+import sqlalchemy as sa
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Index
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import aliased, sessionmaker
+
+from scheduler import (ANALYSIS_QUANTUM_SECONDS, ANALYSIS_SLICE_GAMES, DEFAULT_GAME_SECONDS, MAX_RUNNING_ANALYSES,
+                       estimate_wait_seconds)
+import metrics
+import sql_profiler
+
+QueueBase = declarative_base()
+
+# A running job whose worker has not heartbeated for this long is handed to another worker
+JOB_LEASE_SECONDS = int(os.environ.get('BLUNDER_JOB_LEASE_SECONDS', 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get('BLUNDER_JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BACKOFF_SECONDS = int(os.environ.get('BLUNDER_JOB_RETRY_BACKOFF_SECONDS', 30))
+
+JOB_KINDS = ('fetch', 'analyze')
+ACTIVE_STATES = ('queued', 'running')
+
+# Most jobs of a kind running at once across all workers; kinds not listed are unlimited
+MAX_RUNNING = {'analyze': MAX_RUNNING_ANALYSES}
+
+# Claim order: every queued foreground job is served before any background job
+FOREGROUND_PRIORITY = 0
+BACKGROUND_PRIORITY = 1  # e.g. deepening a quick analysis to full depth
+
+# A process writes a user's activity timestamp at most this often
+ACTIVITY_WRITE_SECONDS = 5
+
+class Job(QueueBase):
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # 'fetch' or 'analyze'
+    params = Column(Text, nullable=False, default='{}')  # JSON arguments for the job
+    state = Column(String, nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    priority = Column(Integer, default=FOREGROUND_PRIORITY)  # FOREGROUND_PRIORITY or BACKGROUND_PRIORITY
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=JOB_MAX_ATTEMPTS)
+    run_after = Column(DateTime, nullable=False)  # Not claimable before this time (retry backoff)
+    worker_id = Column(String)
+    claim_token = Column(String)
+    lease_expires_at = Column(DateTime)
+    cancel_requested = Column(String)  # Reason a running job was asked to stop, checked on heartbeat
+    progress = Column(Text)  # JSON, written with each heartbeat
+    result = Column(Text)  # JSON
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_jobs_state_run_after', 'state', 'run_after', 'id'),
+        Index('ix_jobs_username_kind', 'username', 'kind', 'id'),
+    )
+
+    def to_dict(self) -> dict:
+        """Convert to a JSON-ready dict"""
+        return {
+            'id': self.id,
+            'username': self.username,
+            'kind': self.kind,
+            'params': json.loads(self.params or '{}'),
+            'state': self.state,
+            'priority': self.priority or FOREGROUND_PRIORITY,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'worker_id': self.worker_id,
+            'progress': json.loads(self.progress) if self.progress else {},
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class UserActivity(QueueBase):
+    __tablename__ = 'user_activity'
+
+    username = Column(String, primary_key=True)
+    last_active = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_user_activity_last_active', 'last_active'),
+    )
+
+def utcnow() -> datetime:
+    """Naive UTC timestamp, as SQLite stores datetimes without a zone"""
+    return datetime.now(UTC).replace(tzinfo=None)
+
+def _priority():
+    """Job priority, counting rows from before the column existed as foreground"""
+    return sa.func.coalesce(Job.priority, FOREGROUND_PRIORITY)
+
+def _user_running_other(now: datetime, ignore_id: Optional[int] = None):
+    """True for a job whose user has another job of its kind (other than ignore_id) running under a live lease"""
+    other = aliased(Job)
+    running = sa.select(other.id).where(
+        other.username == Job.username, other.kind == Job.kind, other.id != Job.id,
+        other.state == 'running', other.lease_expires_at >= now
+    )
+    if ignore_id is not None:
+        running = running.where(other.id != ignore_id)
+    return running.exists()
+
+def default_worker_id() -> str:
+    """Identify a worker by host, process and thread"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+class JobQueue:
+    """Enqueue, claim, heartbeat, retry and complete jobs stored in one SQLite file
+
+    Every state change is a single UPDATE, so any number of worker processes on one
+    host (or on hosts sharing the data directory) can drain the queue safely.
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, lease_seconds: Optional[int] = None,
+                 max_running: Optional[dict] = None):
+        if data_dir is None:
+            data_dir = "data"
+        os.makedirs(data_dir, exist_ok=True)
+        self.db_path = os.path.join(data_dir, "jobs.db")
+        self.lease_seconds = lease_seconds if lease_seconds is not None else JOB_LEASE_SECONDS
+        self.max_running = MAX_RUNNING if max_running is None else max_running
+        self._activity_written = {}
+        # Wait for other processes' write locks rather than failing immediately
+        self.engine = create_engine(f'sqlite:///{self.db_path}', echo=False, connect_args={'timeout': 30})
+        sql_profiler.attach(metrics.instrument_engine(self.engine))
+        QueueBase.metadata.create_all(self.engine)
+        self._upgrade_schema()
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def _upgrade_schema(self):
+        """Add columns introduced after a jobs.db was first created"""
+        with self.engine.begin() as conn:
+            existing = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(jobs)")}
+            for column in Job.__table__.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql(f"ALTER TABLE jobs ADD COLUMN {column.name} {column.type.compile(self.engine.dialect)}")
+    
+    def enqueue(self, username: str, kind: str, params: Optional[dict] = None,
+                max_attempts: Optional[int] = None, priority: int = FOREGROUND_PRIORITY) -> Job:
+        """Add a job in the queued state"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = utcnow()
+        with self.Session() as session:
+            job = Job(
+                username=username,
+                kind=kind,
+                params=json.dumps(params or {}),
+                state='queued',
+                priority=priority,
+                attempts=0,
+                max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+                run_after=now,
+                created_at=now
+            )
+            session.add(job)
+            session.commit()
+            return job
+
+    def enqueue_exclusive(self, username: str, kind: str, params: Optional[dict] = None,
+                          max_attempts: Optional[int] = None, priority: int = FOREGROUND_PRIORITY) -> Optional[Job]:
+        """Queue a job unless the user already has one of the same priority queued or running; None if they do
+
+        The check and the insert are one statement, so concurrent requests
+        handled by different processes cannot both get a job in. Background
+        jobs do not block foreground ones; claim() still runs one of a user's
+        jobs of a kind at a time.
+        """
+        busy = sa.select(Job.id).where(Job.username == username, Job.state.in_(ACTIVE_STATES), _priority() == priority)
+        return self._insert_unless(busy, username, kind, params, max_attempts, priority)
+
+    def claim_exclusive(self, username: str, kind: str, worker_id: str, params: Optional[dict] = None,
+                        priority: int = FOREGROUND_PRIORITY) -> Optional[Job]:
+        """Add a job already claimed by worker_id unless the user has any job queued or running; None if they do
+
+        For work done outside the workers (batch.py): while its lease is renewed,
+        no worker claims the user's games and no request can queue another job.
+        """
+        now = utcnow()
+        busy = sa.select(Job.id).where(Job.username == username, Job.state.in_(ACTIVE_STATES))
+        # The token that identifies the new row doubles as its claim token
+        return self._insert_unless(busy, username, kind, params, 1, priority, state='running', worker_id=worker_id,
+                                   attempts=1, started_at=now, heartbeat_at=now,
+                                   lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+
+    def _insert_unless(self, busy, username: str, kind: str, params: Optional[dict], max_attempts: Optional[int],
+                       priority: int, state: str = 'queued', **extra) -> Optional[Job]:
+        """Insert a job in one statement unless the `busy` select finds a row; None if it does"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = utcnow()
+        token = uuid.uuid4().hex
+        values = {
+            'username': username,
+            'kind': kind,
+            'params': json.dumps(params or {}),
+            'state': state,
+            'priority': priority,
+            'attempts': 0,
+            'max_attempts': max_attempts or JOB_MAX_ATTEMPTS,
+            'run_after': now,
+            'created_at': now,
+            'claim_token': token,
+            **extra,
+        }
+        row = sa.select(*[sa.literal(value, type_=Job.__table__.c[name].type) for name, value in values.items()]).where(~busy.exists())
+        with self.Session() as session:
+            inserted = session.execute(sa.insert(Job).from_select(list(values), row)).rowcount
+            if not inserted:
+                session.rollback()
+                return None
+            job = session.query(Job).filter(Job.claim_token == token).one()
+            if state == 'queued':
+                # The token only identifies the new row; claim() replaces it
+                job.claim_token = None
+            session.commit()
+            return job
+
+    def claim(self, worker_id: str, kinds=JOB_KINDS) -> Optional[Job]:
+        """Atomically take the next runnable job, or an expired lease, for this worker
+
+        Jobs are served by priority, then in run_after order; a job that yields
+        after a slice is requeued with run_after = now, which rotates slots
+        between users. A job waits while another job of its kind is running for
+        the same user, so two analyses never rewrite the same games.
+        """
+        now = utcnow()
+        token = uuid.uuid4().hex
+        with self.Session() as session:
+            # Jobs whose worker died on their last attempt are not retried again
+            session.execute(sa.update(Job).where(
+                Job.state == 'running',
+                Job.lease_expires_at < now,
+                Job.attempts >= Job.max_attempts
+            ).values(state='failed', error='Worker lost (lease expired)', finished_at=now))
+
+            # Kinds at their running limit are skipped; the count runs inside the claiming
+            # UPDATE, so the limit holds across processes
+            allowed = []
+            for kind in kinds:
+                limit = self.max_running.get(kind)
+                if limit is None:
+                    allowed.append(Job.kind == kind)
+                    continue
+                running = sa.select(sa.func.count(Job.id)).where(
+                    Job.kind == kind, Job.state == 'running', Job.lease_expires_at >= now
+                ).scalar_subquery()
+                allowed.append(sa.and_(Job.kind == kind, running < limit))
+
+            candidate = sa.select(Job.id).where(
+                sa.or_(*allowed),
+                sa.or_(
+                    sa.and_(Job.state == 'queued', Job.run_after <= now),
+                    sa.and_(Job.state == 'running', Job.lease_expires_at < now)
+                ),
+                ~_user_running_other(now)
+            ).order_by(_priority(), Job.run_after, Job.id).limit(1).scalar_subquery()
+
+            claimed = session.execute(sa.update(Job).where(Job.id == candidate).values(
+                state='running',
+                worker_id=worker_id,
+                claim_token=token,
+                attempts=Job.attempts + 1,
+                started_at=now,
+                heartbeat_at=now,
+                lease_expires_at=now + timedelta(seconds=self.lease_seconds)
+            )).rowcount
+            session.commit()
+
+            if not claimed:
+                return None
+            job = session.query(Job).filter(Job.claim_token == token).first()
+            metrics.JOB_WAIT_SECONDS.observe(max(0.0, (now - job.run_after).total_seconds()), kind=job.kind)
+            return job
+
+    def heartbeat(self, job: Job, progress: Optional[dict] = None) -> bool:
+        """Extend a claimed job's lease; False means the lease was lost to another worker"""
+        now = utcnow()
+        values = {'heartbeat_at': now, 'lease_expires_at': now + timedelta(seconds=self.lease_seconds)}
+        if progress is not None:
+            values['progress'] = json.dumps(progress, default=str)
+        with self.Session() as session:
+            updated = session.execute(sa.update(Job).where(
+                Job.id == job.id, Job.claim_token == job.claim_token, Job.state == 'running'
+            ).values(**values)).rowcount
+            session.commit()
+            return updated == 1
+
+    def complete(self, job: Job, result: Optional[dict] = None) -> bool:
+        """Mark a claimed job as succeeded"""
+        return self._finish(job, state='succeeded', result=json.dumps(result or {}, default=str),
+                            finished_at=utcnow())
+
+    def requeue(self, job: Job, progress: Optional[dict] = None) -> bool:
+        """Put a job that finished a slice of its work at the back of the queue"""
+        values = {'state': 'queued', 'run_after': utcnow(), 'attempts': 0}
+        if progress is not None:
+            values['progress'] = json.dumps(progress, default=str)
+        return self._finish(job, **values)
+    
+    def cancelled(self, job: Job, result: Optional[dict] = None) -> bool:
+        """Mark a claimed job that stopped on a cancellation request"""
+        return self._finish(job, state='cancelled', result=json.dumps(result or {}, default=str),
+                            finished_at=utcnow())
+    
+    def fail(self, job: Job, error: str) -> bool:
+        """Record a failed attempt; the job is requeued with backoff until attempts run out"""
+        now = utcnow()
+        if job.attempts < job.max_attempts:
+            return self._finish(job, state='queued', error=error,
+                                run_after=now + timedelta(seconds=JOB_RETRY_BACKOFF_SECONDS * job.attempts))
+        return self._finish(job, state='failed', error=error, finished_at=now)
+
+    def _finish(self, job: Job, **values) -> bool:
+        """Apply a terminal (or requeue) transition if this worker still holds the job"""
+        with self.Session() as session:
+            updated = session.execute(sa.update(Job).where(
+                Job.id == job.id, Job.claim_token == job.claim_token, Job.state == 'running'
+            ).values(claim_token=None, lease_expires_at=None, **values)).rowcount
+            session.commit()
+            return updated == 1
+
+    def request_cancel(self, username: str, reason: str = 'cancelled', include_background: bool = True,
+                       only_background: bool = False) -> int:
+        """Cancel a user's queued jobs and ask their running job to stop at the next ply"""
+        cancelled = self.cancel_queued(username, include_background, only_background)
+        with self.Session() as session:
+            query = sa.update(Job).where(
+                Job.username == username, Job.state == 'running', Job.cancel_requested.is_(None)
+            )
+            if not include_background:
+                query = query.where(_priority() == FOREGROUND_PRIORITY)
+            elif only_background:
+                query = query.where(_priority() == BACKGROUND_PRIORITY)
+            cancelled += session.execute(query.values(cancel_requested=reason)).rowcount
+            session.commit()
+        return cancelled
+    
+    def cancel_reason(self, job: Job) -> Optional[str]:
+        """Why a running job was asked to stop, if it was"""
+        with self.Session() as session:
+            return session.query(Job.cancel_requested).filter(Job.id == job.id).scalar()
+    
+    def has_waiting(self, kind: str, priority: int = FOREGROUND_PRIORITY, running: Optional[Job] = None) -> bool:
+        """True when a job of this kind, at this priority or above, could run if `running` yielded its slot"""
+        now = utcnow()
+        with self.Session() as session:
+            return session.query(Job.id).filter(
+                Job.kind == kind, Job.state == 'queued', Job.run_after <= now, _priority() <= priority,
+                ~_user_running_other(now, running.id if running is not None else None)
+            ).first() is not None
+    
+    def cancel_queued(self, username: str, include_background: bool = True, only_background: bool = False) -> int:
+        """Cancel a user's jobs that have not started yet"""
+        with self.Session() as session:
+            query = sa.update(Job).where(Job.username == username, Job.state == 'queued')
+            if not include_background:
+                query = query.where(_priority() == FOREGROUND_PRIORITY)
+            elif only_background:
+                query = query.where(_priority() == BACKGROUND_PRIORITY)
+            cancelled = session.execute(query.values(state='cancelled', finished_at=utcnow())).rowcount
+            session.commit()
+            return cancelled
+
+    def get_job(self, job_id: int) -> Optional[Job]:
+        """Look up a job by id"""
+        with self.Session() as session:
+            return session.get(Job, job_id)
+
+    def get_claimed(self, job_id: int, claim_token: str) -> Optional[Job]:
+        """A running job, if claim_token still holds its lease"""
+        with self.Session() as session:
+            return session.query(Job).filter(
+                Job.id == job_id, Job.claim_token == claim_token, Job.state == 'running'
+            ).first()
+
+    def get_active_job(self, username: str) -> Optional[Job]:
+        """The user's queued or running foreground job, if any"""
+        with self.Session() as session:
+            return session.query(Job).filter(
+                Job.username == username, Job.state.in_(ACTIVE_STATES), _priority() == FOREGROUND_PRIORITY
+            ).order_by(Job.id).first()
+
+    def count_active(self, kind: Optional[str] = None) -> int:
+        """Number of queued or running jobs, optionally of one kind"""
+        with self.Session() as session:
+            query = session.query(Job).filter(Job.state.in_(ACTIVE_STATES))
+            if kind:
+                query = query.filter(Job.kind == kind)
+            return query.count()
+
+    def count_by_state(self) -> dict:
+        """Number of jobs per (kind, state) that are not finished"""
+        with self.Session() as session:
+            rows = session.query(Job.kind, Job.state, sa.func.count(Job.id)).filter(
+                Job.state.in_(ACTIVE_STATES)
+            ).group_by(Job.kind, Job.state).all()
+            return {(kind, state): count for kind, state, count in rows}
+
+    def get_active_usernames(self, kind: Optional[str] = None) -> list:
+        """Users with a running job, optionally of one kind"""
+        with self.Session() as session:
+            query = session.query(Job.username).filter(Job.state == 'running')
+            if kind:
+                query = query.filter(Job.kind == kind)
+            return [username for username, in query.distinct().all()]
+
+    def get_queue_position(self, job: Job) -> int:
+        """Number of queued jobs of the same kind that will be served before this one"""
+        priority = job.priority or FOREGROUND_PRIORITY
+        with self.Session() as session:
+            return session.query(Job).filter(
+                Job.kind == job.kind,
+                Job.state == 'queued',
+                sa.or_(
+                    _priority() < priority,
+                    sa.and_(_priority() == priority, Job.run_after < job.run_after),
+                    sa.and_(_priority() == priority, Job.run_after == job.run_after, Job.id < job.id)
+                )
+            ).count()
+    
+    def estimate_wait(self, job: Job, slots: int) -> float:
+        """Seconds until a queued job is expected to get a worker slot"""
+        with self.Session() as session:
+            running = session.query(Job.progress).filter(Job.kind == job.kind, Job.state == 'running').all()
+        
+        # Recent per-game timings reported by running jobs
+        game_seconds = [json.loads(progress).get('avg_game_seconds') for progress, in running if progress]
+        game_seconds = [seconds for seconds in game_seconds if seconds]
+        slice_seconds = ANALYSIS_SLICE_GAMES * (
+            sum(game_seconds) / len(game_seconds) if game_seconds else DEFAULT_GAME_SECONDS
+        )
+        # With someone waiting, a slice is preempted once it has run for the quantum
+        slice_seconds = min(slice_seconds, ANALYSIS_QUANTUM_SECONDS)
+        return estimate_wait_seconds(self.get_queue_position(job), len(running), slots, slice_seconds)
+    
+    def touch_user(self, username: str, force: bool = False):
+        """Record that a user is active; repeated calls within ACTIVITY_WRITE_SECONDS are skipped"""
+        now = time.monotonic()
+        if not force and now - self._activity_written.get(username, float('-inf')) < ACTIVITY_WRITE_SECONDS:
+            return
+        self._activity_written[username] = now
+        with self.Session() as session:
+            session.execute(sa.text(
+                "INSERT INTO user_activity (username, last_active) VALUES (:username, :now) "
+                "ON CONFLICT(username) DO UPDATE SET last_active = excluded.last_active"
+            ), {'username': username, 'now': utcnow()})
+            session.commit()
+
+    def get_inactive_users(self, seconds: float) -> list:
+        """Users last seen more than `seconds` ago"""
+        cutoff = utcnow() - timedelta(seconds=seconds)
+        with self.Session() as session:
+            return [username for username, in session.query(UserActivity.username).filter(
+                UserActivity.last_active < cutoff
+            ).all()]
+
+    def forget_user(self, username: str, seconds: float) -> bool:
+        """Drop a user's activity record if they are still inactive and have no active job"""
+        cutoff = utcnow() - timedelta(seconds=seconds)
+        busy = sa.select(Job.id).where(Job.username == username, Job.state.in_(ACTIVE_STATES))
+        with self.Session() as session:
+            deleted = session.execute(sa.delete(UserActivity).where(
+                UserActivity.username == username, UserActivity.last_active < cutoff, ~busy.exists()
+            )).rowcount
+            session.commit()
+        self._activity_written.pop(username, None)
+        return deleted == 1
+
+    def count_users(self) -> int:
+        """Users with an activity record, i.e. not yet cleaned up"""
+        with self.Session() as session:
+            return session.query(UserActivity).count()
+
+    def get_operation_status(self, username: str, slots: Optional[int] = None) -> dict:
+        """Summarise a user's foreground jobs in the shape of the web app's operation status
+
+        Background work only shows up as the `deepening` flag.
+        """
+        with self.Session() as session:
+            active = session.query(Job).filter(
+                Job.username == username, Job.state.in_(ACTIVE_STATES), _priority() == FOREGROUND_PRIORITY
+            ).order_by(Job.id).first()
+            last = session.query(Job).filter(
+                Job.username == username, Job.state.in_(('succeeded', 'failed', 'cancelled')),
+                _priority() == FOREGROUND_PRIORITY
+            ).order_by(Job.id.desc()).first()
+            deepening = session.query(Job.id).filter(
+                Job.username == username, Job.state.in_(ACTIVE_STATES), _priority() > FOREGROUND_PRIORITY
+            ).first() is not None
+        
+        queue_position = None
+        estimated_wait_seconds = None
+        if active is not None and active.state == 'queued':
+            queue_position = self.get_queue_position(active)
+            if slots:
+                estimated_wait_seconds = round(self.estimate_wait(active, slots))
+
+        last_operation = None
+        if last is not None:
+            last_operation = {
+                'type': last.kind,
+                'completed_at': last.finished_at.replace(tzinfo=UTC).isoformat() if last.finished_at else None,
+            }
+            if last.state in ('succeeded', 'cancelled'):
+                last_operation.update(json.loads(last.result or '{}'))
+            else:
+                last_operation['error'] = last.error
+
+        return {
+            'fetching': active is not None and active.kind == 'fetch',
+            'analyzing': active is not None and active.kind == 'analyze',
+            'deepening': deepening,
+            'job_id': active.id if active is not None else None,
+            'job_state': active.state if active is not None else None,
+            'queue_position': queue_position,
+            'estimated_wait_seconds': estimated_wait_seconds,
+            'last_operation': last_operation,
+            'progress': json.loads(active.progress) if active is not None and active.progress else {},
+        }
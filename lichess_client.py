@@ -1,7 +1,9 @@
 import aiohttp
 import asyncio
+import time
 from datetime import datetime
 import re
+import metrics
 
 class LichessClient:
     def __init__(self):
@@ -42,11 +44,16 @@ class LichessClient:
             params['perfType'] = ','.join(game_types)
         
         games = []
+        started = time.perf_counter()
         async with self.session.get(url, params=params) as response:
             if response.status == 200:
                 # Response is in PGN format, need to parse it
-                text = await response.text()
+                body = await response.read()
+                text = body.decode(response.get_encoding())
                 games = self.parse_pgn_response(text)
+                metrics.FETCH_BYTES.inc(len(body))
+                metrics.FETCH_GAMES.inc(len(games))
+        metrics.FETCH_SECONDS.observe(time.perf_counter() - started)
         
         return games
     
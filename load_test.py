@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test of the read API with realistic filter mixes
+
+Fill a user database first (see synthetic_data.py), then:
+
+    python load_test.py loadtest --requests 400 --concurrency 8
+    python load_test.py loadtest --save-baseline      # record p50/p95/p99 and query counts in data/
+    python load_test.py loadtest                       # compare against the baseline; exits 1 on regression
+
+Requests run in-process through the Flask test client, with the response
+cache disabled so every request reaches the database (--warm keeps it).
+--url targets a running server instead; start it with BLUNDER_SQL_PROFILE=1
+to get query counts.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DEFAULT_BASELINE = os.path.join('data', 'load_test_baseline.json')
+
+# A p95 latency this much above the baseline counts as a regression
+LATENCY_TOLERANCE = 0.25
+
+def _pick(rng, options):
+    return rng.choice(options)
+
+# Endpoint, share of the traffic, and a generator of query parameters
+SCENARIOS = [
+    ('/api/stats', 3, lambda rng: {
+        'time_control': _pick(rng, [None, None, '180+0', '300+0', '600+0']),
+        'quality': _pick(rng, [None, None, 'full']),
+    }),
+    ('/api/performance', 4, lambda rng: {
+        'timeControl': _pick(rng, [None, 'All', 'bullet', 'blitz', 'rapid']),
+        'bucket': _pick(rng, [None, None, 'week', 'month']),
+        'points': _pick(rng, [None, 200, 500]),
+        'format': _pick(rng, [None, 'columns']),
+        **_pick(rng, [{}, {}, {'ratingRange[0]': 1200, 'ratingRange[1]': 1800},
+                      {'dateRange[0]': '2021-01-01', 'dateRange[1]': '2022-12-31'}]),
+    }),
+    ('/api/recent-games', 3, lambda rng: {
+        'limit': _pick(rng, [None, 10, 50]),
+    }),
+    ('/api/blunder-analysis', 2, lambda rng: {
+        'blunder_limit': _pick(rng, [None, 10, 50]),
+        'quality': _pick(rng, [None, 'full']),
+    }),
+    ('/api/problem-positions', 1, lambda rng: {
+        'min_count': _pick(rng, [None, 3]),
+    }),
+    ('/api/opening-tree', 1, lambda rng: {
+        'color': _pick(rng, ['white', 'black']),
+    }),
+]
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def build_requests(username: str, count: int, seed: int = 0) -> list:
+    """The request mix as (endpoint, query string) pairs"""
+    rng = random.Random(seed)
+    weighted = [scenario for scenario in SCENARIOS for _ in range(scenario[1])]
+    requests = []
+    for _ in range(count):
+        endpoint, _, make_params = rng.choice(weighted)
+        params = {key: value for key, value in make_params(rng).items() if value is not None}
+        requests.append((endpoint, urllib.parse.urlencode({'username': username, **params})))
+    return requests
+
+class InProcessClient:
+    """Sends requests to the app in this process; one test client per thread"""
+
+    def __init__(self, warm: bool = False):
+        import sql_profiler
+        sql_profiler.SQL_PROFILE = True
+        from app import app, response_cache
+        if not warm:
+            response_cache.max_bytes = 0
+        self.app = app
+        self.local = threading.local()
+
+    def get(self, path: str) -> tuple:
+        """(status, SQL statement count or None)"""
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.get(path, headers={'Accept-Encoding': 'gzip'})
+        response.get_data()
+        queries = response.headers.get('X-SQL-Queries')
+        return response.status_code, int(queries) if queries else None
+
+class HttpClient:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    def get(self, path: str) -> tuple:
+        request = urllib.request.Request(self.base_url + path, headers={'Accept-Encoding': 'gzip'})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            status, headers = e.code, e.headers
+        queries = headers.get('X-SQL-Queries')
+        return status, int(queries) if queries else None
+
+def run_load(client, requests: list, concurrency: int) -> dict:
+    """Send the requests from `concurrency` threads; returns per-endpoint samples and wall time"""
+    samples = {}
+    lock = threading.Lock()
+    pending = list(reversed(requests))
+
+    def work():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                endpoint, query = pending.pop()
+            started = time.perf_counter()
+            try:
+                status, queries = client.get(f'{endpoint}?{query}')
+            except Exception as e:
+                print(f"[WARN] {endpoint}?{query} failed: {e}")
+                status, queries = None, None
+            seconds = time.perf_counter() - started
+            with lock:
+                entry = samples.setdefault(endpoint, {'latencies': [], 'queries': [], 'errors': 0})
+                entry['latencies'].append(seconds)
+                if queries is not None:
+                    entry['queries'].append(queries)
+                if status is None or status >= 400:
+                    entry['errors'] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=work, name=f'load-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'samples': samples, 'seconds': time.perf_counter() - started}
+
+def summarize(run: dict) -> dict:
+    """p50/p95/p99 latency (ms), throughput and mean SQL statements per endpoint"""
+    summary = {}
+    for endpoint, entry in sorted(run['samples'].items()):
+        latencies = entry['latencies']
+        summary[endpoint] = {
+            'requests': len(latencies),
+            'errors': entry['errors'],
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'requests_per_second': round(len(latencies) / run['seconds'], 1),
+            'queries': round(sum(entry['queries']) / len(entry['queries']), 1) if entry['queries'] else None,
+        }
+    return summary
+
+def print_summary(summary: dict, total_seconds: float):
+    print(f"{'endpoint':<26}{'reqs':>6}{'errs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>8}{'queries':>9}")
+    for endpoint, row in summary.items():
+        queries = '-' if row['queries'] is None else row['queries']
+        print(f"{endpoint:<26}{row['requests']:>6}{row['errors']:>6}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+              f"{row['p99_ms']:>10}{row['requests_per_second']:>8}{queries:>9}")
+    total = sum(row['requests'] for row in summary.values())
+    print(f"{total} requests in {total_seconds:.1f}s ({total / total_seconds:.1f} req/s)")
+
+def compare(summary: dict, baseline: dict, tolerance: float = LATENCY_TOLERANCE) -> list:
+    """Regressions against a saved baseline, as readable strings"""
+    regressions = []
+    for endpoint, row in summary.items():
+        base = baseline.get(endpoint)
+        if not base:
+            continue
+        if row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {row['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if row['queries'] is not None and base.get('queries') is not None and row['queries'] > base['queries']:
+            regressions.append(f"{endpoint}: {row['queries']} queries vs baseline {base['queries']}")
+        if row['errors'] > base.get('errors', 0):
+            regressions.append(f"{endpoint}: {row['errors']} errors vs baseline {base.get('errors', 0)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the read API")
+    parser.add_argument('username', help="User whose database to query (see synthetic_data.py)")
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="Test a running server instead of the app in this process")
+    parser.add_argument('--warm', action='store_true', help="Keep the response cache on (in-process only)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=LATENCY_TOLERANCE, help="Allowed p95 increase, e.g. 0.25")
+    args = parser.parse_args()
+
+    client = HttpClient(args.url) if args.url else InProcessClient(args.warm)
+    requests = build_requests(args.username, args.requests, args.seed)
+    run = run_load(client, requests, args.concurrency)
+    summary = summarize(run)
+    print_summary(summary, run['seconds'])
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print(f"[INFO] Baseline saved to {args.baseline}")
+        return
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"[INFO] No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
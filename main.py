@@ -1,14 +1,149 @@
 import asyncio
+import functools
+import io
+import itertools
+import os
+import chess.pgn
+import chess.polyglot
+from sqlalchemy import and_, or_, update
 from datetime import datetime, UTC
-from database_multiuser import DatabaseManager, Game, Move
-from lichess_client import LichessClient
-from game_analyzer import GameAnalyzer
+from types import SimpleNamespace
+from sqlalchemy import func
+from database_multiuser import (DatabaseManager, DatabaseThread, Game, Move, WriteBatcher, UNKNOWN_POSITION,
+                                QUALITY_QUICK, QUALITY_FULL, bump_data_version, shared_db_manager, to_signed64)
+from game_analyzer import GameAnalyzer, FULL_DEPTH, QUICK_DEPTH
+from cancellation import AnalysisCancelled
+import opening_tree
+import metrics
+
+# Game ids read per keyset query while streaming the analysis backlog
+BACKLOG_BATCH_GAMES = int(os.environ.get('BLUNDER_BACKLOG_BATCH_GAMES', 50))
+
+# Columns a deeper re-analysis overwrites on existing Move rows
+REEVALUATED_COLUMNS = ('centipawn_loss', 'is_blunder', 'is_mistake', 'is_inaccuracy',
+                       'position_hash', 'best_move', 'analysis_quality')
+
+def replace_evaluations(session, game, moves: list):
+    """Overwrite a game's stored move evaluations in place and adjust its opening tree totals"""
+    existing = {move.move_number: move for move in session.query(Move).filter(Move.game_lichess_id == game.lichess_id)}
+    old = [SimpleNamespace(move_number=move.move_number, centipawn_loss=move.centipawn_loss, is_blunder=move.is_blunder)
+           for move in existing.values()]
+    for record in moves:
+        move = existing.get(record.move_number)
+        if move is None:
+            session.add(record)
+            continue
+        for column in REEVALUATED_COLUMNS:
+            setattr(move, column, getattr(record, column))
+    opening_tree.update_game(session, game, old, moves)
+
+def backlog_query(db, username, quality=QUALITY_FULL, provisional_only=False, resume_after=None):
+    """Games still to analyze at this quality, newest first
+
+    resume_after (played_at, id) skips games up to and including that one.
+    """
+    query = db.query(Game).filter(Game.username == username)
+    if quality == QUALITY_QUICK:
+        query = query.filter(Game.fully_analyzed == False)
+    else:
+        query = query.filter(func.coalesce(Game.analysis_quality, 0) < QUALITY_FULL)
+        if provisional_only:
+            query = query.filter(Game.fully_analyzed == True)
+    if resume_after:
+        resume_played_at, resume_id = resume_after
+        query = query.filter(or_(
+            Game.played_at < resume_played_at,
+            and_(Game.played_at == resume_played_at, Game.id < resume_id)
+        ))
+    return query.order_by(Game.played_at.desc(), Game.id.desc())
+
+def iter_backlog(db, username, quality=QUALITY_FULL, provisional_only=False, resume_after=None,
+                 batch_size=BACKLOG_BATCH_GAMES, between_batches=None):
+    """Stream the backlog newest first, loading each game (and its PGN) only when it is reached
+
+    Ids are read in keyset batches of batch_size. between_batches() runs before
+    each batch after the first, so the caller can write and expunge the games
+    it has finished and memory stays flat however long the backlog is.
+    """
+    first = True
+    while True:
+        batch = backlog_query(db, username, quality, provisional_only, resume_after).with_entities(
+            Game.id, Game.played_at
+        ).limit(batch_size).all()
+        if not batch:
+            return
+        if not first and between_batches:
+            between_batches()
+        first = False
+        for game_id, played_at in batch:
+            game = db.get(Game, game_id)
+            if game is not None:
+                yield game
+        game_id, played_at = batch[-1]
+        resume_after = (played_at, game_id)
+
+def stage_analysis(batcher, game, success, move_evaluations, quality, analysis_started_at):
+    """Queue one game's analysis result on a WriteBatcher; returns 'analyzed' or 'skipped'"""
+    if not success:
+        batcher.stage(game, {'analysis_started_at': analysis_started_at})
+        metrics.GAMES_PROCESSED.inc(outcome='skipped')
+        return 'skipped'
+    
+    move_records = []
+    for move_eval in move_evaluations:
+        centipawn_loss = move_eval.get('centipawn_loss', 0) or 0
+        
+        move_records.append(Move(
+            game_lichess_id=game.lichess_id,
+            move_number=move_eval['move_number'],
+            played_at=game.played_at,
+            move_san=move_eval['move_san'],
+            centipawn_loss=centipawn_loss,
+            opponent_rating=game.opponent_rating,
+            opening_name=game.opening_name,
+            time_control=game.time_control,
+            user_color=game.user_color,
+            is_blunder=(centipawn_loss >= 300),
+            is_mistake=(centipawn_loss >= 100),
+            is_inaccuracy=(centipawn_loss >= 50),
+            position_hash=to_signed64(move_eval['position_hash']) if move_eval.get('position_hash') is not None else None,
+            best_move=move_eval.get('best_move'),
+            analysis_quality=quality
+        ))
+    
+    # Moves, the fully_analyzed flag and the opening tree land in the same transaction
+    values = {
+        'analysis_started_at': analysis_started_at,
+        'fully_analyzed': True,
+        'analysis_quality': quality,
+        'analysis_completed_at': datetime.now(UTC)
+    }
+    if game.fully_analyzed:
+        # Deepening a provisional analysis: the moves already exist
+        batcher.stage(game, values, after=functools.partial(replace_evaluations, game=game, moves=move_records))
+    else:
+        batcher.stage(game, values, move_records,
+                      after=functools.partial(opening_tree.add_game, game=game, moves=move_records))
+    metrics.GAMES_PROCESSED.inc(outcome='analyzed')
+    return 'analyzed'
 
 class BlunderTracker:
-    def __init__(self, progress_callback=None):
-        self.analyzer = GameAnalyzer()
-        self.db_manager = DatabaseManager()
+    def __init__(self, progress_callback=None, db_manager: DatabaseManager = None):
+        # Jobs share the process's open databases instead of re-checking the schema each time
+        self.db_manager = db_manager or shared_db_manager()
         self.progress_callback = progress_callback
+        self._analyzer = None
+    
+    @property
+    def analyzer(self):
+        """Created on first analysis, so fetch jobs never look for an engine"""
+        if self._analyzer is None:
+            self._analyzer = GameAnalyzer()
+        return self._analyzer
+    
+    @analyzer.setter
+    def analyzer(self, analyzer):
+        self._analyzer = analyzer
     
     async def fetch_user_games(self, username, max_games=100, game_types=None, fetch_older=False):
         """Step 1: Fetch user's games and store in database"""
@@ -17,129 +152,301 @@ class BlunderTracker:
             
         print(f"Fetching games for {username} (types: {', '.join(game_types)})...")
         
-        db = self.db_manager.get_db(username)
+        db_thread = DatabaseThread(self.db_manager, username)
+        lag_watch = asyncio.create_task(metrics.watch_event_loop_lag('fetch'))
         
-        since = None
-        until = None
+        def edge_played_at(db):
+            # Oldest game when fetching older ones, else the newest
+            order = Game.played_at.asc() if fetch_older else Game.played_at.desc()
+            game = db.query(Game.played_at).filter(Game.username == username).order_by(order).first()
+            return game.played_at if game else None
         
-        if fetch_older:
-            # Fetch games older than our oldest game
-            oldest_game = db.query(Game).filter(Game.username == username).order_by(Game.played_at.asc()).first()
-            until = oldest_game.played_at if oldest_game else None
-            print(f"Fetching games older than {until}")
-        else:
-            # Fetch games newer than our newest game
-            latest_game = db.query(Game).filter(Game.username == username).order_by(Game.played_at.desc()).first()
-            since = latest_game.played_at if latest_game else None
-            print(f"Fetching games newer than {since}")
-        
-        async with LichessClient() as client:
-            games_json = await client.get_user_games(username, max_games, since, until, game_types)
-            
+        def store_games(db, games_data):
+            ids = [game_data['lichess_id'] for game_data in games_data]
+            seen = {lichess_id for (lichess_id,) in db.query(Game.lichess_id).filter(Game.lichess_id.in_(ids))}
             games_added = 0
-            for game_json in games_json:
-                # Check if game already exists
-                existing = db.query(Game).filter(Game.lichess_id == game_json['id']).first()
-                if existing:
+            for game_data in games_data:
+                # Skip games already stored
+                if game_data['lichess_id'] in seen:
                     continue
-                
-                # Parse and store game
-                game_data = client.parse_game_data(game_json, username)
-                game = Game(**game_data)
-                db.add(game)
+                seen.add(game_data['lichess_id'])
+                db.add(Game(**game_data))
                 games_added += 1
             
-            db.commit()
-            db.close()
+            if games_added:
+                bump_data_version(db)
+            with metrics.COMMIT_SECONDS.time(source='fetch'):
+                db.commit()
+            return games_added
+        
+        since = None
+        until = None
+        try:
+            if fetch_older:
+                until = await db_thread.run(edge_played_at)
+                print(f"Fetching games older than {until}")
+            else:
+                since = await db_thread.run(edge_played_at)
+                print(f"Fetching games newer than {since}")
+            
+            # aiohttp is only needed here; importing it lazily keeps web and analysis startup fast
+            from lichess_client import LichessClient
+            async with LichessClient() as client:
+                games_json = await client.get_user_games(username, max_games, since, until, game_types)
+                games_added = await db_thread.run(
+                    store_games, [client.parse_game_data(game_json, username) for game_json in games_json]
+                )
+        finally:
+            await db_thread.close()
+            lag_watch.cancel()
             
         print(f"Added {games_added} new games")
         return games_added
     
-    async def analyze_games(self, username, time_limit_per_game_seconds=300, total_time_limit_seconds=None):
-        """Step 2: Analyze games with time limit per game, mark fully analyzed ones"""
-        print(f"Starting game analysis with {time_limit_per_game_seconds}s per game...")
+    async def analyze_games(self, username, time_limit_per_game_seconds=300, total_time_limit_seconds=None,
+                            max_games=None, resume_after=None, cancel_token=None, resume_game=None,
+                            quality=QUALITY_FULL, provisional_only=False):
+        """Step 2: Analyze games with time limit per game, mark fully analyzed ones
+
+        max_games limits this call to a slice of the backlog; pass the returned
+        resume_after (played_at, id) back in to continue after the last game seen.
+        A cancelled cancel_token stops at the next ply; the returned partial_game
+        can be passed back as resume_game to continue that game where it stopped.
+
+        quality=QUALITY_QUICK runs a shallow sweep over unanalyzed games only;
+        QUALITY_FULL also re-analyzes quick games, updating their moves in place;
+        provisional_only restricts it to those, leaving unanalyzed games to the sweep.
+        """
+        depth = QUICK_DEPTH if quality == QUALITY_QUICK else FULL_DEPTH
+        print(f"Starting game analysis with {time_limit_per_game_seconds}s per game at depth {depth}...")
         if total_time_limit_seconds:
             print(f"Total session time limit: {total_time_limit_seconds}s")
         
         session_start_time = datetime.now(UTC)
-        db = self.db_manager.get_db(username)
-        
-        # Get unanalyzed games, ordered by date
-        unanalyzed_games = db.query(Game).filter(
-            Game.username == username,
-            Game.fully_analyzed == False
-        ).order_by(Game.played_at.desc()).all()
-        
-        print(f"Found {len(unanalyzed_games)} unanalyzed games")
+        # Queries and commits run on their own thread so the engine search never waits on an fsync
+        db_thread = DatabaseThread(self.db_manager, username)
+        lag_samples = []
+        lag_watch = asyncio.create_task(metrics.watch_event_loop_lag('analysis', samples=lag_samples))
         
         games_analyzed = 0
         games_skipped = 0
+        positions_analyzed = 0
+        games_processed = 0
+        cancelled = None
+        partial_game = None
+        batcher = None
         
-        for i, game in enumerate(unanalyzed_games):
-            # Check total session time limit if specified
-            if total_time_limit_seconds:
-                elapsed_seconds = (datetime.now(UTC) - session_start_time).total_seconds()
-                if elapsed_seconds >= total_time_limit_seconds:
-                    print(f"Total session time limit ({total_time_limit_seconds}s) reached. Stopping analysis.")
-                    break
-                    
-                remaining_time = total_time_limit_seconds - elapsed_seconds
-                print(f"Session time remaining: {remaining_time:.1f}s")
-            
-            # Update progress if callback provided
-            if self.progress_callback:
-                self.progress_callback({
-                    'current': i,
-                    'total': len(unanalyzed_games),
-                    'current_game': game.lichess_id,
-                    'games_analyzed': games_analyzed,
-                    'games_skipped': games_skipped
-                })
+        def open_backlog(db):
+            batcher = WriteBatcher(db)
             
-            print(f"Analyzing game {i+1}/{len(unanalyzed_games)}: {game.lichess_id} ({game.played_at})...")
+            def release_finished_games():
+                # Write what is staged, then drop every loaded game and move from the identity map
+                batcher.flush()
+                db.expunge_all()
             
-            game.analysis_started_at = datetime.now(UTC)
-            db.commit()
-            
-            # Analyze the game with per-game time limit
-            success, move_evaluations = await self.analyzer.analyze_game_with_time_limit(
-                game.pgn, game.user_color, time_limit_per_game_seconds
+            return batcher, iter_backlog(db, username, quality, provisional_only, resume_after,
+                                         between_batches=release_finished_games)
+        
+        def next_game(db):
+            # The event loop only sees a snapshot; the Game row stays with the database thread
+            game = next(backlog, None)
+            if game is None:
+                return None
+            return SimpleNamespace(id=game.id, lichess_id=game.lichess_id, played_at=game.played_at,
+                                   pgn=game.pgn, user_color=game.user_color)
+        
+        def stage(db, game_id, success, move_evaluations, analysis_started_at):
+            stage_analysis(batcher, db.get(Game, game_id), success, move_evaluations, quality, analysis_started_at)
+        
+        try:
+            # Games below the requested quality are streamed newest first; only the count is read up front
+            backlog_total = await db_thread.run(
+                lambda db: backlog_query(db, username, quality, provisional_only, resume_after).order_by(None).count()
             )
+            print(f"Found {backlog_total} unanalyzed games")
             
-            if success:
-                # Store the move analysis data immediately
-                for move_eval in move_evaluations:
-                    centipawn_loss = move_eval.get('centipawn_loss', 0) or 0
-                    
-                    move_record = Move(
-                        game_lichess_id=game.lichess_id,
-                        move_number=move_eval['move_number'],
-                        played_at=game.played_at,
-                        move_san=move_eval['move_san'],
-                        centipawn_loss=centipawn_loss,
-                        opponent_rating=game.opponent_rating,
-                        opening_name=game.opening_name,
-                        time_control=game.time_control,
-                        user_color=game.user_color,
-                        is_blunder=(centipawn_loss >= 300),
-                        is_mistake=(centipawn_loss >= 100),
-                        is_inaccuracy=(centipawn_loss >= 50)
+            batcher, backlog = await db_thread.run(open_backlog)
+            upcoming = db_thread.submit(next_game) if max_games != 0 else None
+            for i in itertools.count():
+                game = await asyncio.wrap_future(upcoming) if upcoming else None
+                if game is None:
+                    break
+                if cancel_token and cancel_token.cancelled:
+                    cancelled = cancel_token.reason
+                    break
+                
+                # Check total session time limit if specified
+                if total_time_limit_seconds:
+                    elapsed_seconds = (datetime.now(UTC) - session_start_time).total_seconds()
+                    if elapsed_seconds >= total_time_limit_seconds:
+                        print(f"Total session time limit ({total_time_limit_seconds}s) reached. Stopping analysis.")
+                        break
+                        
+                    remaining_time = total_time_limit_seconds - elapsed_seconds
+                    print(f"Session time remaining: {remaining_time:.1f}s")
+                
+                # Load the next game while the engine works on this one (none past max_games)
+                upcoming = db_thread.submit(next_game) if max_games is None or games_processed + 1 < max_games else None
+                
+                # Update progress if callback provided
+                self._report_progress(session_start_time, i, backlog_total, game.lichess_id,
+                                      games_analyzed, games_skipped, positions_analyzed)
+                
+                print(f"Analyzing game {i+1}/{backlog_total}: {game.lichess_id} ({game.played_at})...")
+                
+                # Written together with the results, so no commit before the engine starts
+                analysis_started_at = datetime.now(UTC)
+                
+                # Analyze the game with per-game time limit
+                resume = resume_game if resume_game and resume_game.get('lichess_id') == game.lichess_id else None
+                try:
+                    success, move_evaluations = await self.analyzer.analyze_game_with_time_limit(
+                        game.pgn, game.user_color, time_limit_per_game_seconds,
+                        cancel_token=cancel_token, resume=resume, depth=depth
                     )
-                    db.add(move_record)
+                except AnalysisCancelled as e:
+                    # Nothing is written for this game; it stays first in line for the next run
+                    cancelled = e.reason
+                    partial_game = {
+                        'lichess_id': game.lichess_id,
+                        'ply': e.ply,
+                        'move_evaluations': e.move_evaluations,
+                        'elapsed_seconds': e.elapsed_seconds
+                    }
+                    print(f"Analysis of {game.lichess_id} stopped at ply {e.ply} ({e.reason})")
+                    break
                 
-                game.fully_analyzed = True
-                game.analysis_completed_at = datetime.now(UTC)
-                games_analyzed += 1
-                print(f"✓ Game {game.lichess_id} fully analyzed ({len(move_evaluations)} moves)")
-            else:
-                games_skipped += 1
-                print(f"✗ Game {game.lichess_id} analysis incomplete (time limit reached)")
-            
-            db.commit()
+                # Each user move costs one search before and one after it
+                positions_analyzed += 2 * len(move_evaluations)
+                
+                # Queued, not awaited: a commit it triggers overlaps the next game's search
+                db_thread.submit(stage, game.id, success, move_evaluations, analysis_started_at)
+                if success:
+                    games_analyzed += 1
+                    print(f"✓ Game {game.lichess_id} fully analyzed ({len(move_evaluations)} moves)")
+                else:
+                    games_skipped += 1
+                    print(f"✗ Game {game.lichess_id} analysis incomplete (time limit reached)")
+                
+                games_processed += 1
+                resume_after = (game.played_at, game.id)
+                self._report_progress(session_start_time, i + 1, backlog_total, None,
+                                      games_analyzed, games_skipped, positions_analyzed)
+        finally:
+            # Games staged so far are complete, so they are kept even if the loop failed
+            try:
+                if batcher is not None:
+                    await db_thread.run(lambda db: batcher.flush())
+            finally:
+                await db_thread.close()
+                lag_watch.cancel()
         
+        stats = batcher.stats
+        max_lag_ms = round(max(lag_samples, default=0.0) * 1000, 1)
+        print(f"Wrote {stats['games_written']} games in {stats['commits']} commits "
+              f"({stats['commit_seconds']:.3f}s waiting on commit, event loop lag at most {max_lag_ms}ms)")
         print(f"Analysis session complete: {games_analyzed} games analyzed, {games_skipped} games skipped")
-        db.close()
-        return {"games_analyzed": games_analyzed, "games_skipped": games_skipped}
+        return {
+            "games_analyzed": games_analyzed,
+            "games_skipped": games_skipped,
+            "positions_analyzed": positions_analyzed,
+            "games_remaining": backlog_total - games_processed,
+            "resume_after": resume_after,
+            "cancelled": cancelled,
+            "partial_game": partial_game,
+            "commits": stats['commits'],
+            "commit_seconds": round(stats['commit_seconds'], 3),
+            "max_loop_lag_ms": max_lag_ms
+        }
+    
+    def _report_progress(self, session_start_time, current, total, current_game,
+                         games_analyzed, games_skipped, positions_analyzed):
+        """Send progress, throughput and an ETA to the progress callback"""
+        if not self.progress_callback:
+            return
+        
+        elapsed_seconds = (datetime.now(UTC) - session_start_time).total_seconds()
+        positions_per_second = positions_analyzed / elapsed_seconds if elapsed_seconds > 0 else 0
+        eta_seconds = None
+        if current > 0:
+            eta_seconds = round(elapsed_seconds / current * (total - current))
+        
+        self.progress_callback({
+            'current': current,
+            'total': total,
+            'current_game': current_game,
+            'games_analyzed': games_analyzed,
+            'games_skipped': games_skipped,
+            'positions_analyzed': positions_analyzed,
+            'positions_per_second': round(positions_per_second, 1),
+            'eta_seconds': eta_seconds
+        })
+    
+    def backfill_position_hashes(self, username, max_games=200):
+        """Add position hashes to moves analyzed before they were recorded
+
+        Replays the stored PGN of up to max_games such games; the engine's best
+        move cannot be recovered this way and stays empty until re-analysis.
+        Returns the number of games updated.
+        """
+        db = self.db_manager.get_db(username)
+        try:
+            lichess_ids = [lichess_id for lichess_id, in db.query(Move.game_lichess_id).filter(
+                Move.position_hash == None
+            ).distinct().limit(max_games).all()]
+            if not lichess_ids:
+                return 0
+            
+            moves_by_game = {}
+            for move_id, lichess_id, move_number in db.query(Move.id, Move.game_lichess_id, Move.move_number).filter(
+                Move.game_lichess_id.in_(lichess_ids), Move.position_hash == None
+            ):
+                moves_by_game.setdefault(lichess_id, {})[move_number] = move_id
+            
+            hashes = {}
+            for lichess_id, pgn in db.query(Game.lichess_id, Game.pgn).filter(Game.lichess_id.in_(lichess_ids)):
+                game = chess.pgn.read_game(io.StringIO(pgn or ''))
+                if not game:
+                    continue
+                wanted = moves_by_game.get(lichess_id, {})
+                board = game.board()
+                for move_number, move in enumerate(game.mainline_moves(), start=1):
+                    if move_number in wanted:
+                        hashes[wanted[move_number]] = to_signed64(chess.polyglot.zobrist_hash(board))
+                    board.push(move)
+            
+            # Moves that could not be replayed get UNKNOWN_POSITION so they are not retried
+            updates = [{'id': move_id, 'position_hash': hashes.get(move_id, UNKNOWN_POSITION)}
+                       for moves in moves_by_game.values() for move_id in moves.values()]
+            db.execute(update(Move), updates)
+            bump_data_version(db)
+            db.commit()
+            print(f"Backfilled position hashes for {len(lichess_ids)} games")
+            return len(lichess_ids)
+        finally:
+            db.close()
+    
+    def backfill_opening_tree(self, username, max_games=200):
+        """Add up to max_games analyzed games that are not in the opening tree yet"""
+        db = self.db_manager.get_db(username)
+        try:
+            games = db.query(Game).filter(
+                Game.fully_analyzed == True, Game.in_opening_tree.isnot(True)
+            ).limit(max_games).all()
+            if not games:
+                return 0
+            
+            moves_by_game = {}
+            for move in db.query(Move).filter(Move.game_lichess_id.in_([game.lichess_id for game in games])):
+                moves_by_game.setdefault(move.game_lichess_id, []).append(move)
+            for game in games:
+                opening_tree.add_game(db, game, moves_by_game.get(game.lichess_id, []))
+            bump_data_version(db)
+            db.commit()
+            print(f"Added {len(games)} games to the opening tree")
+            return len(games)
+        finally:
+            db.close()
     
     def process_analyzed_games(self, username):
         """Step 3: Report on fully analyzed games and moves"""
@@ -167,20 +474,7 @@ class BlunderTracker:
         db.close()
         return total_moves
 
-async def main():
-    tracker = BlunderTracker()
-    username = "kencht"  # Correct Lichess username
-    
-    # Step 1: Fetch games
-    await tracker.fetch_user_games(username, max_games=20)
-    
-    # Step 2: Analyze games (with time limit per game)
-    await tracker.analyze_games(username, time_limit_per_game_seconds=20)
-    
-    # Step 3: Process into moves database
-    tracker.process_analyzed_games(username)
-    
-    print("Done!")
-
 if __name__ == "__main__":
-    asyncio.run(main())
+    # The command-line entry point lives in batch.py: python main.py users.txt [options]
+    from batch import main
+    main()
@@ -0,0 +1,276 @@
+"""
+In-process counters, gauges and histograms exported in the Prometheus text format
+
+Recording a sample is a dict lookup and an addition under a lock, so metrics
+stay on in production. The web server serves them at /metrics; standalone
+workers can serve their own with `python worker.py --metrics-port 9101`.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ENGINE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# Route (or "worker") that SQL statements are attributed to
+current_endpoint = contextvars.ContextVar('current_endpoint', default='worker')
+
+class Metric:
+    """A named family of samples keyed by label values"""
+
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _format_labels(self, key: tuple, extra: str = '') -> str:
+        parts = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key)]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def collect(self) -> list:
+        with self.lock:
+            values = dict(self.values)
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{self._format_labels(key)} {_format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A value that goes up and down
+
+    A `callback` computes the samples at scrape time instead, as a list of
+    (labels dict, value) pairs.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def collect(self) -> list:
+        if self.callback:
+            try:
+                samples = self.callback()
+            except Exception as e:
+                print(f"[WARN] Metric {self.name} unavailable: {e}")
+                samples = []
+            with self.lock:
+                self.values = {self._key(labels): value for labels, value in samples}
+        return super().collect()
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def collect(self) -> list:
+        with self.lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f'{self.name}_bucket{self._format_labels(key, le)} {cumulative}')
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{self._format_labels(key, le)} {count}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {count}')
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+class Registry:
+    """All metrics of this process, rendered together on scrape"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), callback=None) -> Gauge:
+        return self.register(Gauge(name, help_text, labels, callback))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+REGISTRY = Registry()
+
+# Engine
+ENGINE_SEARCHES = REGISTRY.counter('blunder_engine_searches_total', 'Engine searches run', ('depth',))
+ENGINE_SEARCH_SECONDS = REGISTRY.histogram('blunder_engine_search_seconds', 'engine.analyse latency',
+                                           ('depth',), ENGINE_BUCKETS)
+ENGINE_NODES = REGISTRY.counter('blunder_engine_nodes_total', 'Nodes searched', ('engine',))
+ENGINE_NPS = REGISTRY.gauge('blunder_engine_nodes_per_second', 'Nodes per second of the last search', ('engine',))
+TABLEBASE_PROBES = REGISTRY.counter('blunder_tablebase_probes_total',
+                                    'Syzygy probes; hits are positions that needed no engine search', ('outcome',))
+
+# Analysis
+GAMES_PROCESSED = REGISTRY.counter('blunder_games_total', 'Games processed by analysis', ('outcome',))
+EVENT_LOOP_LAG = REGISTRY.histogram('blunder_event_loop_lag_seconds', 'How late timers fire on analysis and fetch event loops',
+                                    ('loop',))
+
+# Job queue
+JOB_WAIT_SECONDS = REGISTRY.histogram('blunder_job_wait_seconds', 'Time a job waited in the queue before a worker claimed it',
+                                      ('kind',), WAIT_BUCKETS)
+JOBS_FINISHED = REGISTRY.counter('blunder_jobs_finished_total', 'Job claims that ended', ('kind', 'outcome'))
+
+# Database
+SQL_QUERIES = REGISTRY.counter('blunder_sql_queries_total', 'SQL statements executed', ('endpoint',))
+SQL_QUERY_SECONDS = REGISTRY.histogram('blunder_sql_query_seconds', 'SQL statement latency', ('endpoint',))
+COMMIT_SECONDS = REGISTRY.histogram('blunder_commit_seconds', 'Commit latency of game writes', ('source',))
+
+# Lichess
+FETCH_BYTES = REGISTRY.counter('blunder_lichess_fetch_bytes_total', 'Bytes downloaded from Lichess')
+FETCH_GAMES = REGISTRY.counter('blunder_lichess_fetch_games_total', 'Games downloaded from Lichess')
+FETCH_SECONDS = REGISTRY.histogram('blunder_lichess_fetch_seconds', 'Lichess game export request duration',
+                                   buckets=WAIT_BUCKETS)
+
+# HTTP
+HTTP_REQUESTS = REGISTRY.counter('blunder_http_requests_total', 'HTTP requests served', ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('blunder_http_request_seconds', 'HTTP request latency', ('route',))
+
+def observe_engine_search(depth, seconds: float, info: dict, engine: str):
+    """Record one engine.analyse call and the node counts it reported"""
+    ENGINE_SEARCHES.inc(depth=depth)
+    ENGINE_SEARCH_SECONDS.observe(seconds, depth=depth)
+    nodes = info.get('nodes')
+    if nodes:
+        ENGINE_NODES.inc(nodes, engine=engine)
+        ENGINE_NPS.set(info.get('nps') or round(nodes / max(seconds, 1e-6)), engine=engine)
+
+async def watch_event_loop_lag(loop_name: str, interval: float = 0.05, samples=None):
+    """Until cancelled, time how late a short sleep wakes up; blocking work on the loop shows up as lag"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        EVENT_LOOP_LAG.observe(lag, loop=loop_name)
+        if samples is not None:
+            samples.append(lag)
+
+def instrument_engine(engine):
+    """Count and time every SQL statement run on a SQLAlchemy engine, per endpoint"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_query_start'].pop()
+        endpoint = current_endpoint.get()
+        SQL_QUERIES.inc(endpoint=endpoint)
+        SQL_QUERY_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+
+    return engine
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Expose /metrics from a process without a web server, on a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"[INFO] Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,134 @@
+"""
+Per-user opening tree with blunder statistics, maintained as games are analyzed
+
+Each node is one row in opening_nodes holding running totals, so adding a
+game touches one row per ply and reading a subtree is an indexed lookup on
+(user_color, parent_id).
+"""
+
+import io
+import os
+
+import sqlalchemy as sa
+
+from database_multiuser import OpeningNode
+
+# Plies of each game that are added to the tree
+OPENING_TREE_PLIES = int(os.environ.get('BLUNDER_OPENING_TREE_PLIES', 20))
+
+# parent_id of the moves from the starting position
+ROOT_ID = 0
+
+_UPSERT_NODE = sa.text(
+    "INSERT INTO opening_nodes (user_color, parent_id, move_san, ply, games, user_moves, cp_loss_total, blunders, game_blunders) "
+    "VALUES (:user_color, :parent_id, :move_san, :ply, :games, :user_moves, :cp_loss, :blunders, :game_blunders) "
+    "ON CONFLICT(user_color, parent_id, move_san) DO UPDATE SET "
+    "games = games + excluded.games, "
+    "user_moves = user_moves + excluded.user_moves, "
+    "cp_loss_total = cp_loss_total + excluded.cp_loss_total, "
+    "blunders = blunders + excluded.blunders, "
+    "game_blunders = game_blunders + excluded.game_blunders "
+    "RETURNING id"
+)
+
+def opening_moves(pgn: str, max_plies: int = OPENING_TREE_PLIES) -> list:
+    """SAN of the first max_plies moves of a game"""
+    import chess.pgn
+    game = chess.pgn.read_game(io.StringIO(pgn or ''))
+    if not game:
+        return []
+    board = game.board()
+    sans = []
+    for move in game.mainline_moves():
+        if len(sans) >= max_plies:
+            break
+        sans.append(board.san(move))
+        board.push(move)
+    return sans
+
+def _contributions(moves: list) -> tuple:
+    """Per-ply (user moves, centipawn loss, blunders) of a game's moves, and its blunder total"""
+    by_ply = {move.move_number: (1, move.centipawn_loss or 0, 1 if move.is_blunder else 0) for move in moves}
+    return by_ply, sum(1 for move in moves if move.is_blunder)
+
+def _apply(session, game, games: int, totals: dict, game_blunders: int, max_plies: int):
+    parent_id = ROOT_ID
+    for ply, move_san in enumerate(opening_moves(game.pgn, max_plies), start=1):
+        user_moves, cp_loss, blunders = totals.get(ply, (0, 0, 0))
+        parent_id = session.execute(_UPSERT_NODE, {
+            'user_color': game.user_color,
+            'parent_id': parent_id,
+            'move_san': move_san,
+            'ply': ply,
+            'games': games,
+            'user_moves': user_moves,
+            'cp_loss': cp_loss,
+            'blunders': blunders,
+            'game_blunders': game_blunders,
+        }).scalar_one()
+
+def add_game(session, game, moves: list, max_plies: int = OPENING_TREE_PLIES):
+    """Add an analyzed game's opening to the tree inside the session's transaction
+
+    `moves` are the game's Move rows (the user's analyzed moves).
+    """
+    totals, game_blunders = _contributions(moves)
+    _apply(session, game, 1, totals, game_blunders, max_plies)
+    game.in_opening_tree = True
+
+def update_game(session, game, old_moves: list, new_moves: list, max_plies: int = OPENING_TREE_PLIES):
+    """Replace a counted game's old move evaluations with new ones along its path
+
+    `old_moves` may be any objects with move_number, centipawn_loss and is_blunder.
+    """
+    if not game.in_opening_tree:
+        add_game(session, game, new_moves, max_plies)
+        return
+    old_totals, old_blunders = _contributions(old_moves)
+    new_totals, new_blunders = _contributions(new_moves)
+    deltas = {
+        ply: tuple(new - old for new, old in zip(new_totals.get(ply, (0, 0, 0)), old_totals.get(ply, (0, 0, 0))))
+        for ply in set(old_totals) | set(new_totals)
+    }
+    _apply(session, game, 0, deltas, new_blunders - old_blunders, max_plies)
+
+def get_path(session, node_id: int) -> list:
+    """Nodes from the first move down to node_id, in one recursive query"""
+    if node_id == ROOT_ID:
+        return []
+    rows = session.execute(sa.text(
+        "WITH RECURSIVE path(id, parent_id, move_san, ply) AS ("
+        " SELECT id, parent_id, move_san, ply FROM opening_nodes WHERE id = :node_id"
+        " UNION ALL"
+        " SELECT n.id, n.parent_id, n.move_san, n.ply FROM opening_nodes n JOIN path p ON n.id = p.parent_id"
+        ") SELECT id, move_san FROM path ORDER BY ply"
+    ), {'node_id': node_id}).all()
+    return [{'id': node_id, 'move_san': move_san} for node_id, move_san in rows]
+
+def serialize_node(node, has_children: bool) -> dict:
+    return {
+        'id': node.id,
+        'move_san': node.move_san,
+        'ply': node.ply,
+        'games': node.games,
+        'user_moves': node.user_moves,
+        'avg_cp_loss': round(node.cp_loss_total / node.user_moves, 1) if node.user_moves else None,
+        'blunders': node.blunders,
+        'game_blunders_per_game': round(node.game_blunders / node.games, 2) if node.games else 0,
+        'has_children': has_children,
+    }
+
+def get_children(session, user_color: str, parent_id: int = ROOT_ID, min_games: int = 1) -> list:
+    """One level of the tree below parent_id, most played first"""
+    children = session.query(OpeningNode).filter(
+        OpeningNode.user_color == user_color,
+        OpeningNode.parent_id == parent_id,
+        OpeningNode.games >= min_games
+    ).order_by(OpeningNode.games.desc(), OpeningNode.move_san).all()
+    if not children:
+        return []
+    with_children = {parent for parent, in session.query(OpeningNode.parent_id).filter(
+        OpeningNode.user_color == user_color,
+        OpeningNode.parent_id.in_([child.id for child in children])
+    ).distinct()}
+    return [serialize_node(child, child.id in with_children) for child in children]
@@ -0,0 +1,83 @@
+"""
+Keyset (cursor) pagination helpers for listing endpoints
+"""
+
+import base64
+import json
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+def encode_cursor(played_at: datetime, row_id: int) -> str:
+    """Encode the (played_at, id) of the last row on a page as an opaque token"""
+    raw = json.dumps([played_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Decode a token from encode_cursor, or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        played_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(played_at), int(row_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+
+def parse_page_size(value: Optional[str], default: int = DEFAULT_PAGE_SIZE) -> int:
+    """Parse a `limit` query parameter, clamped to 1..MAX_PAGE_SIZE"""
+    try:
+        limit = int(value) if value else default
+    except ValueError:
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def _as_datetime(value: str):
+    """An ISO date or timestamp as a datetime; anything else is compared as text"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+def filter_played_between(query, played_at_column, date_from: Optional[str], date_to: Optional[str]):
+    """Keep rows played from date_from through date_to, both optional ISO dates or timestamps"""
+    if date_from:
+        query = query.filter(played_at_column >= _as_datetime(date_from))
+    if date_to:
+        try:
+            # A bare date includes every game played that day
+            next_day = date.fromisoformat(date_to) + timedelta(days=1)
+        except ValueError:
+            query = query.filter(played_at_column <= _as_datetime(date_to))
+        else:
+            query = query.filter(played_at_column < datetime.combine(next_day, datetime.min.time()))
+    return query
+
+def paginate_newest_first(query, played_at_column, id_column, cursor: Optional[str], limit: int):
+    """Return (rows, next_cursor) for a query ordered by (played_at, id) descending
+
+    Rows strictly after the cursor are selected by a seek on the composite key, so
+    every page costs the same regardless of depth.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        played_at, row_id = position
+        query = query.filter(or_(
+            played_at_column < played_at,
+            and_(played_at_column == played_at, id_column < row_id)
+        ))
+
+    # Fetch one extra row to learn whether another page exists
+    rows = query.order_by(played_at_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, played_at_column.key), getattr(last, id_column.key))
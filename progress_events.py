@@ -0,0 +1,131 @@
+"""
+In-process publish/subscribe of per-user operation progress for Server-Sent Events
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+
+# Events a slow client may fall behind by before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+class ProgressBroker:
+    """Fans progress events out to every open stream of a user"""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.last_status = {}  # Last status published per user with open streams
+        self.lock = threading.Lock()
+        self.stats = {'published': 0, 'dropped': 0}
+
+    def subscribe(self, username: str) -> queue.Queue:
+        """Register a new stream and return the queue its events arrive on"""
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers[username].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, username: str, subscriber: queue.Queue):
+        """Remove a stream once its client has disconnected"""
+        with self.lock:
+            self.subscribers[username].discard(subscriber)
+            if not self.subscribers[username]:
+                del self.subscribers[username]
+                self.last_status.pop(username, None)
+
+    def remember_status(self, username: str, data: dict):
+        """Record a status a stream has sent on its own, so it is not published again unchanged"""
+        with self.lock:
+            if username in self.subscribers:
+                self.last_status[username] = data
+
+    def usernames(self) -> list:
+        """Users with at least one open stream"""
+        with self.lock:
+            return list(self.subscribers)
+
+    def publish(self, username: str, event: str, data: dict):
+        """Send an event to all of a user's streams without blocking the publisher"""
+        message = format_event(event, data)
+        with self.lock:
+            subscribers = list(self.subscribers.get(username, ()))
+            if event == 'status' and subscribers:
+                self.last_status[username] = data
+            self.stats['published'] += 1
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Progress is cumulative, so losing an old event is harmless
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(message)
+                except (queue.Empty, queue.Full):
+                    pass
+                with self.lock:
+                    self.stats['dropped'] += 1
+
+    def get_stats(self) -> dict:
+        """Get open stream and event counters"""
+        with self.lock:
+            streams = sum(len(subscribers) for subscribers in self.subscribers.values())
+            return {'streams': streams, **self.stats}
+
+class StatusPoller:
+    """One thread that re-reads the status of every user with an open stream
+
+    Workers may run in other processes, so status has to be polled from the
+    queue; doing it here once per user, rather than in every stream, keeps the
+    load on jobs.db independent of how many tabs are open. Changes are published
+    to the broker, and users with open streams are marked active every
+    `touch_seconds`.
+    """
+
+    def __init__(self, broker: ProgressBroker, read_status, touch, interval: float = 1.0,
+                 touch_seconds: float = 15.0):
+        self.broker = broker
+        self.read_status = read_status
+        self.touch = touch
+        self.interval = interval
+        self.touch_seconds = touch_seconds
+        self.touched = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """Start the polling thread unless it is already running"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='status-poller', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+
+    def poll(self):
+        """Publish every watched user's status if it changed since it was last published"""
+        now = time.monotonic()
+        usernames = self.broker.usernames()
+        for username in usernames:
+            try:
+                if now - self.touched.get(username, 0.0) >= self.touch_seconds:
+                    self.touch(username)
+                    self.touched[username] = now
+                status = self.read_status(username)
+            except Exception as e:
+                print(f"[WARN] Status poll failed for {username}: {e}")
+                continue
+            with self.broker.lock:
+                changed = status != self.broker.last_status.get(username)
+            if changed:
+                self.broker.publish(username, 'status', status)
+        for username in set(self.touched) - set(usernames):
+            del self.touched[username]
+
+def format_event(event: str, data: dict) -> str:
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Remote analysis worker: pulls games over HTTP and analyzes them with a local Stockfish
+
+Needs no access to the server's data directory, only its URL and the worker
+token the server was started with (BLUNDER_WORKER_TOKEN):
+
+    python remote_worker.py --server http://chess-host:5000 --token s3cret
+
+Start one per engine slot; several can run on one machine. Each finished game
+is submitted as soon as it is analyzed, so a worker that dies loses at most the
+game it was on; the server hands the rest of its job to another worker once
+the lease expires.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+
+import aiohttp
+
+from cancellation import AnalysisCancelled, CancellationToken
+from game_analyzer import GameAnalyzer
+
+POLL_INTERVAL_SECONDS = 5.0
+
+class LeaseLost(Exception):
+    """The server gave this worker's job to someone else"""
+
+class RemoteWorker:
+    """Claim, analyze and submit games until stopped"""
+
+    def __init__(self, server: str, token: str, worker_id=None, max_games=None,
+                 poll_interval: float = POLL_INTERVAL_SECONDS, analyzer=None):
+        self.server = server.rstrip('/')
+        self.token = token
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:remote"
+        self.max_games = max_games
+        self.poll_interval = poll_interval
+        self.analyzer = analyzer or GameAnalyzer()
+        self.stopping = False
+        self.http = None
+        # One request at a time, so heartbeats never race a submit's progress update
+        self.request_lock = asyncio.Lock()
+
+    async def call(self, path: str, payload: dict) -> dict:
+        async with self.request_lock:
+            async with self.http.post(f"{self.server}{path}", json=payload) as response:
+                body = await response.json(content_type=None)
+                if response.status == 409:
+                    raise LeaseLost(body.get('error'))
+                if response.status != 200:
+                    raise RuntimeError(f"{path} failed ({response.status}): {body.get('error')}")
+                return body
+
+    async def run(self, once: bool = False):
+        """Work until stop() is called (or, with once, until the server has no work)"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        async with aiohttp.ClientSession(headers=headers) as self.http:
+            print(f"[INFO] Remote worker {self.worker_id} pulling from {self.server}")
+            while not self.stopping:
+                try:
+                    claim = (await self.call('/api/worker/claim', {
+                        'worker_id': self.worker_id, 'max_games': self.max_games
+                    }))['job']
+                except (aiohttp.ClientError, RuntimeError) as e:
+                    print(f"[WARN] Claim failed: {e}")
+                    claim = None
+                if claim is None:
+                    if once:
+                        return
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                try:
+                    await self.run_claim(claim)
+                except LeaseLost as e:
+                    print(f"[WARN] Lost the lease on job {claim['job_id']}: {e}")
+                except (aiohttp.ClientError, RuntimeError) as e:
+                    # Unsubmitted games go to another worker when the lease expires
+                    print(f"[WARN] Job {claim['job_id']} abandoned: {e}")
+
+    async def run_claim(self, claim: dict):
+        """Analyze a claimed batch, heartbeating until it is submitted"""
+        job = {'job_id': claim['job_id'], 'claim_token': claim['claim_token']}
+        print(f"[INFO] Job {claim['job_id']} for {claim['username']}: {len(claim['games'])} games at depth {claim['depth']}")
+        cancel_token = CancellationToken()
+        current = {'game': None}
+        heartbeat = asyncio.create_task(self._heartbeat(job, claim['lease_seconds'], cancel_token, current))
+        stopped = None
+        partial_game = None
+        try:
+            for game in claim['games']:
+                if cancel_token.cancelled or self.stopping:
+                    # A worker shutting down hands the rest back like a preempted slice
+                    stopped = cancel_token.reason or 'preempted'
+                    break
+                current['game'] = game['lichess_id']
+                try:
+                    success, move_evaluations = await self.analyzer.analyze_game_with_time_limit(
+                        game['pgn'], game['user_color'], claim['time_limit_per_game'],
+                        cancel_token=cancel_token, resume=game.get('resume'), depth=claim['depth']
+                    )
+                except AnalysisCancelled as e:
+                    stopped = e.reason
+                    partial_game = {
+                        'lichess_id': game['lichess_id'],
+                        'ply': e.ply,
+                        'move_evaluations': e.move_evaluations,
+                        'elapsed_seconds': e.elapsed_seconds
+                    }
+                    break
+                await self.call('/api/worker/submit', job | {'results': [{
+                    'lichess_id': game['lichess_id'],
+                    'success': success,
+                    'move_evaluations': move_evaluations
+                }]})
+                print(f"{'✓' if success else '✗'} Game {game['lichess_id']} submitted ({len(move_evaluations)} moves)")
+        finally:
+            heartbeat.cancel()
+        if stopped == 'lease lost':
+            raise LeaseLost('heartbeat rejected')
+        reply = await self.call('/api/worker/submit', job | {
+            'results': [], 'done': True, 'stopped': stopped, 'partial_game': partial_game
+        })
+        print(f"[INFO] Job {claim['job_id']} {reply['state']}")
+
+    async def _heartbeat(self, job: dict, lease_seconds: float, cancel_token, current: dict):
+        """Renew the lease and relay stop requests until cancelled"""
+        interval = max(1.0, min(5.0, lease_seconds / 4))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                reply = await self.call('/api/worker/heartbeat', job | {'current_game': current['game']})
+            except LeaseLost:
+                cancel_token.cancel('lease lost')
+                return
+            except (aiohttp.ClientError, RuntimeError) as e:
+                # Keep analyzing; the lease survives a few missed heartbeats
+                print(f"[WARN] Heartbeat failed: {e}")
+                continue
+            if reply.get('stop'):
+                cancel_token.cancel(reply['stop'])
+
+    def stop(self):
+        """Finish the current game, hand back the rest of the batch and exit"""
+        self.stopping = True
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze games for a remote Chess Blunder Tracker server")
+    parser.add_argument('--server', required=True, help="Base URL of the web server, e.g. http://localhost:5000")
+    parser.add_argument('--token', default=os.environ.get('BLUNDER_WORKER_TOKEN'), help="Worker token (default: $BLUNDER_WORKER_TOKEN)")
+    parser.add_argument('--worker-id', help="Name shown in job progress (default: host:pid)")
+    parser.add_argument('--max-games', type=int, help="Games to take per claim (capped by the server)")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL_SECONDS)
+    parser.add_argument('--once', action='store_true', help="Exit once the server has no work")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("--token or BLUNDER_WORKER_TOKEN is required")
+
+    worker = RemoteWorker(args.server, args.token, args.worker_id, args.max_games, args.poll_interval)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    asyncio.run(worker.run(once=args.once))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+In-process cache of computed API response bodies, keyed by data version
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Maximum total size of cached response bodies across all users and endpoints
+RESPONSE_CACHE_BYTES = int(float(os.environ.get('BLUNDER_RESPONSE_CACHE_MB', 64)) * 1024 * 1024)
+
+class ResponseCache:
+    """Thread-safe LRU of computed response bodies, bounded by their total size
+
+    Keys include the user's data version, so entries for older versions are never
+    served again and simply age out. Callers give each entry's size in bytes: the
+    length of encoded payloads, or of the serialized JSON for raw bodies.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'too_large': 0}
+
+    def get(self, key):
+        """Return a cached body or None, marking it most recently used"""
+        with self.lock:
+            if key not in self.entries:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return self.entries[key]
+
+    def put(self, key, body, size: int):
+        """Store a body of `size` bytes, evicting the least recently used entries beyond capacity"""
+        with self.lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                self.stats['too_large'] += 1
+                return
+            self.entries[key] = body
+            self.sizes[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._discard(next(iter(self.entries)))
+
+    def _discard(self, key):
+        if key in self.entries:
+            del self.entries[key]
+            self.total_bytes -= self.sizes.pop(key)
+
+    def record_not_modified(self):
+        """Count a conditional request answered with 304"""
+        with self.lock:
+            self.stats['not_modified'] += 1
+
+    def get_stats(self) -> dict:
+        """Get hit/miss counters and current size"""
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'capacity_bytes': self.max_bytes,
+                    **self.stats}
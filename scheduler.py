@@ -0,0 +1,68 @@
+"""
+Engine slot sizing and fair-share scheduling parameters for analysis jobs
+
+Analysis jobs run one slice (a write batch of games) per claim and then go to
+the back of the queue, so engine slots rotate between users (round-robin) and a
+short backlog never waits behind a long one. Within a slice, a user who has
+held an engine past the quantum while someone else waits is preempted.
+"""
+
+import json
+import math
+import os
+from typing import Optional
+
+# Written by `python autotune.py`; environment variables override it
+ENGINE_CONFIG_PATH = os.environ.get('BLUNDER_ENGINE_CONFIG', os.path.join('data', 'engine_config.json'))
+
+def load_engine_config(path: str = ENGINE_CONFIG_PATH) -> dict:
+    """The autotuned engine settings (threads, hash_mb, slots), or {} when there are none"""
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Ignoring engine config {path}: {e}")
+        return {}
+    return {key: int(config[key]) for key in ('threads', 'hash_mb', 'slots') if config.get(key)}
+
+ENGINE_CONFIG = load_engine_config()
+
+# Stockfish Threads per engine; slots are sized so engines never oversubscribe the CPU
+ENGINE_THREADS = int(os.environ.get('BLUNDER_ENGINE_THREADS', ENGINE_CONFIG.get('threads', 1)))
+
+# Stockfish Hash per engine in MB; 0 keeps the engine's default
+ENGINE_HASH_MB = int(os.environ.get('BLUNDER_ENGINE_HASH_MB', ENGINE_CONFIG.get('hash_mb', 0)))
+
+# Games an analysis job analyzes before yielding its engine slot to the next user; one
+# write batch (BLUNDER_WRITE_BATCH_GAMES) by default, so each slice ends in a single commit
+ANALYSIS_SLICE_GAMES = int(os.environ.get('BLUNDER_ANALYSIS_SLICE_GAMES',
+                                          os.environ.get('BLUNDER_WRITE_BATCH_GAMES', 10)))
+
+# A slice running longer than this is preempted at the next ply if another user is waiting
+ANALYSIS_QUANTUM_SECONDS = float(os.environ.get('BLUNDER_ANALYSIS_QUANTUM_SECONDS', 30))
+
+# Assumed game analysis time until real measurements exist
+DEFAULT_GAME_SECONDS = 30.0
+
+def engine_slot_count(cpu_count: Optional[int] = None, engine_threads: int = ENGINE_THREADS) -> int:
+    """Number of engines that can run at once: BLUNDER_ENGINE_SLOTS, the autotuned count, or cores / threads per engine"""
+    override = os.environ.get('BLUNDER_ENGINE_SLOTS') or (ENGINE_CONFIG.get('slots') if cpu_count is None else None)
+    if override:
+        return max(1, int(override))
+    cpus = cpu_count or os.cpu_count() or 1
+    return max(1, cpus // max(1, engine_threads))
+
+# Analyses running at once across every worker process sharing the data directory;
+# raise it when workers on several hosts share one queue
+MAX_RUNNING_ANALYSES = int(os.environ.get('BLUNDER_MAX_RUNNING_ANALYSES', 0)) or engine_slot_count()
+
+def estimate_wait_seconds(position: int, running: int, slots: int, slice_seconds: float) -> float:
+    """Expected time until the job at `position` in line (0 = next) gets an engine slot"""
+    free_slots = max(0, slots - running)
+    if position < free_slots:
+        return 0.0
+    # Every slice ahead of us occupies one slot for about slice_seconds
+    rounds = math.ceil((position + 1 - free_slots) / slots)
+    return rounds * slice_seconds
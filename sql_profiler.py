@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Per-request SQL profiling, slow-query log and query-count budgets
+
+Set BLUNDER_SQL_PROFILE=1 to have every API response report its statement
+count and database time (X-SQL-Queries, X-SQL-Time-Ms and Server-Timing
+headers). Set BLUNDER_SLOW_QUERY_MS to log statements slower than that, with
+their EXPLAIN QUERY PLAN. To catch N+1 regressions, run the endpoint budgets
+against an existing user database:
+
+    python sql_profiler.py kencht
+"""
+
+import contextlib
+import contextvars
+import os
+import sys
+import time
+from typing import Optional
+
+from sqlalchemy import event
+
+SQL_PROFILE = os.environ.get('BLUNDER_SQL_PROFILE', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.environ.get('BLUNDER_SLOW_QUERY_MS', 0))  # 0 disables the slow-query log
+
+# Statements kept per profile for reporting; counts and time are always complete
+MAX_RECORDED_STATEMENTS = 200
+
+# Most statements a request to each endpoint may run (user and job databases together)
+QUERY_BUDGETS = {
+    '/api/stats': 15,
+    '/api/recent-games': 4,
+    '/api/games': 4,
+    '/api/blunders': 3,
+    '/api/blunder-analysis': 8,
+    '/api/performance': 3,
+    '/api/problem-positions': 5,
+    '/api/opening-tree': 5,
+}
+
+class QueryProfile:
+    """Statements run while the profile was active"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        if len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append((statement, seconds))
+
+    def headers(self) -> dict:
+        """Debug response headers describing this profile"""
+        ms = self.seconds * 1000
+        return {
+            'X-SQL-Queries': str(self.count),
+            'X-SQL-Time-Ms': f'{ms:.2f}',
+            'Server-Timing': f'db;dur={ms:.2f};desc="{self.count} queries"',
+        }
+
+_active_profile = contextvars.ContextVar('sql_profile', default=None)
+
+def start_profile() -> contextvars.Token:
+    """Begin collecting statements for the current request or block"""
+    return _active_profile.set(QueryProfile())
+
+def current_profile() -> Optional[QueryProfile]:
+    return _active_profile.get()
+
+def stop_profile(token: contextvars.Token) -> QueryProfile:
+    """Stop collecting and return what the profile saw"""
+    profile = _active_profile.get()
+    _active_profile.reset(token)
+    return profile
+
+@contextlib.contextmanager
+def count_queries():
+    """Collect the statements run inside the block
+
+        with count_queries() as profile:
+            client.get('/api/recent-games?username=kencht')
+        print(profile.count)
+    """
+    token = start_profile()
+    profile = current_profile()
+    try:
+        yield profile
+    finally:
+        stop_profile(token)
+
+@contextlib.contextmanager
+def assert_max_queries(limit: int, label: str = 'block'):
+    """Fail with the statements run if the block runs more than `limit` of them"""
+    with count_queries() as profile:
+        yield profile
+    if profile.count > limit:
+        statements = '\n'.join(f"  {seconds * 1000:7.2f}ms  {' '.join(statement.split())}" for statement, seconds in profile.statements)
+        raise AssertionError(f"{label} ran {profile.count} SQL statements (budget {limit}):\n{statements}")
+
+def attach(engine):
+    """Feed an engine's statements to the active profile and the slow-query log"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['profile_query_start'].pop()
+        profile = _active_profile.get()
+        if profile is not None:
+            profile.record(statement, seconds)
+        if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+            log_slow_query(cursor, statement, parameters, seconds, executemany)
+
+    return engine
+
+def log_slow_query(cursor, statement: str, parameters, seconds: float, executemany: bool = False):
+    """Print a slow statement with SQLite's plan for it"""
+    print(f"[SLOW SQL] {seconds * 1000:.1f}ms: {' '.join(statement.split())}")
+    if executemany or not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+        return
+    try:
+        plan = cursor.connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).fetchall()
+    except Exception as e:
+        print(f"[SLOW SQL]   (no plan: {e})")
+        return
+    for row in plan:
+        print(f"[SLOW SQL]   {row[-1]}")
+
+def check_query_budgets(client, username: str, budgets: Optional[dict] = None) -> list:
+    """Request each budgeted endpoint; returns (path, count, budget) for those over budget"""
+    failures = []
+    for path, budget in (budgets or QUERY_BUDGETS).items():
+        with count_queries() as profile:
+            response = client.get(f'{path}?username={username}')
+        status = 'ok' if profile.count <= budget else 'OVER BUDGET'
+        print(f"{path}: {profile.count} statements, {profile.seconds * 1000:.1f}ms "
+              f"(budget {budget}, HTTP {response.status_code}) {status}")
+        if profile.count > budget:
+            failures.append((path, profile.count, budget))
+    return failures
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python sql_profiler.py <username>")
+        sys.exit(2)
+    from app import app
+    failures = check_query_budgets(app.test_client(), sys.argv[1])
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
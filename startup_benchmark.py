@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the web server and analysis workers
+
+Starts fresh interpreters (in a scratch directory, so no real data is touched)
+and times importing app.py and worker.py, then times engine discovery with and
+without the per-process cache. Exits non-zero when the median app import is
+over budget or a lazily imported module was loaded eagerly; the same checks
+run in tests/test_startup.py:
+
+    python startup_benchmark.py
+    python startup_benchmark.py --runs 10 --budget-ms 800
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Median time to import app.py in a fresh interpreter
+STARTUP_BUDGET_MS = float(os.environ.get('BLUNDER_STARTUP_BUDGET_MS', 1500))
+
+# Imported on first use only; loading one at startup is a regression. The web
+# server reaches the engine code (and python-chess) only once it runs a job
+LAZY_MODULES = {
+    'app': ('aiohttp', 'lichess_client', 'chess', 'game_analyzer', 'main', 'worker'),
+    'worker': ('aiohttp', 'lichess_client'),
+}
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+print(json.dumps({{'ms': (time.perf_counter() - started) * 1000, 'modules': sorted(sys.modules)}}))
+"""
+
+def measure_import(module: str, runs: int = 5) -> dict:
+    """Import and whole-process times (ms) of `import module` in fresh interpreters"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [repo, os.environ.get('PYTHONPATH')])))
+    import_ms, process_ms, eager = [], [], set()
+    with tempfile.TemporaryDirectory() as scratch:
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], cwd=scratch, env=env,
+                                    capture_output=True, text=True, check=True)
+            process_ms.append((time.perf_counter() - started) * 1000)
+            probe = json.loads(result.stdout.strip().splitlines()[-1])
+            import_ms.append(probe['ms'])
+            eager.update(name for name in probe['modules'] if name.split('.')[0] in LAZY_MODULES.get(module, ()))
+    return {
+        'import_ms': round(statistics.median(import_ms), 1),
+        'process_ms': round(statistics.median(process_ms), 1),
+        'eager_modules': sorted(eager),
+    }
+
+def measure_engine_discovery() -> dict:
+    """First (searching, UCI handshake) and cached engine lookups, in ms"""
+    import game_analyzer
+    started = time.perf_counter()
+    try:
+        game_analyzer.find_stockfish_engine()
+    except FileNotFoundError:
+        return {'first_ms': None, 'cached_ms': None}
+    first = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    game_analyzer.find_stockfish_engine()
+    return {'first_ms': round(first, 1), 'cached_ms': round((time.perf_counter() - started) * 1000, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the server and workers")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS, help="Median app import budget")
+    args = parser.parse_args()
+
+    failures = []
+    for module in ('app', 'worker'):
+        result = measure_import(module, args.runs)
+        print(f"[INFO] import {module}: {result['import_ms']}ms (process {result['process_ms']}ms)")
+        if result['eager_modules']:
+            failures.append(f"import {module} loads {', '.join(result['eager_modules'])} eagerly")
+        if module == 'app' and result['import_ms'] > args.budget_ms:
+            failures.append(f"import app took {result['import_ms']}ms, budget {args.budget_ms}ms")
+
+    discovery = measure_engine_discovery()
+    if discovery['first_ms'] is None:
+        print("[WARN] Stockfish not found; engine discovery not measured")
+    else:
+        print(f"[INFO] engine discovery: {discovery['first_ms']}ms first, {discovery['cached_ms']}ms cached")
+
+    for failure in failures:
+        print(f"[REGRESSION] {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Synthetic user databases for load testing
+
+Fills data/chess_blunders_<user>.db through DatabaseManager with random but
+legal games, analyzed moves (with realistic centipawn-loss spread, position
+hashes and best moves) and the opening tree:
+
+    python synthetic_data.py loadtest --games 5000 --moves-per-game 40
+
+5000 games of 40 plies give 100k analyzed moves. Generation is seeded, so
+the same arguments always produce the same database.
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+from database_multiuser import DatabaseManager, Game, Move, QUALITY_FULL, bump_data_version, to_signed64
+import opening_tree
+
+TIME_CONTROLS = ['60+0', '120+1', '180+0', '180+2', '300+0', '300+3', '600+0', '600+5', '900+10', '1800+0', '1800+30']
+# Games start with one of these lines, so the opening tree has shared prefixes like a real repertoire
+OPENINGS = {
+    'Sicilian Defense': 'e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3',
+    'French Defense': 'e4 e6 d4 d5 Nc3 Nf6',
+    'Caro-Kann Defense': 'e4 c6 d4 d5 Nc3 dxe4 Nxe4',
+    'Ruy Lopez': 'e4 e5 Nf3 Nc6 Bb5 a6 Ba4 Nf6 O-O',
+    'Italian Game': 'e4 e5 Nf3 Nc6 Bc4 Bc5 c3 Nf6',
+    'Scandinavian Defense': 'e4 d5 exd5 Qxd5 Nc3 Qa5',
+    "Queen's Gambit Declined": 'd4 d5 c4 e6 Nc3 Nf6 Bg5',
+    'Slav Defense': 'd4 d5 c4 c6 Nf3 Nf6',
+    "King's Indian Defense": 'd4 Nf6 c4 g6 Nc3 Bg7 e4 d6',
+    'London System': 'd4 d5 Bf4 Nf6 e3 e6 Nf3',
+    'English Opening': 'c4 e5 Nc3 Nf6 g3',
+}
+
+# Games written per transaction
+INSERT_BATCH_GAMES = 500
+
+def centipawn_loss(rng: random.Random) -> int:
+    """Most moves lose little; a few are mistakes and blunders"""
+    roll = rng.random()
+    if roll < 0.03:
+        return rng.randint(300, 900)
+    if roll < 0.10:
+        return rng.randint(100, 299)
+    if roll < 0.22:
+        return rng.randint(50, 99)
+    return int(rng.expovariate(1 / 12))
+
+def random_game(rng: random.Random, opening: str, plies: int):
+    """An opening line continued with random legal moves, as (pgn game, [(board before, move)])"""
+    board = chess.Board()
+    game = chess.pgn.Game()
+    node = game
+    played = []
+    # Leave the book early now and then
+    book = OPENINGS[opening].split()[:rng.randint(2, 12)]
+    for ply in range(plies):
+        if ply < len(book):
+            move = board.parse_san(book[ply])
+        else:
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+        played.append((board.copy(stack=False), move))
+        node = node.add_variation(move)
+        board.push(move)
+    return game, played
+
+def generate_user(db_manager: DatabaseManager, username: str, games: int, moves_per_game: int = 40,
+                  seed: int = 0, start: datetime = datetime(2020, 1, 1), with_opening_tree: bool = True) -> dict:
+    """Add `games` analyzed games to a user's database; returns counts and timing"""
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    db = db_manager.get_db(username)
+    existing = db.query(Game).filter(Game.username == username).count()
+    played_at = start
+    user_rating = 1500
+    moves_written = 0
+    try:
+        for batch_start in range(0, games, INSERT_BATCH_GAMES):
+            game_rows = []
+            move_rows = []
+            for i in range(batch_start, min(games, batch_start + INSERT_BATCH_GAMES)):
+                played_at += timedelta(minutes=rng.randint(5, 600))
+                user_rating = max(800, min(2800, user_rating + rng.randint(-12, 12)))
+                user_color = rng.choice(['white', 'black'])
+                time_control = rng.choice(TIME_CONTROLS)
+                opening_name = rng.choice(list(OPENINGS))
+                opponent_rating = user_rating + rng.randint(-300, 300)
+                pgn_game, played = random_game(rng, opening_name, rng.randint(moves_per_game // 2, moves_per_game * 3 // 2))
+                pgn_game.headers['White'] = username if user_color == 'white' else 'opponent'
+                pgn_game.headers['Black'] = username if user_color == 'black' else 'opponent'
+                game = Game(
+                    lichess_id=f'syn{existing + i:08d}',
+                    username=username,
+                    played_at=played_at,
+                    time_control=time_control,
+                    variant='standard',
+                    opening_name=opening_name,
+                    user_color=user_color,
+                    user_rating=user_rating,
+                    opponent_rating=opponent_rating,
+                    result=rng.choice(['win', 'loss', 'draw']),
+                    pgn=str(pgn_game),
+                    fully_analyzed=True,
+                    analysis_started_at=played_at,
+                    analysis_completed_at=played_at,
+                    analysis_quality=QUALITY_FULL
+                )
+                user_turn = chess.WHITE if user_color == 'white' else chess.BLACK
+                moves = []
+                for ply, (board, move) in enumerate(played, start=1):
+                    if board.turn != user_turn:
+                        continue
+                    loss = centipawn_loss(rng)
+                    moves.append(Move(
+                        game_lichess_id=game.lichess_id,
+                        move_number=ply,
+                        played_at=played_at,
+                        move_san=board.san(move),
+                        centipawn_loss=loss,
+                        opponent_rating=opponent_rating,
+                        opening_name=opening_name,
+                        time_control=time_control,
+                        user_color=user_color,
+                        is_blunder=loss >= 300,
+                        is_mistake=loss >= 100,
+                        is_inaccuracy=loss >= 50,
+                        position_hash=to_signed64(chess.polyglot.zobrist_hash(board)),
+                        best_move=board.san(rng.choice(list(board.legal_moves))),
+                        analysis_quality=QUALITY_FULL
+                    ))
+                game_rows.append((game, moves))
+                move_rows.extend(moves)
+            db.add_all([game for game, _ in game_rows])
+            db.add_all(move_rows)
+            if with_opening_tree:
+                for game, moves in game_rows:
+                    opening_tree.add_game(db, game, moves)
+            bump_data_version(db)
+            db.commit()
+            db.expunge_all()
+            moves_written += len(move_rows)
+            print(f"[INFO] {username}: {min(games, batch_start + INSERT_BATCH_GAMES)}/{games} games, {moves_written} moves")
+    finally:
+        db.close()
+    return {'games': games, 'moves': moves_written, 'seconds': round(time.perf_counter() - started, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill user databases with synthetic analyzed games")
+    parser.add_argument('usernames', nargs='+')
+    parser.add_argument('--games', type=int, default=2000, help="Games per user")
+    parser.add_argument('--moves-per-game', type=int, default=40, help="Average plies per game")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=None)
+    parser.add_argument('--no-opening-tree', action='store_true', help="Skip the opening tree (faster)")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(args.data_dir)
+    for i, username in enumerate(args.usernames):
+        result = generate_user(db_manager, username, args.games, args.moves_per_game, seed=args.seed + i,
+                               with_opening_tree=not args.no_opening_tree)
+        print(f"[INFO] {username}: wrote {result['games']} games and {result['moves']} moves in {result['seconds']}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """A scratch working directory, so data/ and jobs.db never touch real data"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / 'data'
+
+@pytest.fixture
+def db_manager(data_dir):
+    from database_multiuser import DatabaseManager
+    manager = DatabaseManager(str(data_dir))
+    yield manager
+    manager.dispose_all()
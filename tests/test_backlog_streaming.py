@@ -0,0 +1,32 @@
+import tracemalloc
+
+from database_multiuser import Game
+from main import iter_backlog
+from synthetic_data import generate_user
+
+def stream_peak_bytes(db_manager, username: str, games: int) -> int:
+    """Peak traced memory while streaming a backlog of `games` synthetic games"""
+    generate_user(db_manager, username, games=games, moves_per_game=10, with_opening_tree=False)
+    db = db_manager.get_db(username)
+    db.query(Game).update({Game.analysis_quality: 0})
+    db.commit()
+    db.expunge_all()
+
+    streamed = 0
+    tracemalloc.start()
+    try:
+        for game in iter_backlog(db, username, batch_size=50, between_batches=db.expunge_all):
+            assert game.pgn
+            streamed += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        db.close()
+    assert streamed == games
+    return peak
+
+def test_backlog_memory_does_not_grow_with_game_count(db_manager):
+    small = stream_peak_bytes(db_manager, 'small', 200)
+    large = stream_peak_bytes(db_manager, 'large', 1200)
+    # Six times the games; holding them all would need roughly six times the memory
+    assert large < small * 1.5
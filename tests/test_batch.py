@@ -0,0 +1,74 @@
+import io
+import sqlite3
+
+import pytest
+
+import batch
+from job_queue import JobQueue
+
+class FakeTracker:
+    analyzed = []
+
+    def __init__(self, progress_callback=None):
+        pass
+
+    async def analyze_games(self, username, **kwargs):
+        FakeTracker.analyzed.append(username)
+        return {'games_analyzed': 2, 'games_skipped': 0, 'positions_analyzed': 40, 'games_remaining': 0}
+
+@pytest.fixture
+def runner(data_dir, monkeypatch):
+    monkeypatch.setattr(batch, 'BlunderTracker', FakeTracker)
+    monkeypatch.setattr(batch, 'GameAnalyzer', lambda **kwargs: None)
+    FakeTracker.analyzed = []
+    return batch.BatchRunner(batch.EventWriter(io.StringIO()), parallel=2, engines=2, fetch=False,
+                             job_queue=JobQueue(str(data_dir)))
+
+def test_users_with_a_running_job_are_skipped(runner):
+    job_queue = runner.job_queue
+    job_queue.enqueue('alice', 'analyze')
+    assert job_queue.claim('web-worker', ('analyze',)).username == 'alice'
+
+    reports = runner.run(['alice', 'bob'])
+
+    assert [report['status'] for report in reports] == ['busy', 'ok']
+    assert FakeTracker.analyzed == ['bob']
+    assert job_queue.get_active_job('bob') is None
+
+def test_user_is_held_in_the_queue_while_refreshed(runner, monkeypatch):
+    held = []
+
+    async def analyze_games(self, username, **kwargs):
+        held.append(runner.job_queue.enqueue_exclusive(username, 'analyze'))
+        held.append(runner.job_queue.claim('web-worker', ('analyze',)))
+        return {'games_analyzed': 0, 'games_skipped': 0, 'positions_analyzed': 0, 'games_remaining': 0}
+
+    monkeypatch.setattr(FakeTracker, 'analyze_games', analyze_games)
+    assert runner.run(['alice'])[0]['status'] == 'ok'
+    assert held == [None, None]
+
+def test_job_queue_errors_fail_only_that_user(runner, monkeypatch):
+    job_queue = runner.job_queue
+    claim_exclusive = job_queue.claim_exclusive
+    complete = job_queue.complete
+
+    def locked_claim(username, *args, **kwargs):
+        if username == 'alice':
+            raise sqlite3.OperationalError('database is locked')
+        return claim_exclusive(username, *args, **kwargs)
+
+    def locked_complete(job, *args, **kwargs):
+        if job.username == 'bob':
+            raise sqlite3.OperationalError('database is locked')
+        return complete(job, *args, **kwargs)
+
+    monkeypatch.setattr(job_queue, 'claim_exclusive', locked_claim)
+    monkeypatch.setattr(job_queue, 'complete', locked_complete)
+    reports = runner.run(['alice', 'bob', 'carol'])
+
+    assert [report['status'] for report in reports] == ['error', 'error', 'ok']
+    assert 'database is locked' in reports[0]['error']
+    assert sorted(FakeTracker.analyzed) == ['bob', 'carol']
+    assert runner.user_tokens == set()
+    assert job_queue.get_active_job('carol') is None
+    assert batch.exit_code(reports, False) == batch.EXIT_PARTIAL
@@ -0,0 +1,38 @@
+import io
+
+import chess.pgn
+
+import compact_pgn
+
+STANDARD = '''[Event "Rated blitz game"]
+[White "alice"]
+[Black "bob"]
+[Result "1-0"]
+
+1. e4 { [%clk 0:03:00] } d5 2. exd5 c6 3. dxc6 Qd7 4. cxb7 Qe6+ 5. Be2 Qxe2+ 6. Nxe2 Nf6 7. bxa8=Q 1-0
+'''
+
+CRAZYHOUSE = '''[Event "Rated crazyhouse game"]
+[Variant "Crazyhouse"]
+[Result "*"]
+
+1. e4 d5 2. exd5 Nf6 3. Nc3 Nxd5 4. Nxd5 Qxd5 5. N@f6+ exf6 6. P@e4 *
+'''
+
+def mainline_uci(pgn_text):
+    return [move.uci() for move in chess.pgn.read_game(io.StringIO(pgn_text)).mainline_moves()]
+
+def test_round_trip_keeps_moves_and_promotions():
+    packed = compact_pgn.encode(STANDARD, keep_comments=False)
+    assert isinstance(packed, bytes)
+    assert mainline_uci(compact_pgn.decode(packed)) == mainline_uci(STANDARD)
+
+def test_round_trip_keeps_comments_when_asked():
+    decoded = compact_pgn.decode(compact_pgn.encode(STANDARD, keep_comments=True))
+    assert chess.pgn.read_game(io.StringIO(decoded)).next().comment == '[%clk 0:03:00]'
+
+def test_games_with_drops_are_stored_as_text():
+    assert compact_pgn.encode(CRAZYHOUSE) == CRAZYHOUSE
+    game = chess.pgn.read_game(io.StringIO(CRAZYHOUSE))
+    assert not game.errors
+    assert any(move.drop for move in game.mainline_moves())
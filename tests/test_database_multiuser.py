@@ -0,0 +1,82 @@
+import threading
+from datetime import datetime
+
+from database_multiuser import DatabaseManager, Game
+
+def add_game(db_manager, username):
+    db_manager.add_game(username, {'lichess_id': f'{username}1', 'played_at': datetime(2024, 1, 1), 'pgn': ''})
+
+def in_thread(fn):
+    """Run fn on a thread that stays alive (holding its session) until released"""
+    done, release = threading.Event(), threading.Event()
+    result = {}
+
+    def run():
+        result['value'] = fn()
+        done.set()
+        release.wait()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    done.wait()
+    return result['value'], release, thread
+
+def test_evict_closes_other_threads_sessions(db_manager):
+    add_game(db_manager, 'alice')
+
+    def load():
+        session = db_manager.get_session('alice')
+        games = session.query(Game).all()
+        session.commit()
+        return session, games
+
+    (session, games), release, thread = in_thread(load)
+    assert len(session.identity_map) == 1
+    db_manager.evict('alice')
+    assert 'alice' not in db_manager.engines
+    assert len(session.identity_map) == 0
+    release.set()
+    thread.join()
+
+def test_open_transaction_in_another_thread_blocks_eviction(data_dir):
+    db_manager = DatabaseManager(str(data_dir), idle_seconds=0)
+    add_game(db_manager, 'alice')
+    db_manager.close_session('alice')
+
+    def begin():
+        session = db_manager.get_session('alice')
+        session.query(Game).all()
+        return session
+
+    session, release, thread = in_thread(begin)
+    db_manager.evict_idle()
+    assert 'alice' in db_manager.engines
+    session.rollback()
+    db_manager.evict_idle()
+    assert 'alice' not in db_manager.engines
+    release.set()
+    thread.join()
+    db_manager.dispose_all()
+
+def test_session_kept_across_eviction_reopens_through_the_manager(db_manager):
+    add_game(db_manager, 'alice')
+
+    def load():
+        session = db_manager.get_session('alice')
+        session.query(Game).all()
+        session.commit()
+        return session
+
+    session, release, thread = in_thread(load)
+    db_manager.evict('alice')
+    evicted = db_manager.pool_stats['evictions']
+
+    # The thread's next statement reopens the database as a tracked engine
+    assert session.query(Game).count() == 1
+    assert 'alice' in db_manager.engines
+    assert db_manager.pool_stats['reopens'] == 1
+    session.rollback()
+    db_manager.evict('alice')
+    assert db_manager.pool_stats['evictions'] == evicted + 1
+    release.set()
+    thread.join()
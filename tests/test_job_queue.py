@@ -0,0 +1,32 @@
+from job_queue import BACKGROUND_PRIORITY, JobQueue
+
+def test_full_analysis_never_runs_beside_background_deepening(data_dir):
+    job_queue = JobQueue(str(data_dir))
+    job_queue.enqueue_exclusive('alice', 'analyze', {'quality': 'full', 'provisional_only': True},
+                                priority=BACKGROUND_PRIORITY)
+    deepening = job_queue.claim('worker-1', ('analyze',))
+    assert deepening.priority == BACKGROUND_PRIORITY
+
+    # What /api/analyze-games does for "progressive": false
+    full = job_queue.enqueue_exclusive('alice', 'analyze', {'quality': 'full'})
+    assert full is not None
+    assert job_queue.request_cancel('alice', 'superseded by full analysis', only_background=True) == 1
+    assert job_queue.cancel_reason(full) is None
+    assert job_queue.cancel_reason(deepening) == 'superseded by full analysis'
+
+    # The full job waits until the deepening job has stopped
+    assert job_queue.claim('worker-2', ('analyze',)) is None
+    assert job_queue.has_waiting('analyze', BACKGROUND_PRIORITY, deepening)
+    job_queue.cancelled(deepening, {})
+    assert job_queue.claim('worker-2', ('analyze',)).id == full.id
+
+def test_other_users_are_not_held_back(data_dir):
+    job_queue = JobQueue(str(data_dir), max_running={})
+    job_queue.enqueue('alice', 'analyze')
+    job_queue.enqueue('alice', 'analyze', priority=BACKGROUND_PRIORITY)
+    job_queue.enqueue('bob', 'analyze')
+    assert job_queue.claim('worker-1', ('analyze',)).username == 'alice'
+    assert job_queue.claim('worker-2', ('analyze',)).username == 'bob'
+    assert job_queue.claim('worker-3', ('analyze',)) is None
+    # Alice's queued job is held by her own running job, so it preempts nobody else
+    assert not job_queue.has_waiting('analyze', BACKGROUND_PRIORITY)
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from database_multiuser import Game
+from pagination import filter_played_between
+
+def test_date_to_includes_the_whole_day(db_manager):
+    for lichess_id, played_at in (('morning', datetime(2024, 1, 5, 0, 0)),
+                                  ('evening', datetime(2024, 1, 5, 23, 59, 59)),
+                                  ('next', datetime(2024, 1, 6, 0, 0))):
+        db_manager.add_game('alice', {'lichess_id': lichess_id, 'played_at': played_at, 'pgn': ''})
+    db = db_manager.get_db('alice')
+
+    def listed(date_from, date_to):
+        query = filter_played_between(db.query(Game), Game.played_at, date_from, date_to)
+        return sorted(game.lichess_id for game in query)
+
+    assert listed(None, '2024-01-05') == ['evening', 'morning']
+    assert listed('2024-01-05', '2024-01-06') == ['evening', 'morning', 'next']
+    assert listed('2024-01-05T12:00:00', None) == ['evening', 'next']
+    assert listed(None, '2024-01-05T12:00:00') == ['morning']
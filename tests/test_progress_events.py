@@ -0,0 +1,33 @@
+from progress_events import ProgressBroker, StatusPoller
+
+def test_one_poll_per_user_publishes_only_changes():
+    broker = ProgressBroker()
+    streams = [broker.subscribe('alice') for _ in range(5)]
+    reads, touches = [], []
+    status = {'analyzing': False}
+    poller = StatusPoller(broker, lambda username: reads.append(username) or dict(status), touches.append,
+                          touch_seconds=60)
+
+    poller.poll()
+    poller.poll()
+    assert reads == ['alice', 'alice']
+    assert touches == ['alice']
+    assert all(stream.qsize() == 1 for stream in streams)
+
+    status['analyzing'] = True
+    poller.poll()
+    assert all(stream.qsize() == 2 for stream in streams)
+
+def test_remembered_status_is_not_published_again():
+    broker = ProgressBroker()
+    stream = broker.subscribe('alice')
+    broker.remember_status('alice', {'analyzing': False})
+    StatusPoller(broker, lambda username: {'analyzing': False}, lambda username: None).poll()
+    assert stream.empty()
+
+def test_users_without_streams_are_not_polled():
+    broker = ProgressBroker()
+    broker.unsubscribe('alice', broker.subscribe('alice'))
+    reads = []
+    StatusPoller(broker, reads.append, lambda username: None).poll()
+    assert reads == []
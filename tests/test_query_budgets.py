@@ -0,0 +1,24 @@
+import pytest
+
+from sql_profiler import QUERY_BUDGETS, assert_max_queries
+
+USERNAME = 'budget'
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    """The app against a synthetic user, in a scratch data directory"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp('budgets'))
+        from app import app, db_manager, update_user_activity
+        from synthetic_data import generate_user
+        generate_user(db_manager, USERNAME, games=300, moves_per_game=30)
+        # Budgets are for an active user; the first request of a session also records activity
+        update_user_activity(USERNAME)
+        yield app.test_client()
+        db_manager.evict(USERNAME)
+
+@pytest.mark.parametrize('path', sorted(QUERY_BUDGETS))
+def test_endpoint_within_query_budget(client, path):
+    with assert_max_queries(QUERY_BUDGETS[path], path):
+        response = client.get(f'{path}?username={USERNAME}')
+    assert response.status_code == 200
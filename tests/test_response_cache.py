@@ -0,0 +1,25 @@
+from response_cache import ResponseCache
+
+def test_evicts_least_recently_used_beyond_byte_limit():
+    cache = ResponseCache(max_bytes=100)
+    cache.put('a', b'a' * 40, 40)
+    cache.put('b', b'b' * 40, 40)
+    assert cache.get('a') is not None
+    cache.put('c', b'c' * 40, 40)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.get_stats()['bytes'] == 80
+
+def test_replacing_an_entry_updates_its_size():
+    cache = ResponseCache(max_bytes=100)
+    cache.put('a', b'a' * 90, 90)
+    cache.put('a', b'a' * 10, 10)
+    assert cache.get_stats()['bytes'] == 10
+
+def test_body_larger_than_the_cache_is_not_stored():
+    cache = ResponseCache(max_bytes=100)
+    cache.put('a', b'a' * 40, 40)
+    cache.put('big', b'x' * 200, 200)
+    assert cache.get('big') is None
+    assert cache.get('a') is not None
+    assert cache.get_stats()['too_large'] == 1
@@ -0,0 +1,9 @@
+from startup_benchmark import STARTUP_BUDGET_MS, measure_import
+
+def test_app_import_is_within_budget_and_lazy():
+    result = measure_import('app', runs=3)
+    assert result['eager_modules'] == []
+    assert result['import_ms'] <= STARTUP_BUDGET_MS
+
+def test_worker_import_does_not_load_the_lichess_client():
+    assert measure_import('worker', runs=1)['eager_modules'] == []
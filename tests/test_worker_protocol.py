@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database_multiuser import Game
+from job_queue import JobQueue
+from worker_protocol import RemoteWorkerServer
+
+PGN = '[Event "Test"]\n\n1. e4 e5 2. Nf3 Nc6 *\n'
+
+@pytest.fixture
+def server(data_dir, db_manager):
+    db = db_manager.get_db('alice')
+    for i in range(3):
+        db.add(Game(lichess_id=f'g{i}', username='alice', played_at=datetime(2024, 1, 1) + timedelta(hours=i),
+                    user_color='white', pgn=PGN))
+    db.commit()
+    db.close()
+    return RemoteWorkerServer(JobQueue(str(data_dir)), db_manager)
+
+def test_failed_games_are_not_handed_out_again(server):
+    job = server.job_queue.enqueue('alice', 'analyze', {'quality': 'full'})
+    handed_out = []
+    for _ in range(5):
+        claim = server.claim('remote-1', max_games=1)
+        if claim is None:
+            break
+        assert claim['job_id'] == job.id
+        lichess_id = claim['games'][0]['lichess_id']
+        handed_out.append(lichess_id)
+        server.submit(claim['job_id'], claim['claim_token'], [
+            {'lichess_id': lichess_id, 'success': False, 'move_evaluations': []}
+        ], done=True)
+
+    assert handed_out == ['g2', 'g1', 'g0']
+    assert server.claim('remote-1') is None
+    job = server.job_queue.get_job(job.id).to_dict()
+    assert job['state'] == 'succeeded'
+    assert '3 skipped' in job['result']['result']
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Analysis worker: claims fetch/analyze jobs from the durable queue and runs them
+
+Run any number of these next to the web server (or on other hosts sharing the
+data directory):
+
+    python worker.py --kinds analyze
+"""
+
+import argparse
+import asyncio
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime, UTC
+
+from database_multiuser import QUALITY_LEVELS, QUALITY_QUICK
+from job_queue import JobQueue, JOB_KINDS, BACKGROUND_PRIORITY, default_worker_id
+from main import BlunderTracker
+from scheduler import ANALYSIS_SLICE_GAMES, ANALYSIS_QUANTUM_SECONDS
+from cancellation import CancellationToken
+from game_analyzer import PREWARM_DISCOVERY, prewarm_discovery
+import metrics
+
+POLL_INTERVAL_SECONDS = 2.0
+
+def run_fetch_job(job, params, progress, cancel_token):
+    """Fetch a batch of games for the job's user"""
+    batch_size = params.get('batch_size', 100)
+    fetch_older = params.get('fetch_older', False)
+    direction = "older" if fetch_older else "newer"
+    progress.update({'stage': 'fetching', 'current': 0, 'total': batch_size})
+
+    tracker = BlunderTracker()
+    games_added = asyncio.run(tracker.fetch_user_games(job.username, max_games=batch_size, fetch_older=fetch_older))
+    return {'result': f'Added {games_added} new {direction} games for {job.username}'}
+
+def run_analyze_job(job, params, progress, cancel_token):
+    """Analyze one slice of the job's user's unanalyzed games
+
+    Returns Requeue while backlog remains (or when preempted mid-game), so the
+    engine slot passes to the next user in line; counters and any partially
+    analyzed game carry over between slices in the job's progress. A finished
+    quick sweep asks for a background deepening job with 'deepen'.
+    """
+    time_limit_per_game = params.get('time_limit_per_game', 20)
+    total_time_limit = params.get('total_time_limit')
+    quality = QUALITY_LEVELS[params.get('quality', 'full')]
+
+    progress.update(job.to_dict()['progress'] or {
+        'stage': 'analyzing',
+        'current': 0,
+        'total': 0,
+        'start_time': datetime.now(UTC).isoformat(),
+        'time_limit_per_game': time_limit_per_game,
+        'total_time_limit': total_time_limit,
+        'current_game': None,
+        'games_analyzed': 0,
+        'games_skipped': 0,
+        'positions_analyzed': 0,
+        'elapsed_seconds': 0.0,
+        'commits': 0,
+        'commit_seconds': 0.0
+    })
+    carried = {key: progress.get(key, 0) for key in ('current', 'games_analyzed', 'games_skipped', 'positions_analyzed')}
+    slice_start = time.monotonic()
+
+    def on_progress(data):
+        progress.update(data)
+        for key, value in carried.items():
+            progress[key] = value + data.get(key, 0)
+        progress['total'] = carried['current'] + data.get('total', 0)
+        elapsed = progress['elapsed_seconds'] + time.monotonic() - slice_start
+        if progress['positions_analyzed'] and elapsed > 0:
+            progress['positions_per_second'] = round(progress['positions_analyzed'] / elapsed, 1)
+        if progress.get('avg_game_seconds'):
+            progress['eta_seconds'] = round(progress['avg_game_seconds'] * (progress['total'] - progress['current']))
+
+    remaining_time = None
+    if total_time_limit:
+        remaining_time = total_time_limit - progress['elapsed_seconds']
+
+    result = None
+    if remaining_time is None or remaining_time > 0:
+        resume_after = progress.get('resume_after')
+        if resume_after:
+            resume_after = (datetime.fromisoformat(resume_after[0]), resume_after[1])
+        tracker = BlunderTracker(progress_callback=on_progress)
+        if not progress.get('backfilled'):
+            # Older analyses predate the position index and opening tree; fill them in a little per job
+            tracker.backfill_position_hashes(job.username)
+            tracker.backfill_opening_tree(job.username)
+            progress['backfilled'] = True
+        result = asyncio.run(tracker.analyze_games(
+            job.username,
+            time_limit_per_game_seconds=time_limit_per_game,
+            total_time_limit_seconds=remaining_time,
+            max_games=ANALYSIS_SLICE_GAMES,
+            resume_after=resume_after,
+            cancel_token=cancel_token,
+            resume_game=progress.get('partial_game'),
+            quality=quality,
+            provisional_only=params.get('provisional_only', False)
+        ))
+
+        on_progress({key: result[key] for key in ('games_analyzed', 'games_skipped', 'positions_analyzed')} | {
+            'current': result['games_analyzed'] + result['games_skipped'],
+            'total': result['games_analyzed'] + result['games_skipped'] + result['games_remaining'],
+            'current_game': None
+        })
+        progress['elapsed_seconds'] += time.monotonic() - slice_start
+        progress['commits'] += result.get('commits', 0)
+        progress['commit_seconds'] += result.get('commit_seconds', 0)
+        if progress['current']:
+            progress['avg_game_seconds'] = round(progress['elapsed_seconds'] / progress['current'], 2)
+        if result['resume_after']:
+            played_at, game_id = result['resume_after']
+            progress['resume_after'] = [played_at.isoformat(), game_id]
+        progress['partial_game'] = result['partial_game']
+
+        if result['cancelled'] == 'preempted':
+            return Requeue(progress)
+        if result['cancelled']:
+            return Cancelled({
+                'result': f'Analysis stopped for {job.username} ({result["cancelled"]}): '
+                          f'{progress["games_analyzed"]} games analyzed, {progress["games_skipped"]} skipped',
+                'commits': progress['commits'],
+                'commit_seconds': round(progress['commit_seconds'], 3)
+            })
+
+        out_of_time = total_time_limit and progress['elapsed_seconds'] >= total_time_limit
+        made_progress = result['games_analyzed'] + result['games_skipped'] > 0
+        if result['games_remaining'] > 0 and made_progress and not out_of_time:
+            return Requeue(progress)
+
+    return {
+        'result': f'Analysis completed for {job.username}: {progress["games_analyzed"]} games analyzed, {progress["games_skipped"]} skipped',
+        'commits': progress['commits'],
+        'commit_seconds': round(progress['commit_seconds'], 3),
+        'deepen': quality == QUALITY_QUICK and progress['games_analyzed'] > 0
+    }
+
+class Requeue:
+    """Returned by a job runner that finished a slice and has more work to do"""
+
+    def __init__(self, progress: dict):
+        self.progress = progress
+
+class Cancelled:
+    """Returned by a job runner that stopped on a cancellation request"""
+
+    def __init__(self, result: dict):
+        self.result = result
+
+def enqueue_deepening(job_queue: JobQueue, job, params: dict):
+    """Queue the full-depth pass over games a quick sweep just analyzed"""
+    deepen = job_queue.enqueue_exclusive(job.username, 'analyze', {
+        'time_limit_per_game': params.get('time_limit_per_game', 20),
+        'quality': 'full',
+        'provisional_only': True
+    }, priority=BACKGROUND_PRIORITY)
+    if deepen is not None:
+        print(f"[INFO] Queued background deepening job {deepen.id} for {job.username}")
+
+JOB_RUNNERS = {
+    'fetch': run_fetch_job,
+    'analyze': run_analyze_job,
+}
+
+class Worker:
+    """Claims jobs one at a time and keeps their lease alive while they run"""
+
+    def __init__(self, job_queue: JobQueue, kinds=JOB_KINDS, worker_id=None,
+                 poll_interval: float = POLL_INTERVAL_SECONDS):
+        self.job_queue = job_queue
+        self.kinds = tuple(kinds)
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+
+    def run_forever(self):
+        """Drain the queue until stop() is called"""
+        if self.worker_id is None:
+            self.worker_id = default_worker_id()
+        print(f"[INFO] Worker {self.worker_id} waiting for {', '.join(self.kinds)} jobs")
+        while not self.stop_event.is_set():
+            if not self.run_once():
+                self.stop_event.wait(self.poll_interval)
+
+    def run_once(self) -> bool:
+        """Claim and run a single job; False when the queue had nothing for us"""
+        job = self.job_queue.claim(self.worker_id, self.kinds)
+        if job is None:
+            return False
+
+        print(f"[INFO] Worker {self.worker_id} running {job.kind} job {job.id} for {job.username} (attempt {job.attempts})")
+        progress = {}
+        cancel_token = CancellationToken()
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, progress, done, cancel_token), daemon=True)
+        heartbeat.start()
+        try:
+            params = job.to_dict()['params']
+            result = JOB_RUNNERS[job.kind](job, params, progress, cancel_token)
+            done.set()
+            heartbeat.join()
+            if isinstance(result, Requeue):
+                finished = self.job_queue.requeue(job, result.progress)
+                outcome = 'requeued'
+            elif isinstance(result, Cancelled):
+                finished = self.job_queue.cancelled(job, result.result)
+                outcome = 'cancelled'
+            else:
+                finished = self.job_queue.complete(job, result)
+                outcome = 'succeeded'
+                if finished and result.get('deepen'):
+                    enqueue_deepening(self.job_queue, job, params)
+            metrics.JOBS_FINISHED.inc(kind=job.kind, outcome=outcome if finished else 'lease_lost')
+            if not finished:
+                print(f"[WARN] Job {job.id} finished after its lease was taken over; result discarded")
+        except Exception as e:
+            done.set()
+            heartbeat.join()
+            traceback.print_exc()
+            self.job_queue.fail(job, str(e))
+            metrics.JOBS_FINISHED.inc(kind=job.kind, outcome='failed')
+        return True
+
+    def _heartbeat(self, job, progress, done, cancel_token):
+        """Renew the job's lease, publish its progress and relay stop requests until it finishes"""
+        interval = max(1.0, min(5.0, self.job_queue.lease_seconds / 4))
+        started = time.monotonic()
+        while not done.wait(interval):
+            if not self.job_queue.heartbeat(job, dict(progress)):
+                # Another worker owns the job now; stop duplicating its work
+                print(f"[WARN] Lost the lease on job {job.id}")
+                cancel_token.cancel('preempted')
+                return
+            
+            reason = self.job_queue.cancel_reason(job)
+            if reason:
+                cancel_token.cancel(reason)
+            elif (job.kind == 'analyze' and time.monotonic() - started > ANALYSIS_QUANTUM_SECONDS
+                  and self.job_queue.has_waiting(job.kind, job.priority or 0, job)):
+                # Someone is waiting for an engine: yield at the next ply boundary
+                cancel_token.cancel('preempted')
+
+    def stop(self):
+        """Finish the current job, then exit the loop"""
+        self.stop_event.set()
+
+def start_worker_threads(job_queue: JobQueue, kinds=JOB_KINDS, count: int = 1) -> list:
+    """Run workers as daemon threads inside another process (e.g. the web server)"""
+    workers = []
+    for i in range(count):
+        worker = Worker(job_queue, kinds)
+        thread = threading.Thread(target=worker.run_forever, name=f"worker-{'-'.join(kinds)}-{i}", daemon=True)
+        thread.start()
+        workers.append(worker)
+    return workers
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Chess Blunder Tracker jobs from the queue")
+    parser.add_argument('--kinds', default=','.join(JOB_KINDS), help="Comma-separated job kinds to take")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL_SECONDS)
+    parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics for this worker on this port")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    kinds = [kind.strip() for kind in args.kinds.split(',') if kind.strip()]
+    if PREWARM_DISCOVERY and 'analyze' in kinds:
+        prewarm_discovery()
+    worker = Worker(JobQueue(), kinds, poll_interval=args.poll_interval)
+
+    # Let the current job finish on SIGTERM/SIGINT; its lease covers a hard kill
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+
+    if args.once:
+        worker.worker_id = default_worker_id()
+        while worker.run_once() and not worker.stop_event.is_set():
+            pass
+    else:
+        worker.run_forever()
+
+if __name__ == "__main__":
+    main()
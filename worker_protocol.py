@@ -0,0 +1,243 @@
+"""
+Server side of the HTTP protocol used by remote analysis workers
+
+Remote workers (remote_worker.py) run GameAnalyzer against their own Stockfish
+and have no access to the data directory. They pull work through three calls:
+
+    POST /api/worker/claim      lease an analyze job and receive a batch of its games
+    POST /api/worker/heartbeat  renew the lease; the reply says whether to stop
+    POST /api/worker/submit     send finished games' evaluations; done=true ends the claim
+
+A claim is an ordinary job-queue lease, so when a worker dies its heartbeats
+stop, the lease expires and the job (less the games already submitted) is
+claimed again by the next worker, local or remote.
+"""
+
+import os
+from datetime import datetime, UTC
+from typing import Optional
+
+from database_multiuser import Game, QUALITY_LEVELS, QUALITY_QUICK, WriteBatcher
+from job_queue import JobQueue
+from scheduler import ANALYSIS_QUANTUM_SECONDS, ANALYSIS_SLICE_GAMES
+import metrics
+
+# main, worker and game_analyzer (and with them python-chess and its engine
+# module) are imported on the first call, so importing app.py stays fast
+
+# Shared secret sent as "Authorization: Bearer <token>"; the endpoints are off without it
+WORKER_TOKEN = os.environ.get('BLUNDER_WORKER_TOKEN', '')
+
+# Most games handed out per claim
+REMOTE_BATCH_GAMES = int(os.environ.get('BLUNDER_REMOTE_BATCH_GAMES', ANALYSIS_SLICE_GAMES))
+
+class ProtocolError(Exception):
+    """A worker request that cannot be served; status is the HTTP status to reply with"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+def check_token(authorization: Optional[str]):
+    """Reject requests without the configured worker token"""
+    if not WORKER_TOKEN:
+        raise ProtocolError('Remote workers are disabled (set BLUNDER_WORKER_TOKEN)', 404)
+    if authorization != f'Bearer {WORKER_TOKEN}':
+        raise ProtocolError('Invalid worker token', 401)
+
+def _clean_evaluations(move_evaluations) -> list:
+    """Validate a submitted game's move evaluations"""
+    if not isinstance(move_evaluations, list):
+        raise ProtocolError('move_evaluations must be a list')
+    cleaned = []
+    for move_eval in move_evaluations:
+        try:
+            cleaned.append({
+                'move_number': int(move_eval['move_number']),
+                'move_san': str(move_eval['move_san']),
+                'centipawn_loss': int(move_eval['centipawn_loss']) if move_eval.get('centipawn_loss') is not None else None,
+                'position_hash': int(move_eval['position_hash']) if move_eval.get('position_hash') is not None else None,
+                'best_move': str(move_eval['best_move']) if move_eval.get('best_move') else None,
+            })
+        except (KeyError, TypeError, ValueError) as e:
+            raise ProtocolError(f'Invalid move evaluation: {e}')
+    return cleaned
+
+def _resume_after(progress: Optional[dict]):
+    """The (played_at, id) keyset position a job has worked through, or None"""
+    resume_after = (progress or {}).get('resume_after')
+    if resume_after:
+        return datetime.fromisoformat(resume_after[0]), resume_after[1]
+    return None
+
+class RemoteWorkerServer:
+    """Hands out analyze jobs to remote workers and merges their results"""
+
+    def __init__(self, job_queue: JobQueue, db_manager):
+        self.job_queue = job_queue
+        self.db_manager = db_manager
+
+    def _claimed(self, job_id, claim_token):
+        job = self.job_queue.get_claimed(job_id, claim_token)
+        if job is None:
+            raise ProtocolError('Lease lost; the job was reassigned', 409)
+        return job
+
+    def claim(self, worker_id: str, max_games: Optional[int] = None) -> Optional[dict]:
+        """Lease the next analyze job and return a batch of its games; None when there is no work"""
+        from game_analyzer import FULL_DEPTH, QUICK_DEPTH
+        from main import backlog_query
+        max_games = max(1, min(max_games or REMOTE_BATCH_GAMES, REMOTE_BATCH_GAMES))
+        while True:
+            job = self.job_queue.claim(worker_id, ('analyze',))
+            if job is None:
+                return None
+            params = job.to_dict()['params']
+            quality = QUALITY_LEVELS[params.get('quality', 'full')]
+            db = self.db_manager.get_db(job.username)
+            try:
+                # Games this job already had back (including failed ones) are not handed out again
+                backlog = backlog_query(db, job.username, quality, params.get('provisional_only', False),
+                                        _resume_after(job.to_dict()['progress']))
+                remaining = backlog.count()
+                games = backlog.limit(max_games).all()
+            finally:
+                db.close()
+            if games:
+                break
+            # Nothing left to analyze: finish this job and look for another
+            self._finish(job, params, quality, job.to_dict()['progress'], remaining=0)
+
+        progress = job.to_dict()['progress'] or {
+            'stage': 'analyzing',
+            'current': 0,
+            'start_time': datetime.now(UTC).isoformat(),
+            'time_limit_per_game': params.get('time_limit_per_game', 20),
+            'total_time_limit': params.get('total_time_limit'),
+            'games_analyzed': 0,
+            'games_skipped': 0,
+            'positions_analyzed': 0,
+            # Kept so a local worker can pick the job up where this one left it
+            'elapsed_seconds': 0.0,
+            'commits': 0,
+            'commit_seconds': 0.0
+        }
+        progress.update({'total': progress['current'] + remaining, 'current_game': None,
+                         'worker_id': worker_id, 'claim_processed': 0})
+        self.job_queue.heartbeat(job, progress)
+        partial = progress.get('partial_game')
+        return {
+            'job_id': job.id,
+            'claim_token': job.claim_token,
+            'username': job.username,
+            'lease_seconds': self.job_queue.lease_seconds,
+            'time_limit_per_game': params.get('time_limit_per_game', 20),
+            'depth': QUICK_DEPTH if quality == QUALITY_QUICK else FULL_DEPTH,
+            'games': [{
+                'lichess_id': game.lichess_id,
+                'pgn': game.pgn,
+                'user_color': game.user_color,
+                # A game preempted mid-way continues from the evaluations made so far
+                'resume': partial if partial and partial.get('lichess_id') == game.lichess_id else None,
+            } for game in games],
+        }
+
+    def heartbeat(self, job_id: int, claim_token: str, current_game: Optional[str] = None) -> dict:
+        """Renew a lease; 'stop' carries a cancellation or preemption reason"""
+        job = self._claimed(job_id, claim_token)
+        progress = job.to_dict()['progress']
+        progress['current_game'] = current_game
+        if not self.job_queue.heartbeat(job, progress):
+            raise ProtocolError('Lease lost; the job was reassigned', 409)
+        stop = self.job_queue.cancel_reason(job)
+        running_seconds = (datetime.now(UTC).replace(tzinfo=None) - job.started_at).total_seconds()
+        if not stop and running_seconds > ANALYSIS_QUANTUM_SECONDS and self.job_queue.has_waiting(job.kind, job.priority or 0, job):
+            stop = 'preempted'
+        return {'stop': stop}
+
+    def submit(self, job_id: int, claim_token: str, results: list, done: bool = False,
+               stopped: Optional[str] = None, partial_game: Optional[dict] = None) -> dict:
+        """Merge finished games into the user's database; done=True releases the job"""
+        from main import stage_analysis
+        job = self._claimed(job_id, claim_token)
+        params = job.to_dict()['params']
+        quality = QUALITY_LEVELS[params.get('quality', 'full')]
+        progress = job.to_dict()['progress']
+
+        cleaned = []
+        for result in results or []:
+            if not isinstance(result, dict) or not result.get('lichess_id'):
+                raise ProtocolError('Each result needs a lichess_id')
+            cleaned.append((str(result['lichess_id']), bool(result.get('success')),
+                            _clean_evaluations(result.get('move_evaluations', []))))
+
+        merged = 0
+        resume_after = _resume_after(progress)
+        if cleaned:
+            db = self.db_manager.get_db(job.username)
+            batcher = WriteBatcher(db, max_games=len(cleaned))
+            try:
+                games = {game.lichess_id: game for game in db.query(Game).filter(
+                    Game.username == job.username, Game.lichess_id.in_([lichess_id for lichess_id, _, _ in cleaned])
+                )}
+                for lichess_id, success, move_evaluations in cleaned:
+                    game = games.get(lichess_id)
+                    if game is None:
+                        continue
+                    # The backlog is handed out newest first; later claims start after the oldest game returned
+                    if resume_after is None or (game.played_at, game.id) < resume_after:
+                        resume_after = (game.played_at, game.id)
+                    # A game submitted twice (e.g. by a worker that lost its lease) is merged once
+                    if game.fully_analyzed and (game.analysis_quality or 0) >= quality:
+                        continue
+                    outcome = stage_analysis(batcher, game, success, move_evaluations, quality, datetime.now(UTC))
+                    progress['games_analyzed' if outcome == 'analyzed' else 'games_skipped'] += 1
+                    progress['positions_analyzed'] += 2 * len(move_evaluations)
+                    progress['current'] += 1
+                    progress['claim_processed'] = progress.get('claim_processed', 0) + 1
+                    merged += 1
+            finally:
+                batcher.flush()
+                db.close()
+        if resume_after:
+            progress['resume_after'] = [resume_after[0].isoformat(), resume_after[1]]
+
+        if not done:
+            if not self.job_queue.heartbeat(job, progress):
+                raise ProtocolError('Lease lost; the job was reassigned', 409)
+            return {'merged': merged}
+        # Only a game stopped mid-way in this claim is resumed by the next one
+        progress['partial_game'] = partial_game
+        return {'merged': merged, 'state': self._finish(job, params, quality, progress, stopped=stopped)}
+
+    def _finish(self, job, params: dict, quality: int, progress: dict, stopped: Optional[str] = None,
+                remaining: Optional[int] = None) -> str:
+        """Requeue, cancel or complete a claimed job, as a local worker would"""
+        from main import backlog_query
+        from worker import enqueue_deepening
+        summary = (f'{progress.get("games_analyzed", 0)} games analyzed, '
+                   f'{progress.get("games_skipped", 0)} skipped')
+        if remaining is None:
+            db = self.db_manager.get_db(job.username)
+            try:
+                remaining = backlog_query(db, job.username, quality, params.get('provisional_only', False),
+                                          _resume_after(progress)).count()
+            finally:
+                db.close()
+
+        if stopped == 'preempted' or (not stopped and remaining and progress.get('claim_processed')):
+            finished, outcome = self.job_queue.requeue(job, progress), 'requeued'
+        elif stopped:
+            finished, outcome = self.job_queue.cancelled(job, {
+                'result': f'Analysis stopped for {job.username} ({stopped}): {summary}'
+            }), 'cancelled'
+        else:
+            finished, outcome = self.job_queue.complete(job, {
+                'result': f'Analysis completed for {job.username}: {summary}'
+            }), 'succeeded'
+            if finished and quality == QUALITY_QUICK and progress.get('games_analyzed'):
+                enqueue_deepening(self.job_queue, job, params)
+        metrics.JOBS_FINISHED.inc(kind=job.kind, outcome=outcome if finished else 'lease_lost')
+        if not finished:
+            raise ProtocolError('Lease lost; the job was reassigned', 409)
+        return outcome